@@ -10,7 +10,9 @@ Redefinition of the ase.Atoms class to:
 - add constraints when summing two Atoms objects.
 '''
 
+import numpy as np
 from ase import Atoms, Atom
+from ase.data import chemical_symbols
 from ase.constraints import FixAtoms, FixCartesian, FixScaled
 
 
@@ -28,20 +30,42 @@ class AtomsCustom(Atoms):
     def custom_labels(self):
         """Get custom_labels."""
 
-        symbols = self.get_chemical_symbols()
+        labels, label_indices = self.get_custom_labels_table()
+        return [labels[i] for i in label_indices.tolist()]
+
+
+    def get_custom_labels_table(self) -> tuple:
+        """
+        Get the distinct custom labels, and the index of the label of each atom,
+        without building a label for each atom.
+
+        Returns
+        -------
+        labels : list[str]
+            Distinct custom labels.
+        label_indices : np.ndarray
+            Index in labels of the label of each atom.
+        """
+
+        numbers = self.get_atomic_numbers()
         tags = self.get_tags()
 
         if tags.any(): # if not all zero (default)
-            custom_labels = []
-            for symbol, tag in zip(self.get_chemical_symbols(), self.get_tags()):
-                if tag != -1:
-                    custom_labels.append(f"{symbol}{tag}")
-                else:
-                    custom_labels.append(symbol)
+            # single integer key for each (number, tag) pair, faster than unique rows
+            nelements = len(chemical_symbols)
+            keys, label_indices = np.unique((tags.astype(np.int64) - tags.min()) * nelements
+                                            + numbers, return_inverse=True)
+            labels = []
+            for key in keys.tolist():
+                number = key % nelements
+                tag = key // nelements + tags.min()
+                labels.append(chemical_symbols[number] if tag == -1
+                              else f"{chemical_symbols[number]}{tag}")
         else:
-            custom_labels = symbols
+            keys, label_indices = np.unique(numbers, return_inverse=True)
+            labels = [chemical_symbols[number] for number in keys.tolist()]
 
-        return custom_labels
+        return labels, label_indices.ravel()
 
 
     @custom_labels.setter
@@ -13,7 +13,6 @@ import sys
 
 import numpy as np
 import ase.io.pov
-from ase import Atoms
 from ase.constraints import FixAtoms
 from ase.io.pov import pa, pc
 
@@ -28,8 +27,15 @@ def POVRAYInit(self, cell, cell_vertices, positions, diameters, colors,
                  depth_cueing=False, cue_density=5e-3, constant_fog_height=0.0,
                  celllinewidth=0.05, bondlinewidth=0.10, bondatoms=[],
                  exportconstraints=False,
-                 arrows=None):
-    """ Mod to ase.io.pov.POVRAY.__init__ with arrows """
+                 arrows=None, compact=False, styles=None, supercell=None, instanced=None):
+    """
+    Mod to ase.io.pov.POVRAY.__init__ with arrows, compact scenes, atom styles
+    and instanced supercells.
+
+    With supercell = (nx, ny, nz), cell and cell_vertices are those of the supercell,
+    and the atoms (those in the instanced mask, or all of them) and their bonds are
+    drawn as translated instances of the unit cell, instead of being replicated.
+    """
 
     # attributes from initialization
     self.area_light = area_light
@@ -57,6 +63,8 @@ def POVRAYInit(self, cell, cell_vertices, positions, diameters, colors,
     self.cell = cell
     self.diameters = diameters
     self.arrows = arrows #### CUSTOM
+    self.compact = compact #### CUSTOM
+    self.styles = styles #### CUSTOM
 
     # calculations based on passed inputs
 
@@ -64,7 +72,24 @@ def POVRAYInit(self, cell, cell_vertices, positions, diameters, colors,
     #of the atoms, so when calculating z0 the offset is wrong
     positions = positions[:len(diameters)] #### CUSTOM
 
-    z0 = positions[:, 2].max()
+    #### BEGIN CUSTOM: instanced supercell
+    self.supercell = tuple(supercell) if supercell is not None else None
+    if self.supercell is not None:
+        self.cell = cell = cell / np.asarray(self.supercell)[:, None] # unit cell
+        if instanced is None:
+            instanced = np.ones(len(positions), dtype=bool)
+        self.instanced = np.asarray(instanced, dtype=bool)[:len(positions)]
+        self.translations = np.indices(self.supercell).reshape(3, -1).T @ cell
+
+        # front-most atom among all the replicas
+        z0 = max(positions[self.instanced, 2].max(initial=-np.inf)
+                 + self.translations[:, 2].max(),
+                 positions[~self.instanced, 2].max(initial=-np.inf))
+    else:
+        self.instanced = None
+        self.translations = None
+        z0 = positions[:, 2].max()
+    #### END CUSTOM
     self.offset = (image_width / 2, image_height / 2, z0)
     self.positions = positions - self.offset
 
@@ -158,11 +183,341 @@ Max_Image_Buffer_Memory=1024
     return path
 
 
+# Texture names of the atom styles, indexed by the texture id
+TEXTURES = tuple(ase.io.pov.POVRAY.material_styles_dict)
+
+# Per-atom style table, that can be passed to POVRAY as styles instead of
+# colors, diameters, textures and transmittances
+ATOM_STYLE_DTYPE = np.dtype([('color', float, 3),
+                             ('radius', float),
+                             ('texture', np.int16),
+                             ('transmittance', float)])
+
+# Povray array syntax for a 3D vector, equivalent to ase.io.pov.pa
+_PA = '<' + ', '.join(['%6.2f'] * 3) + '>'
+
+# Number of records formatted at once by _write_records
+_CHUNK_SIZE = 10000
+
+
+def _color_fields(colors) -> tuple:
+    """
+    Template and values to format the colors in bulk, with the same output as pc().
+
+    Returns
+    -------
+    template : str
+        Printf-style template for one color.
+    fields : np.ndarray
+        (N, k) object array with the k values to be formatted for each color.
+    """
+
+    try:
+        values = np.asarray(colors, dtype=float)
+    except (TypeError, ValueError):
+        values = None
+
+    if values is not None and values.ndim == 2 and 3 <= values.shape[1] <= 5:
+        kind = {3: 'rgb', 4: 'rgbt', 5: 'rgbft'}[values.shape[1]]
+        template = f"{kind} <{', '.join(['%.2f'] * values.shape[1])}>"
+        return template, values.astype(object)
+
+    # named colors, grey scale or mixed formats: fall back to pc()
+    fields = np.empty((len(colors), 1), dtype=object)
+    fields[:, 0] = [pc(c) for c in colors]
+    return '%s', fields
+
+
+def _record_fields(columns : tuple, start : int, stop : int) -> tuple:
+    """
+    Values of the records from start to stop, flattened in the order
+    in which they fill the fields of the record templates.
+    """
+
+    fields = np.concatenate([np.asarray(col[start:stop], dtype=object).reshape(stop-start, -1)
+                             for col in columns], axis=1)
+    return tuple(fields.ravel().tolist())
+
+
+def _write_records(fd, template : str, columns : tuple, chunk_size : int = _CHUNK_SIZE) -> int:
+    """
+    Write one record per row of columns, formatting all the rows of a chunk
+    with a single string formatting operation.
+
+    Parameters
+    ----------
+    fd : file object
+        File to write to.
+    template : str
+        Printf-style template of one record.
+    columns : tuple
+        Arrays with the same number of rows, whose values (all those of the
+        same row, in order) fill the fields of the template.
+    chunk_size : int
+        Number of records formatted and written at once.
+
+    Returns
+    -------
+    int
+        Number of records written.
+    """
+
+    nrecords = len(columns[0])
+    for start in range(0, nrecords, chunk_size):
+        stop = min(start + chunk_size, nrecords)
+        fd.write((template * (stop - start)) % _record_fields(columns, start, stop))
+
+    return nrecords
+
+
+def _format_lines(template : str, columns : tuple) -> np.ndarray:
+    """
+    Format one string per row of columns (see _write_records).
+    """
+
+    nrecords = len(columns[0])
+    text = ((template + '\n') * nrecords) % _record_fields(columns, 0, nrecords)
+    return np.array(text.split('\n')[:-1], dtype=object)
+
+
+def _parse_bondatoms(bondatoms, bondlinewidth : float) -> tuple:
+    """
+    Convert the list of bond pairs to arrays. Each pair can have from 2 to 5
+    components: a, b, offset, bond_order, bond_offset
+    a, b: atom index to draw bond
+    offset: original meaning to make offset for mid-point.
+    bond_oder: if not supplied, set it to 1 (single bond).
+               It can be  1, 2, 3, corresponding to single,
+               double, triple bond
+    bond_offset: displacement from original bond position.
+                 Default is (bondlinewidth, bondlinewidth, 0)
+                 for bond_order > 1.
+
+    Returns
+    -------
+    tuple
+        Arrays a (N,), b (N,), offset (N, 3), bond_order (N,), bond_offset (N, 3)
+    """
+
+    nbonds = len(bondatoms) if bondatoms is not None else 0
+    bond_a = np.empty(nbonds, dtype=int)
+    bond_b = np.empty(nbonds, dtype=int)
+    offsets = np.zeros((nbonds, 3))
+    bond_orders = np.ones(nbonds, dtype=int)
+    bond_offsets = np.zeros((nbonds, 3))
+
+    for i, pair in enumerate(bondatoms if bondatoms is not None else []):
+        if len(pair) == 2:
+            a, b = pair
+            offset = (0, 0, 0)
+            bond_order = 1
+            bond_offset = (0, 0, 0)
+        elif len(pair) == 3:
+            a, b, offset = pair
+            bond_order = 1
+            bond_offset = (0, 0, 0)
+        elif len(pair) == 4:
+            a, b, offset, bond_order = pair
+            bond_offset = (bondlinewidth, bondlinewidth, 0)
+        elif len(pair) > 4:
+            a, b, offset, bond_order, bond_offset = pair
+        else:
+            raise RuntimeError('Each list in bondatom must have at least '
+                                '2 entries. Error at %s' % pair)
+
+        if len(offset) != 3:
+            raise ValueError('offset must have 3 elements. '
+                                'Error at %s' % pair)
+        if len(bond_offset) != 3:
+            raise ValueError('bond_offset must have 3 elements. '
+                                'Error at %s' % pair)
+        if bond_order not in [0, 1, 2, 3]:
+            raise ValueError('bond_order must be either 0, 1, 2, or 3. '
+                                'Error at %s' % pair)
+
+        bond_a[i] = a
+        bond_b[i] = b
+        offsets[i] = offset
+        bond_orders[i] = bond_order
+        bond_offsets[i] = bond_offset
+
+    return bond_a, bond_b, offsets, bond_orders, bond_offsets
+
+
+def _perpendicular_bond_offsets(bond_vectors : np.ndarray, bond_offsets : np.ndarray) -> np.ndarray:
+    """
+    Rotate the offsets of multiple bonds in the plane that each one forms with
+    its bond, so that it becomes perpendicular to the bond, keeping its length.
+    Vectorized equivalent of the original ase approach, which built an Atoms('H3')
+    with a, b, b + bond_offset for each bond and called set_angle(0, 1, 2, 90).
+
+    Parameters
+    ----------
+    bond_vectors : np.ndarray
+        (N, 3) vectors along the bonds.
+    bond_offsets : np.ndarray
+        (N, 3) bond offsets, with non-zero length.
+
+    Returns
+    -------
+    np.ndarray
+        (N, 3) rotated bond offsets.
+    """
+
+    directions = bond_vectors / np.linalg.norm(bond_vectors, axis=1)[:, None]
+    perpendicular = bond_offsets - np.einsum('ij,ij->i', bond_offsets, directions)[:, None] \
+                                   * directions
+    lengths = np.linalg.norm(bond_offsets, axis=1)
+    perpendicular_lengths = np.linalg.norm(perpendicular, axis=1)
+
+    # offsets parallel to the bond do not define a plane: use any perpendicular direction
+    parallel = perpendicular_lengths < 1e-9 * lengths
+    if parallel.any():
+        axes = np.eye(3)[np.argmin(np.abs(directions[parallel]), axis=1)]
+        perpendicular[parallel] = np.cross(directions[parallel], axes)
+        perpendicular_lengths[parallel] = np.linalg.norm(perpendicular[parallel], axis=1)
+
+    return perpendicular * (lengths / perpendicular_lengths)[:, None]
+
+
+# Cylinders drawn for each bond order, as (atom side, shift) with side 0 = a, 1 = b,
+# and shift in units of bond_offset.
+# bond_order == 0: No bond is plotted
+# bond_order == 1: one half-cylinder from each atom to the midpoint
+# bond_order == 2: draw two bonds, one is shifted by bond_offset/2,
+#                  and another is shifted by -bond_offset/2.
+# bond_order == 3: draw two bonds, one is shifted by bond_offset,
+#                  and one is shifted by -bond_offset, and the
+#                  other has no shift.
+_BOND_CYLINDERS = {
+    1: ((0, 0), (1, 0)),
+    2: ((0, -0.5), (1, -0.5), (0, 0.5), (1, 0.5)),
+    3: ((0, 0), (1, 0), (0, 1), (1, 1), (0, -1), (1, -1)),
+}
+
+
+def _bond_cylinders(positions, cell, bond_a, bond_b, offsets, bond_orders, bond_offsets) -> tuple:
+    """
+    Compute the half-bond cylinders for all the bonds at once,
+    in the same order as they are drawn bond by bond.
+
+    Returns
+    -------
+    ends : np.ndarray
+        (M, 3) positions of the atom end of each cylinder.
+    mids : np.ndarray
+        (M, 3) positions of the midpoint end of each cylinder.
+    atom_indices : np.ndarray
+        (M,) index of the atom whose color and texture is used for each cylinder.
+    """
+
+    ncylinders = 2 * bond_orders
+    starts = np.cumsum(ncylinders) - ncylinders
+    total = int(ncylinders.sum())
+
+    ends = np.empty((total, 3))
+    mids = np.empty((total, 3))
+    atom_indices = np.empty(total, dtype=int)
+
+    R = offsets @ cell
+    posa = positions[bond_a]
+    posb = positions[bond_b]
+    mida = 0.5 * (posa + posb + R)
+    midb = 0.5 * (posa + posb - R)
+
+    for bond_order, cylinders in _BOND_CYLINDERS.items():
+        mask = bond_orders == bond_order
+        if not mask.any():
+            continue
+        for k, (side, shift) in enumerate(cylinders):
+            rows = starts[mask] + k
+            pos, mid = (posa[mask], mida[mask]) if side == 0 else (posb[mask], midb[mask])
+            if shift > 0:
+                bs = bond_offsets[mask] * shift
+                pos, mid = pos + bs, mid + bs
+            elif shift < 0:
+                bs = bond_offsets[mask] * -shift
+                pos, mid = pos - bs, mid - bs
+            ends[rows] = pos
+            mids[rows] = mid
+            atom_indices[rows] = (bond_a if side == 0 else bond_b)[mask]
+
+    return ends, mids, atom_indices
+
+
+def _compact_records(positions : np.ndarray,
+                     radii : np.ndarray,
+                     color_template : str,
+                     colors : np.ndarray,
+                     transmittances : np.ndarray,
+                     textures : np.ndarray,
+                     offsets : np.ndarray,
+                     bond_orders : np.ndarray,
+                     bond_ends : np.ndarray,
+                     bond_mids : np.ndarray,
+                     bond_atoms : np.ndarray) -> tuple:
+    """
+    Records of a compact scene, where:
+    - one texture is declared for each distinct combination of color,
+      transmittance and finish, and one sphere for each distinct combination
+      of radius and texture (i.e. typically one per element);
+    - atoms are translated instances of the declared spheres;
+    - bonds whose two halves have the same texture, and that do not cross
+      the cell boundary, are drawn as a single cylinder.
+
+    Returns
+    -------
+    declarations : str
+        Declarations of the textures and spheres.
+    atoms_template, atoms_columns, bonds_template, bonds_columns
+        Templates and columns for _write_records.
+    bonds_rows : np.ndarray
+        Index of the (first) half-bond cylinder of each bond record.
+    """
+
+    texture_lines = _format_lines(f'texture{{pigment{{color {color_template} '
+                                  'transmit %s} finish{%s}}',
+                                  (colors, transmittances, textures))
+    texture_defs, texture_ids = np.unique(texture_lines.astype(str), return_inverse=True)
+
+    sphere_lines = _format_lines('%.2f texture{T%d}', (radii, texture_ids))
+    sphere_defs, sphere_ids = np.unique(sphere_lines.astype(str), return_inverse=True)
+
+    declarations = ''.join(f'#declare T{i} = {texture}\n'
+                           for i, texture in enumerate(texture_defs))
+    declarations += ''.join(f'#declare S{i} = sphere{{<0,0,0>, {sphere}}}\n'
+                            for i, sphere in enumerate(sphere_defs))
+
+    atoms_template = f'object{{S%d translate {_PA}}}\n'
+    atoms_columns = (sphere_ids, positions)
+
+    # the half-bond cylinders come in pairs (side a, side b) with the same shift
+    pair_bonds = np.repeat(np.arange(len(bond_orders)), 2 * bond_orders)[0::2]
+    texture_a = texture_ids[bond_atoms[0::2]]
+    texture_b = texture_ids[bond_atoms[1::2]]
+    merge = (texture_a == texture_b) & ~offsets[pair_bonds].any(axis=1)
+
+    ends_a, ends_b = bond_ends[0::2], bond_ends[1::2]
+    mids_a, mids_b = bond_mids[0::2], bond_mids[1::2]
+    bonds_template = f'cylinder {{{_PA}, {_PA}, Rbond texture{{T%d}}}}\n'
+    bonds_columns = (np.concatenate([ends_a[merge], ends_a[~merge], ends_b[~merge]]),
+                     np.concatenate([ends_b[merge], mids_a[~merge], mids_b[~merge]]),
+                     np.concatenate([texture_a[merge], texture_a[~merge], texture_b[~merge]]))
+    rows_a = np.arange(0, len(bond_atoms), 2)
+    bonds_rows = np.concatenate([rows_a[merge], rows_a[~merge], rows_a[~merge] + 1])
+
+    return declarations, atoms_template, atoms_columns, bonds_template, bonds_columns, bonds_rows
+
+
 def write_pov(self, path):
     """
     Custom version of ase.io.pov.write_pov with:
     - arrows
     - type 2 fog for depth cueing
+    - atoms and bonds formatted in bulk with numpy and written in chunks
+    - compact scenes, with shared textures and sphere declarations (if self.compact)
+    - instanced supercells (if self.supercell), with the atoms and bonds of the unit cell
+      declared once as a union, and one translated object for each replica
     """
 
     point_lights = '\n'.join(f"light_source {{{pa(loc)} {pc(rgb)}}}"
@@ -209,173 +564,136 @@ adaptive 1 jitter}}"""
         cell_vertices = cell_vertices.strip('\n')
 
     # Draw atoms
-    a = 0
-    atoms = ''
-    for loc, dia, col in zip(self.positions, self.diameters, self.colors):
-        tex = 'ase3'
-        trans = 0.
+    if self.styles is not None:
+        natoms = min(len(self.positions), len(self.styles))
+        styles = self.styles[:natoms]
+        color_template, colors = _color_fields(styles['color'])
+        radii = styles['radius']
+        textures = np.array(TEXTURES, dtype=object)[styles['texture']]
+        transmittances = styles['transmittance'].astype(object)
+    else:
+        natoms = min(len(self.positions), len(self.diameters), len(self.colors))
+        color_template, colors = _color_fields(self.colors[:natoms])
+        radii = np.asarray(self.diameters[:natoms]) / 2.
         if self.textures is not None:
-            tex = self.textures[a]
+            textures = np.asarray(self.textures[:natoms], dtype=object)
+        else:
+            textures = np.full(natoms, 'ase3', dtype=object)
         if self.transmittances is not None:
-            trans = self.transmittances[a]
-        atoms += f'atom({pa(loc)}, {dia/2.:.2f}, {pc(col)}, '\
-                    f'{trans}, {tex}) // #{a:n}\n'
-        a += 1
-    atoms = atoms.strip('\n')
-
-    # Draw atom bonds
-    bondatoms = ''
-    for pair in self.bondatoms:
-        # Make sure that each pair has 4 componets: a, b, offset,
-        #                                           bond_order, bond_offset
-        # a, b: atom index to draw bond
-        # offset: original meaning to make offset for mid-point.
-        # bond_oder: if not supplied, set it to 1 (single bond).
-        #            It can be  1, 2, 3, corresponding to single,
-        #            double, triple bond
-        # bond_offset: displacement from original bond position.
-        #              Default is (bondlinewidth, bondlinewidth, 0)
-        #              for bond_order > 1.
-        if len(pair) == 2:
-            a, b = pair
-            offset = (0, 0, 0)
-            bond_order = 1
-            bond_offset = (0, 0, 0)
-        elif len(pair) == 3:
-            a, b, offset = pair
-            bond_order = 1
-            bond_offset = (0, 0, 0)
-        elif len(pair) == 4:
-            a, b, offset, bond_order = pair
-            bond_offset = (self.bondlinewidth, self.bondlinewidth, 0)
-        elif len(pair) > 4:
-            a, b, offset, bond_order, bond_offset = pair
+            transmittances = np.asarray(self.transmittances[:natoms], dtype=object)
         else:
-            raise RuntimeError('Each list in bondatom must have at least '
-                                '2 entries. Error at %s' % pair)
-
-        if len(offset) != 3:
-            raise ValueError('offset must have 3 elements. '
-                                'Error at %s' % pair)
-        if len(bond_offset) != 3:
-            raise ValueError('bond_offset must have 3 elements. '
-                                'Error at %s' % pair)
-        if bond_order not in [0, 1, 2, 3]:
-            raise ValueError('bond_order must be either 0, 1, 2, or 3. '
-                                'Error at %s' % pair)
+            transmittances = np.full(natoms, 0., dtype=object)
+    tex = textures[-1] if natoms > 0 else None # used by constraints, as in ase
 
-        # Up to here, we should have all a, b, offset, bond_order,
-        # bond_offset for all bonds.
-
-        # Rotate bond_offset so that its direction is 90 deg. off the bond
-        # Utilize Atoms object to rotate
-        if bond_order > 1 and np.linalg.norm(bond_offset) > 1.e-9:
-            tmp_atoms = Atoms('H3')
-            tmp_atoms.set_cell(self.cell)
-            tmp_atoms.set_positions([
-                self.positions[a],
-                self.positions[b],
-                self.positions[b] + np.array(bond_offset),
-            ])
-            tmp_atoms.center()
-            tmp_atoms.set_angle(0, 1, 2, 90)
-            bond_offset = tmp_atoms[2].position - tmp_atoms[1].position
-
-        R = np.dot(offset, self.cell)
-        mida = 0.5 * (self.positions[a] + self.positions[b] + R)
-        midb = 0.5 * (self.positions[a] + self.positions[b] - R)
-        if self.textures is not None:
-            texa = self.textures[a]
-            texb = self.textures[b]
-        else:
-            texa = texb = 'ase3'
+    atoms_template = f'atom({_PA}, %.2f, {color_template}, %s, %s) // #%d\n'
+    atoms_columns = (self.positions[:natoms],
+                     radii,
+                     colors,
+                     transmittances,
+                     textures,
+                     np.arange(natoms))
 
-        if self.transmittances is not None:
-            transa = self.transmittances[a]
-            transb = self.transmittances[b]
-        else:
-            transa = transb = 0.
-
-        # draw bond, according to its bond_order.
-        # bond_order == 0: No bond is plotted
-        # bond_order == 1: use original code
-        # bond_order == 2: draw two bonds, one is shifted by bond_offset/2,
-        #                  and another is shifted by -bond_offset/2.
-        # bond_order == 3: draw two bonds, one is shifted by bond_offset,
-        #                  and one is shifted by -bond_offset, and the
-        #                  other has no shift.
-        # To shift the bond, add the shift to the first two coordinate in
-        # write statement.
-
-        posa = self.positions[a]
-        posb = self.positions[b]
-        cola = self.colors[a]
-        colb = self.colors[b]
-
-        if bond_order == 1:
-            draw_tuples = (
-                (posa, mida, cola, transa, texa),
-                (posb, midb, colb, transb, texb))
-
-        elif bond_order == 2:
-            bs = [x / 2 for x in bond_offset]
-            draw_tuples = (
-                (posa - bs, mida - bs, cola, transa, texa),
-                (posb - bs, midb - bs, colb, transb, texb),
-                (posa + bs, mida + bs, cola, transa, texa),
-                (posb + bs, midb + bs, colb, transb, texb))
-
-        elif bond_order == 3:
-            bs = bond_offset
-            draw_tuples = (
-                (posa, mida, cola, transa, texa),
-                (posb, midb, colb, transb, texb),
-                (posa + bs, mida + bs, cola, transa, texa),
-                (posb + bs, midb + bs, colb, transb, texb),
-                (posa - bs, mida - bs, cola, transa, texa),
-                (posb - bs, midb - bs, colb, transb, texb))
-
-        bondatoms += ''.join(f'cylinder {{{pa(p)}, '
-                                f'{pa(m)}, Rbond texture{{pigment '
-                                f'{{color {pc(c)} '
-                                f'transmit {tr}}} finish{{{tx}}}}}}}\n'
-                                for p, m, c, tr, tx in
-                                draw_tuples)
-
-    bondatoms = bondatoms.strip('\n')
+    # Draw atom bonds
+    bond_a, bond_b, offsets, bond_orders, bond_offsets = _parse_bondatoms(self.bondatoms,
+                                                                          self.bondlinewidth)
+
+    # Rotate bond_offset so that its direction is 90 deg. off the bond
+    multiple = (bond_orders > 1) & (np.linalg.norm(bond_offsets, axis=1) > 1.e-9)
+    bond_offsets[multiple] = _perpendicular_bond_offsets(
+        self.positions[bond_a[multiple]] - self.positions[bond_b[multiple]],
+        bond_offsets[multiple])
+
+    bond_ends, bond_mids, bond_atoms = _bond_cylinders(self.positions,
+                                                      self.cell,
+                                                      bond_a,
+                                                      bond_b,
+                                                      offsets,
+                                                      bond_orders,
+                                                      bond_offsets)
+
+    # Split the atoms and bonds between the instanced unit cell and those drawn once
+    if self.supercell is not None:
+        instanced = self.instanced[:natoms]
+        cylinder_bonds = np.repeat(np.arange(len(bond_orders)), 2 * bond_orders)
+        bonds_in_cell = instanced[bond_a] & instanced[bond_b]
+        cylinders_in_cell = bonds_in_cell[cylinder_bonds]
+
+        # A bond between an instanced atom and one drawn once (e.g. molecule-slab) is drawn
+        # towards the replica of the instanced atom it points to, wrapped into the supercell,
+        # as if the atoms were replicated. The cylinders alternate between side a and b.
+        replicas_a = np.where((instanced[bond_a] & ~bonds_in_cell)[:, None],
+                              np.mod(-offsets, self.supercell), 0)
+        replicas_b = np.where((instanced[bond_b] & ~bonds_in_cell)[:, None],
+                              np.mod(offsets, self.supercell), 0)
+        side_b = np.arange(len(cylinder_bonds)) % 2 == 1
+        shifts = np.where(side_b[:, None], replicas_b[cylinder_bonds],
+                          replicas_a[cylinder_bonds]) @ self.cell
+        bond_ends = bond_ends + shifts
+        bond_mids = bond_mids + shifts
+
+    bonds_template = f'cylinder {{{_PA}, {_PA}, Rbond texture{{pigment '\
+                     f'{{color {color_template} transmit %s}} finish{{%s}}}}}}\n'
+    bonds_columns = (bond_ends,
+                     bond_mids,
+                     colors[bond_atoms],
+                     transmittances[bond_atoms],
+                     textures[bond_atoms])
+
+    bonds_rows = np.arange(len(bond_atoms))
+
+    declarations = ''
+    if self.compact:
+        declarations, atoms_template, atoms_columns, bonds_template, bonds_columns, bonds_rows = \
+            _compact_records(positions=self.positions[:natoms],
+                             radii=radii,
+                             color_template=color_template,
+                             colors=colors,
+                             transmittances=transmittances,
+                             textures=textures,
+                             offsets=offsets,
+                             bond_orders=bond_orders,
+                             bond_ends=bond_ends,
+                             bond_mids=bond_mids,
+                             bond_atoms=bond_atoms)
 
     # Draw constraints if requested
     constraints = ''
+    constraints_in_cell = ''
     if self.exportconstraints:
         for a in self.constrainatoms:
-            dia = self.diameters[a]
             loc = self.positions[a]
-            trans = 0.0
-            if self.transmittances is not None:
-                trans = self.transmittances[a]
-            constraints += f'constrain({pa(loc)}, {dia / 2.:.2f}, Black, '\
-                f'{trans}, {tex}) // #{a:n} \n'
+            constraint = f'constrain({pa(loc)}, {radii[a]:.2f}, Black, '\
+                f'{transmittances[a]}, {tex}) // #{a:n} \n'
+            if self.supercell is not None and instanced[a]:
+                constraints_in_cell += constraint
+            else:
+                constraints += constraint
     constraints = constraints.strip('\n')
 
     #### BEGIN CUSTOM: handle arrows
     # Draw arrows
     arrows = ''
+    arrows_in_cell = ''
     if self.arrows is not None:
         maxlength = np.max([np.linalg.norm(arrow) for arrow in self.arrows])
-        for pos, arrow, diam in zip(self.positions, self.arrows, self.diameters):
+        for i, (pos, arrow, diam) in enumerate(zip(self.positions, self.arrows, self.diameters)):
             modulus = np.linalg.norm(arrow)
             if modulus/maxlength > 0.1: # skip degenerate primitives
                 cylinder_pos_dw = pos # - 0.8*normalized_arrow
                 cylinder_pos_up = pos + 0.7*arrow
-                arrows += f'cylinder {{{pa(cylinder_pos_dw)}, '+\
+                arrow_str = f'cylinder {{{pa(cylinder_pos_dw)}, '+\
                                         f'{pa(cylinder_pos_up)}, 0.1 texture{{pigment '+\
                                         f'{{color {pc([1,0,0])} '+\
                                         f'transmit 0.0}} finish{{ase3}}}}}}\n'
                 cone_pos = pos + 0.7*arrow
-                arrows += f'cone {{{pa(cone_pos)}, 0.2'+\
+                arrow_str += f'cone {{{pa(cone_pos)}, 0.2'+\
                                         f'{pa(cone_pos + 0.3*arrow/modulus)}, 0.0 texture{{pigment '+\
                                         f'{{color {pc([1,0,0])} '+\
                                         f'transmit 0.0}} finish{{ase3}}}}}}\n'
+                if self.supercell is not None and instanced[i]:
+                    arrows_in_cell += arrow_str
+                else:
+                    arrows += arrow_str
     #### END CUSTOM
 
     pov = f"""#version 3.6;
@@ -405,14 +723,34 @@ union{{torus{{R, Rcell rotate 45*z texture{{pigment{{color COL transmit TRANS}}
 #end
 
 {cell_vertices if cell_vertices != '' else '// no cell vertices'}
-{atoms}
-{bondatoms}
-{constraints if constraints != '' else '// no constraints'}
-{arrows if arrows != '' else '// no arrows'}
 """  # noqa: E501
 
+    # atoms and bonds are formatted and written in chunks, to handle large systems
     with open(path, 'w') as fd:
         fd.write(pov)
+        fd.write(declarations)
+        if self.supercell is not None:
+            # scene of the unit cell, and its translated instances
+            fd.write('#declare UnitCell = union {\n')
+            _write_records(fd, atoms_template, tuple(col[instanced] for col in atoms_columns))
+            in_cell = cylinders_in_cell[bonds_rows]
+            _write_records(fd, bonds_template, tuple(col[in_cell] for col in bonds_columns))
+            fd.write(constraints_in_cell)
+            fd.write(arrows_in_cell)
+            fd.write('}\n')
+            _write_records(fd, f'object{{UnitCell translate {_PA}}}\n', (self.translations,))
+
+            # atoms and bonds drawn once
+            atoms_columns = tuple(col[~instanced] for col in atoms_columns)
+            bonds_columns = tuple(col[~in_cell] for col in bonds_columns)
+
+        if _write_records(fd, atoms_template, atoms_columns) == 0:
+            fd.write('\n')
+        if _write_records(fd, bonds_template, bonds_columns) == 0:
+            fd.write('\n')
+        fd.write(f"""{constraints if constraints != '' else '// no constraints'}
+{arrows if arrows != '' else '// no arrows'}
+""")
 
     return path
 
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Content-hashed caches, used to avoid repeating expensive work
+(e.g. rendering trajectory frames) when the inputs did not change.
+'''
+
+from __future__ import annotations
+
+import os
+import glob
+import hashlib
+import logging
+import dataclasses
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+import atomsplot
+
+if TYPE_CHECKING:
+    from ase import Atoms
+
+logger = logging.getLogger(__name__)
+
+
+def _update_hash(h, obj):
+    """
+    Recursively feed obj to the hash object h.
+    Handles numpy arrays, dataclasses, dicts, lists/tuples and scalars.
+    """
+
+    if isinstance(obj, np.ndarray):
+        h.update(f'ndarray{obj.dtype.str}{obj.shape}'.encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        _update_hash(h, type(obj).__name__)
+        _update_hash(h, {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)})
+    elif isinstance(obj, dict):
+        h.update(b'{')
+        for key in sorted(obj, key=str):
+            _update_hash(h, key)
+            _update_hash(h, obj[key])
+        h.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[')
+        for item in obj:
+            _update_hash(h, item)
+        h.update(b']')
+    else:
+        h.update(f'{type(obj).__name__}:{obj!r};'.encode())
+
+
+def hash_objects(*objs) -> str:
+    """
+    Return a hex digest identifying the content of the given objects.
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+    for obj in objs:
+        _update_hash(h, obj)
+    return h.hexdigest()
+
+
+def hash_atoms(atoms: Atoms) -> str:
+    """
+    Return a hex digest of everything in an Atoms object that can affect
+    its rendering: per-atom arrays (positions, numbers, tags/custom labels...),
+    cell, pbc and the calculator results (forces, magnetic moments...).
+    """
+
+    results = atoms.calc.results if atoms.calc is not None else None
+    return hash_objects(atoms.arrays, atoms.cell.array, atoms.pbc, results)
+
+
+class FrameCache:
+    """
+    Manifest of the frames of a trajectory already rendered in a folder.
+
+    Each frame is identified by a key, which is a hash of the frame content
+    and of all the rendering settings. The manifest is an append-only text
+    file with one 'filename key' line per rendered frame, so that it is
+    always consistent with the images on disk, even if the rendering
+    is interrupted.
+
+    Parameters
+    ----------
+    folder : str
+        Folder where the frames are rendered.
+    settings : tuple
+        All the settings that affect the rendering of the frames
+        (e.g. CustomSettings and the keyword arguments of render_image).
+    """
+
+    MANIFEST = '.frames_cache'
+
+    def __init__(self, folder : str, settings : tuple):
+
+        self.folder = folder
+        self.path = os.path.join(folder, self.MANIFEST)
+        self.settings_key = hash_objects(atomsplot.__version__, settings)
+
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 2:
+                        self.entries[fields[0]] = fields[1]  # last entry wins
+            logger.debug('Read %d entries from %s', len(self.entries), self.path)
+
+
+    def frame_key(self, atoms: Atoms) -> str:
+        """Return the key of a frame, combining its content and the settings."""
+
+        return hash_objects(self.settings_key, hash_atoms(atoms))
+
+
+    def is_valid(self, outfile : str, key : str) -> bool:
+        """Return True if outfile was already rendered with the given key."""
+
+        name = os.path.basename(outfile)
+        return self.entries.get(name) == key and os.path.isfile(outfile)
+
+
+    def add(self, outfile : str, key : str):
+        """Record that outfile was rendered with the given key."""
+
+        name = os.path.basename(outfile)
+        self.entries[name] = key
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(f'{name} {key}\n')
+
+
+def hash_file_sample(path : str, block_size : int = 1 << 20, nblocks : int = 8) -> str:
+    """
+    Return a hex digest of the size of a file and of nblocks evenly spaced blocks
+    of its content (the whole file if smaller), which identifies large files
+    without reading them entirely.
+    """
+
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{size};'.encode())
+    with open(path, 'rb') as f:
+        if size <= block_size * nblocks:
+            h.update(f.read())
+        else:
+            for offset in np.linspace(0, size - block_size, nblocks).astype(int):
+                f.seek(offset)
+                h.update(f.read(block_size))
+    return h.hexdigest()
+
+
+class GridCache:
+    """
+    Binary sidecar cache of a parsed volumetric file (atoms and grid),
+    so that the text is parsed only once, and the following reads are just a
+    memory map of the grid (read-only). The isosurface meshes computed from the
+    grid are cached as well (see load_mesh and save_mesh).
+
+    The cache is stored next to the source file, as a .npy file with the grid
+    and a .npz file with the atoms and the key, which combines the size, mtime
+    and sampled content hash of the source file, and the settings of the parsing.
+    Each mesh is stored in a .mesh-<key>.npz file, with float32 vertices and
+    int32 faces, and the meshes are removed when the grid is cached again.
+    If the folder is not writable, nothing is cached.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the source file.
+    settings : tuple
+        All the settings that affect the grid (e.g. format, upscaling, dtype).
+    """
+
+    SUFFIX = '.atomsplot'
+
+    def __init__(self, filename : str, settings : tuple):
+
+        folder, name = os.path.split(os.path.abspath(filename))
+        self.base = base = os.path.join(folder, f'.{name}{self.SUFFIX}')
+        self.grid_path = base + '.npy'
+        self.meta_path = base + '.npz'
+
+        stat = os.stat(filename)
+        self.key = hash_objects(atomsplot.__version__, settings,
+                                stat.st_size, stat.st_mtime_ns, hash_file_sample(filename))
+
+
+    def load(self) -> tuple | None:
+        """
+        Return (atoms, grid) from the cache, with the grid memory-mapped,
+        or None if the cache is missing or stale.
+        """
+
+        from ase.io.jsonio import decode # pylint: disable=import-outside-toplevel
+
+        try:
+            with np.load(self.meta_path) as meta:
+                if str(meta['key']) != self.key:
+                    logger.debug('Stale grid cache %s', self.meta_path)
+                    return None
+                atoms = decode(str(meta['atoms']))
+                shape = tuple(meta['shape'])
+            grid = np.load(self.grid_path, mmap_mode='r')
+        except (OSError, ValueError, KeyError) as exc:
+            logger.debug('Cannot read grid cache %s: %s', self.meta_path, exc)
+            return None
+
+        if grid.shape != shape:
+            return None
+
+        logger.debug('Loaded grid from cache %s', self.grid_path)
+        return atoms, grid
+
+
+    def save(self, atoms : Atoms, grid : np.ndarray):
+        """
+        Write atoms and grid to the cache, replacing the previous one.
+        """
+
+        from ase.io.jsonio import encode # pylint: disable=import-outside-toplevel
+
+        try:
+            # the metadata is removed first and written last, so that it is
+            # never paired with a grid written for a different key
+            if os.path.exists(self.meta_path):
+                os.remove(self.meta_path)
+            for path in glob.glob(f'{glob.escape(self.base)}.mesh-*.npz'):
+                os.remove(path)
+            tmp = self.grid_path + '.tmp.npy'
+            np.save(tmp, grid)
+            os.replace(tmp, self.grid_path)
+            tmp = self.meta_path + '.tmp.npz'
+            np.savez(tmp, key=self.key, atoms=encode(atoms), shape=grid.shape)
+            os.replace(tmp, self.meta_path)
+        except OSError as exc:
+            logger.warning('Cannot write grid cache next to the source file: %s', exc)
+            return
+
+        logger.debug('Saved grid to cache %s', self.grid_path)
+
+
+    def _mesh_path(self, settings : tuple) -> str:
+        return f'{self.base}.mesh-{hash_objects(self.key, settings)}.npz'
+
+
+    def load_mesh(self, settings : tuple) -> tuple | None:
+        """
+        Return the (verts, faces) of the mesh computed from the cached grid with
+        the given settings (e.g. isovalue and cell), or None if not cached.
+        """
+
+        path = self._mesh_path(settings)
+        try:
+            with np.load(path) as mesh:
+                verts, faces = mesh['verts'], mesh['faces']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        logger.debug('Loaded mesh from cache %s', path)
+        return verts, faces
+
+
+    def save_mesh(self, settings : tuple, verts : np.ndarray, faces : np.ndarray):
+        """
+        Write the mesh computed from the cached grid with the given settings.
+        """
+
+        path = self._mesh_path(settings)
+        try:
+            tmp = path + '.tmp.npz'
+            np.savez(tmp, verts=verts.astype(np.float32, copy=False),
+                     faces=faces.astype(np.int32, copy=False))
+            os.replace(tmp, path)
+        except OSError as exc:
+            logger.warning('Cannot write mesh cache next to the source file: %s', exc)
+            return
+
+        logger.debug('Saved mesh to cache %s', path)
@@ -34,9 +34,14 @@ def main():
                     outfile=args.output,
                     movie=args.movie,
                     framerate=args.framerate,
+                    jobs=args.jobs,
+                    resume=args.resume,
+                    keep_frames=not args.discard_frames,
+                    fit_view=args.fit_view,
                     rotations=args.rotations,
                     supercell=args.supercell,
-                    # repeat_slab=args.repeat_slab,
+                    repeat_slab=args.repeat_slab,
+                    instanced_supercell=args.supercell_instances,
                     # center_molecule=args.center_molecule,
                     wrap=args.wrap,
                     hide_cell=args.hide_cell,
@@ -52,7 +57,12 @@ def main():
                     chg_format=args.chg_format,
                     chg_iso_threshold=args.chg_iso_threshold,
                     chg_upscale=args.chg_upscale,
+                    chg_upscale_local=args.chg_upscale_local,
+                    chg_smooth=args.chg_smooth,
+                    chg_single_precision=args.chg_single_precision,
+                    chg_cache=not args.no_chg_cache,
                     povray=not args.no_povray,
                     width_res=args.width_res,
-                    fixed_bounds=args.fixed_bounds
+                    fixed_bounds=args.fixed_bounds,
+                    compact_pov=args.compact_pov
                 )
@@ -65,10 +65,18 @@ def cli_parse():
                     type=_positive_int,
                     metavar=('nx', 'ny', 'nz'),
                     help="Replicate the cell nx ny nz times along the three cell vectors.")
-    # parser.add_argument('rs', '--repeat-slab',
-    #                     action='store_true',
-    #                     default=False,
-    #                     help='Replicate only the slab, not the molecule.')
+    parser.add_argument('-rs', '--repeat-slab',
+                        action='store_true',
+                        default=False,
+                        help='Replicate only the slab, not the molecule '\
+                            '(mol_indices in image_settings.json). The charge density '\
+                            'isosurfaces are then drawn only in the unit cell.')
+    parser.add_argument('-si', '--supercell-instances',
+                        action='store_true',
+                        default=False,
+                        help='Draw the supercell as instances of the unit cell scene '\
+                            'instead of replicating the atoms (povray only). '\
+                            'Much faster for large supercells.')
     # parser.add_argument('-cmol', '--center-molecule',
     #                     action='store_true',
     #                     default=False,
@@ -129,11 +137,33 @@ def cli_parse():
                     type=str,
                     choices=['cube', 'vasp'],
                     help='''Format of the charge density file.
-                    Options: 'cube' or 'vasp' (CHGCAR/CHG).''')
+                    Options: 'cube' or 'vasp' (CHGCAR/CHG/LOCPOT).''')
     parser.add_argument('-chgu', '--chg-upscale',
                     type=_positive_int,
                     help='''Upscale the charge density grid by this factor.
                     (1 = no upscaling).''')
+    parser.add_argument('-chgul', '--chg-upscale-local',
+                    action='store_true',
+                    default=False,
+                    help='''Apply the upscaling (-chgu) only to the blocks of the grid around
+                    the isosurfaces, while computing them, instead of to the whole grid
+                    (much less memory and time). The default isovalue is then computed
+                    on the original grid.''')
+    parser.add_argument('-chgsm', '--chg-smooth',
+                    type=_positive_int,
+                    help='''Smooth the isosurfaces with this number of iterations of Taubin
+                    smoothing (e.g. 5), and shade them with interpolated normals.
+                    Much cheaper alternative to -chgu.''')
+    parser.add_argument('-chgsp', '--chg-single-precision',
+                    action='store_true',
+                    help='''Keep the charge density grid in single precision (float32),
+                    halving its memory.''')
+    parser.add_argument('-nochgc', '--no-chg-cache',
+                    action='store_true',
+                    default=False,
+                    help='''Do not cache the parsed charge density grid in a binary file
+                    next to the input (.<name>.atomsplot.npy/.npz), which makes the following
+                    renderings of the same file start much faster.''')
     parser.add_argument('-iso', '--chg-iso-threshold',
                     type=_positive_float,
                     help='''Iso-surface threshold for the charge density.
@@ -148,10 +178,32 @@ def cli_parse():
                     action='store_true',
                     default=False,
                     help='Fix the canvas white space to the unit cell. Always true for trajs.')
+    parser.add_argument('-fv', '--fit-view',
+                    type=str,
+                    choices=['cell', 'all'],
+                    default='cell',
+                    help='For trajectories, the camera and canvas are computed once for all '\
+                        'the frames, fitting the cell of the first frame (cell), or the atoms '\
+                        'and cells of all the frames (all, requires an extra pass over the file).')
     parser.add_argument('-nopov','--no-povray',
                     action='store_true',
                     default=False,
                     help='Use povray for rendering (much better quality).')
+    parser.add_argument('-cpov', '--compact-pov',
+                    action='store_true',
+                    default=False,
+                    help='Write compact povray scenes, with shared textures and merged bonds '\
+                        '(smaller files and faster parsing for large systems).')
+    parser.add_argument('-j', '--jobs',
+                    type=_positive_int,
+                    default=1,
+                    help='Number of frames of a trajectory rendered in parallel, '\
+                        'or of processes computing the isosurfaces of a charge density.')
+    parser.add_argument('--resume',
+                    action='store_true',
+                    default=False,
+                    help='Keep the frames already rendered in rendered_frames, and render '\
+                        'only those missing or whose structure or settings changed.')
 
     # movie options
     parser.add_argument('-m','--movie',
@@ -162,6 +214,10 @@ def cli_parse():
                     type=float,
                     default=10.0,
                     help='Framerate of the movie (frames per second).')
+    parser.add_argument('-df', '--discard-frames',
+                    action='store_true',
+                    default=False,
+                    help='Delete the frame images once the movie has been encoded successfully.')
 
 
 
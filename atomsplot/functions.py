@@ -13,42 +13,67 @@ from __future__ import annotations
 
 import os
 import shutil
-import subprocess
 import logging
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from itertools import chain, islice
 
 from tqdm import tqdm
 import numpy as np
-from ase.io import read
+from ase import Atoms
+from ase.io import read, iread
+from ase.io.formats import string2index
 from ase.units import Bohr
 
 from atomsplot import ase_custom # monkey patch. pylint: disable=unused-import
-from atomsplot.render import render_image
+from atomsplot.cache import FrameCache, GridCache
+from atomsplot.movie import MovieEncoder, make_gif
+from atomsplot.neighbors import NeighborsCache
+from atomsplot.render import render_image, get_fixed_view, SlabHeightCache
 from atomsplot.settings import CustomSettings
+from atomsplot.volumetric import read_vasp_volumetric, read_cube_volumetric
 
 logger = logging.getLogger(__name__)
 
+# neighbors and slab height of the last frame rendered by this process, reused for the next ones
+_neighbors_cache = NeighborsCache()
+_slab_height_cache = SlabHeightCache()
+
 
 def _deduce_chg_format(filename: str) -> str | None:
 
     if filename.endswith('.cube'):
         return 'cube'
-    elif filename.startswith('CHG'):
+    elif os.path.basename(filename).startswith(('CHG', 'LOCPOT')):
         return 'vasp'
     else:
         return None
 
-def _read_charge_file(filename, fmt='cube', upscale : int | None =None):
+def _read_charge_file(filename,
+                      fmt='cube',
+                      upscale : int | None =None,
+                      single_precision=False,
+                      cache : GridCache | None = None):
     """
-    Read charge density file (cube of VASP CHGCAR/CHG format).
+    Read charge density file (cube of VASP CHGCAR/CHG/LOCPOT format).
 
     Parameters
     ----------
     filename : str
         Path to the file containing the isosurfaces.
     fmt : str, optional
-        'cube' or VASP CHGCAR/CHG.
+        'cube' or 'vasp' (CHGCAR/CHG/LOCPOT).
     upscale : int, optional
         Upscale factor for the density grid.
+    single_precision : bool, optional
+        If True, the density grid is kept in float32 (half the memory).
+        Default is False (float64).
+    cache : GridCache | None, optional
+        Binary sidecar cache of the file, where the parsed atoms and grid are stored,
+        and read from (memory-mapped, read-only) when the file is read again
+        with the same settings. Default is None (no cache).
 
     Returns
     -------
@@ -58,17 +83,22 @@ def _read_charge_file(filename, fmt='cube', upscale : int | None =None):
         3D numpy array representing the charge density grid.
     """
 
+    if cache is not None:
+        cached = cache.load()
+        if cached is not None:
+            return cached
+
+    dtype = np.float32 if single_precision else float
+
     if fmt == 'cube':
-        data_dict = read(filename, read_data=True, full_output=True)
-        atoms = data_dict["atoms"]
-        density_grid = data_dict["data"]
+        atoms, density_grid = read_cube_volumetric(filename, dtype=dtype)
 
     elif fmt == 'vasp':
-        from ase.calculators.vasp import VaspChargeDensity # pylint: disable=import-outside-toplevel
-        vcd = VaspChargeDensity(filename)
-
-        atoms = vcd.atoms[0]
-        density_grid = np.array(vcd.chg[0]) * (Bohr ** 3) # convert volume in Angstrom^3 to bohr^3
+        atoms, density_grid = read_vasp_volumetric(filename, dtype=dtype)
+        if not os.path.basename(filename).startswith('LOCPOT'):
+            # CHGCAR/CHG contain the density times the cell volume
+            density_grid /= atoms.get_volume()
+            density_grid *= Bohr ** 3 # convert volume in Angstrom^3 to bohr^3
 
         logging.debug('Charge density grid shape: %s', density_grid.shape)
     else:
@@ -82,14 +112,135 @@ def _read_charge_file(filename, fmt='cube', upscale : int | None =None):
         except ImportError:
             logging.error('scipy is not installed. Cannot upscale the charge density grid.')
 
+    if cache is not None:
+        cache.save(atoms, density_grid)
+
     return atoms, density_grid
 
 
+def _init_worker(scratch_root: str):
+    """
+    Initializer for the worker processes of the rendering pool.
+    Each worker moves to its own scratch directory, so that the temporary
+    .pov/.ini/.png files of frames rendered concurrently do not clash.
+    """
+    os.chdir(tempfile.mkdtemp(prefix=f'worker_{os.getpid()}_', dir=scratch_root))
+
+
+def _render_frame(frame : tuple, custom_settings : CustomSettings, **kwargs) -> str:
+    """
+    Render a single frame of a trajectory. Used as the task of the rendering pool.
+
+    Parameters
+    ----------
+    frame : tuple
+        (atoms, outfile) for the frame to be rendered. outfile must be an absolute path.
+        If atoms is None, the frame is already rendered and is not touched.
+    custom_settings : CustomSettings
+        Custom settings for rendering.
+    **kwargs : dict
+        Additional keyword arguments for render_image.
+
+    Returns
+    -------
+    outfile : str
+        Path of the rendered image.
+    """
+
+    atoms, outfile = frame
+    if atoms is None: # already rendered
+        return outfile
+
+    render_image(atoms=atoms,
+                 outfile=outfile,
+                 custom_settings=custom_settings,
+                 neighbors_cache=_neighbors_cache,
+                 slab_height_cache=_slab_height_cache,
+                 **kwargs)
+    return outfile
+
+
+def _imap_ordered(submit, iterable, window : int):
+    """
+    Ordered equivalent of executor.map that submits at most `window` tasks
+    ahead of the last consumed result, instead of consuming the whole iterable
+    at once. This keeps the memory bounded when iterable is a lazy generator.
+    submit is a callable that takes an item and returns a Future.
+    """
+
+    pending = deque()
+    for item in iterable:
+        pending.append(submit(item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _render_frames(frames,
+                   jobs : int,
+                   custom_settings : CustomSettings,
+                   **kwargs):
+    """
+    Render the frames of a trajectory, serially or on a pool of worker processes.
+    This is a generator that yields the path of each rendered frame as soon as
+    it is ready, in the same order as the input frames.
+
+    Parameters
+    ----------
+    frames : Iterable
+        Iterable (can be a generator) of (atoms, outfile) tuples,
+        with absolute paths for outfile. Frames with atoms=None are already
+        rendered, and their outfile is just passed through in order.
+    jobs : int
+        Number of worker processes. If 1, the frames are rendered
+        in the current process and working directory.
+    custom_settings : CustomSettings
+        Custom settings for rendering.
+    **kwargs : dict
+        Additional keyword arguments for render_image.
+    """
+
+    render_frame = partial(_render_frame, custom_settings=custom_settings, **kwargs)
+
+    if jobs == 1:
+        for frame in frames:
+            yield render_frame(frame)
+        logger.debug('Neighbors searched for %d frames, and updated for %d frames',
+                     _neighbors_cache.n_searches, _neighbors_cache.n_updates)
+        logger.debug('Slab height for the fog found for %d frames, and reused for %d frames',
+                     _slab_height_cache.n_searches, _slab_height_cache.n_reuses)
+        return
+
+    scratch_root = os.path.abspath('.scratch')
+    os.makedirs(scratch_root, exist_ok=True)
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_init_worker,
+                                 initargs=(scratch_root,)) as executor:
+
+            def submit(frame):
+                if frame[0] is None: # already rendered, do not occupy a worker
+                    future = Future()
+                    future.set_result(frame[1])
+                    return future
+                return executor.submit(render_frame, frame)
+
+            yield from _imap_ordered(submit, frames, window=2 * jobs)
+    finally:
+        shutil.rmtree(scratch_root, ignore_errors=True)
+
+
 def setup_rendering(filename : str,
                     outfile : str | None = None,
                     index : str = '-1',
                     movie : bool = False,
                     framerate : int = 10,
+                    jobs : int = 1,
+                    resume : bool = False,
+                    keep_frames : bool = True,
+                    fit_view : str = 'cell',
                     **kwargs):
     """
     Setup the rendering of an atomic structure or a trajectory.
@@ -102,11 +253,29 @@ def setup_rendering(filename : str,
         Name of the output file. If not provided, it will be derived from the filename.
     index : str, optional
         Index of the frame to be rendered. Default is '-1' (last frame) for single image,
-        and ':' (all frames) for movie.
+        and ':' (all frames) for movie. For a slice, the frames are read lazily
+        and rendered as soon as they are parsed, so that only a few of them
+        are kept in memory at the same time.
     movie : bool, optional
         If True, generate a movie from the frames. Default is False.
     framerate : int, optional
         Framerate of the movie (frames per second). Default is 10.
+    jobs : int, optional
+        Number of frames of a trajectory rendered in parallel, each one by a
+        separate process, or of processes computing the isosurfaces of a charge
+        density file. Default is 1 (serial rendering).
+    resume : bool, optional
+        If True, keep the existing rendered_frames folder and render only the
+        frames that are missing or whose content or rendering settings changed
+        since they were rendered. Default is False (render all frames from scratch).
+    keep_frames : bool, optional
+        If False, the frame images are deleted once the movie has been encoded
+        successfully. Only used if movie is True. Default is True.
+    fit_view : str, optional
+        How the camera and canvas, shared by all the frames of a trajectory,
+        are computed: 'cell' fits the cell of the first frame, 'all' fits the
+        atoms and cells of all the frames (requires an extra pass over the
+        trajectory). Default is 'cell'.
     **kwargs : dict
         Additional keyword arguments for rendering
     """
@@ -117,69 +286,151 @@ def setup_rendering(filename : str,
     if chg_format is None:
         chg_format = _deduce_chg_format(filename)
 
+    # options of the charge density file, which are not passed to render_image
+    upscale = kwargs.pop('chg_upscale', 1)
+    upscale_local = kwargs.pop('chg_upscale_local', False)
+    single_precision = kwargs.pop('chg_single_precision', False)
+    use_grid_cache = kwargs.pop('chg_cache', True)
 
     if chg_format is not None:
         # read charge density file
+        if upscale_local:
+            # upscaled only around the isosurfaces, while computing them
+            kwargs['chg_local_upscale'] = upscale
+            upscale = None
+        grid_cache = None
+        if use_grid_cache:
+            grid_cache = GridCache(filename, (chg_format, upscale, single_precision))
         atoms, chg_grid = _read_charge_file(filename=filename,
                                     fmt=chg_format,
-                                    upscale=kwargs.pop('chg_upscale', 1))
+                                    upscale=upscale,
+                                    single_precision=single_precision,
+                                    cache=grid_cache)
         kwargs['chg_grid'] = chg_grid
+        kwargs['chg_grid_cache'] = grid_cache
+        kwargs['chg_jobs'] = jobs
     else:
         if index == '-1' and movie: #if we want to render a movie, we need the whole trajectory
             index = ':'
 
-        atoms = read(filename, index=index)
+        if isinstance(string2index(index), slice):
+            # trajectory: stream the frames instead of loading all of them.
+            # The file is opened lazily, after moving to rendered_frames
+            atoms = iread(os.path.abspath(filename), index=index)
+        else:
+            atoms = read(filename, index=index)
 
 
     label = os.path.splitext(outfile if outfile is not None else os.path.basename(filename))[0]
-    logger.info('File was read successfully.')
+    if isinstance(atoms, Atoms):
+        logger.info('File was read successfully.')
 
     # remove None from kwargs
     kwargs = {k: v for k, v in kwargs.items() if v is not None}
 
-    if isinstance(atoms, list): # multiple frames
+    if not isinstance(atoms, Atoms): # multiple frames
 
         kwargs['fixed_bounds'] = True
 
-        if os.path.exists('rendered_frames'):
+        # same camera and canvas for all the frames, computed only once
+        first_frame = next(atoms, None)
+        if first_frame is None:
+            raise ValueError(f'No frames found in {filename} for index {index}.')
+        atoms = chain([first_frame], atoms)
+        view_frames = chain([first_frame],
+                            islice(iread(os.path.abspath(filename), index=index), 1, None))
+        prepare_kwargs = {k: kwargs[k] for k in ('supercell', 'repeat_slab', 'wrap', 'range_cut',
+                                                 'cut_vacuum', 'transl_vector', 'mol_indices')
+                          if k in kwargs}
+        kwargs['fixed_view'] = get_fixed_view(view_frames,
+                                              custom_settings,
+                                              rotations=kwargs.get('rotations', ''),
+                                              fit_to=fit_view,
+                                              **prepare_kwargs)
+
+        if os.path.exists('rendered_frames') and not resume:
             logger.info('Removing old rendered_frames folder...')
             shutil.rmtree('rendered_frames')
-        os.makedirs('rendered_frames')
+        os.makedirs('rendered_frames', exist_ok=True)
         main_dir = os.getcwd()
         os.chdir('rendered_frames')
 
-        for i, atoms_frame in enumerate(tqdm(atoms, desc='Rendering frames:',)):
-            render_image(atoms=atoms_frame,
-                         outfile=f'{label}_{i:05d}.png',
-                         custom_settings=custom_settings,
-                         **kwargs)
+        frame_cache = FrameCache('.', settings=(custom_settings, kwargs))
+        frame_keys = {}
+        n_cached = 0
+
+        def frames_to_render():
+            nonlocal n_cached
+            for i, atoms_frame in enumerate(atoms):
+                frame_outfile = os.path.abspath(f'{label}_{i:05d}.png')
+                key = frame_cache.frame_key(atoms_frame)
+                if frame_cache.is_valid(frame_outfile, key):
+                    n_cached += 1
+                    yield None, frame_outfile
+                    continue
+                frame_keys[frame_outfile] = key
+                yield atoms_frame, frame_outfile
+
+        encoder = None
+        if movie:
+            try:
+                # frames are piped to ffmpeg as soon as they are rendered
+                encoder = MovieEncoder(os.path.join(main_dir, f'{label}.mp4'), framerate)
+            except FileNotFoundError:
+                logger.warning('ffmpeg not found. The movie will be generated '
+                               'with imagemagick at the end.')
+
+        frame_files = []
+        desc = 'Rendering frames:' if jobs == 1 else f'Rendering frames ({jobs} jobs):'
+        try:
+            for frame_outfile in tqdm(_render_frames(frames_to_render(),
+                                                     jobs,
+                                                     custom_settings,
+                                                     **kwargs),
+                                      desc=desc):
+                if frame_outfile in frame_keys:
+                    frame_cache.add(frame_outfile, frame_keys.pop(frame_outfile))
+
+                if encoder is not None and not encoder.add_frame(frame_outfile):
+                    logger.warning('ffmpeg stopped accepting frames. The movie will be '
+                                   'generated with imagemagick at the end.')
+                    encoder.abort()
+                    encoder = None
+                frame_files.append(frame_outfile)
+        except BaseException:
+            # e.g. a failed render or KeyboardInterrupt: do not leave ffmpeg waiting
+            # for frames, nor a truncated movie
+            if encoder is not None:
+                encoder.abort()
+            raise
+        finally:
+            os.chdir(main_dir)
+
+        if n_cached:
+            logger.info('%d frames were already rendered and have been skipped.', n_cached)
         logger.info('Rendering complete.')
 
-        os.chdir(main_dir)
-
         if movie:
             logger.info('Generating movie...')
-            success = False
-
-            # first, try to use ffmpeg:
-            ffmpeg_cmd = f'ffmpeg -y -framerate {framerate} '\
-                f'-i rendered_frames/{label}_%05d.png '\
-                '-vf "pad=ceil(iw/2)*2:ceil(ih/2)*2" '\
-                f'-c:v libx264 -profile:v high -crf 20 -pix_fmt yuv420p '\
-                f'{label}.mp4'
-            try:
-                ret = subprocess.run([ffmpeg_cmd], check=True, capture_output=True, shell=True)
-                success = ret.returncode == 0
-            except (subprocess.CalledProcessError, FileNotFoundError) as ffmpeg_error:
-                logger.error('ffmpeg failed: %s. trying to use imagemagick...', ffmpeg_error)
-                # if ffmpeg fails, try imagemagick:
+
+            if encoder is not None:
                 try:
-                    convert_cmd = f'convert -delay {1000 // framerate} '\
-                        f'-loop 0 rendered_frames/{label}_*.png {label}.gif'
-                    ret = subprocess.run([convert_cmd], check=True, capture_output=True, shell=True)
-                    success = ret.returncode == 0
-                except (subprocess.CalledProcessError, FileNotFoundError) as imagemagick_error:
-                    logger.error('Imagemagick also failed: %s', imagemagick_error)
+                    encoder.close()
+                    success = True
+                except RuntimeError as exc:
+                    logger.error('%s', exc)
+                    success = False
+                # the frames are deleted only once the movie is complete,
+                # so that they are still there for the gif if ffmpeg failed
+                if success and not keep_frames:
+                    for frame_file in frame_files:
+                        os.remove(frame_file)
+            else:
+                success = False
+
+            if not success:
+                logger.info('Trying to generate a gif with imagemagick...')
+                success = make_gif(frame_files, f'{label}.gif', framerate)
 
             if success:
                 logger.info('Movie generated.')
@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Isosurfaces of volumetric grids for the povray scenes.
+'''
+
+from __future__ import annotations
+
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import TYPE_CHECKING
+
+import numpy as np
+from ase.io.pov import POVRAY, POVRAYIsosurface, pc
+
+if TYPE_CHECKING:
+    from atomsplot.cache import GridCache
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum number of grid points of the slabs for the marching cubes
+_SLAB_POINTS = 2**24
+# Grids smaller than this are not split among parallel workers
+_MIN_PARALLEL_POINTS = 2**20
+# Number of points along each axis of the blocks of the upscaled grid
+_UPSCALE_BLOCK = 128
+# Relative margin on the value range of a block, for the overshoot of the interpolation
+_UPSCALE_RANGE_MARGIN = 0.1
+# Factors of the two steps of each iteration of Taubin smoothing
+_TAUBIN_LAMBDA = 0.5
+_TAUBIN_MU = -0.53
+
+
+def _marching_cubes(volume : np.ndarray,
+                    level : float,
+                    gradient_direction : str,
+                    spacing : tuple = (1, 1, 1)) -> tuple:
+    """
+    Marching cubes on volume (by default with vertices in index units).
+    """
+
+    # marching_cubes name was changed in skimage v0.19
+    try:
+        from skimage.measure import marching_cubes # pylint: disable=import-outside-toplevel
+    except ImportError:
+        from skimage.measure import marching_cubes_lewiner as marching_cubes # pylint: disable=import-outside-toplevel
+
+    verts, faces, _, _ = marching_cubes(volume,
+                                        level=level,
+                                        spacing=spacing,
+                                        gradient_direction=gradient_direction,
+                                        allow_degenerate=False)
+    return verts, faces
+
+
+def _slab_mesh(slab : np.ndarray, level : float, gradient_direction : str) -> tuple | None:
+    """
+    Marching cubes on a slab of the grid. Used as the task of the pool.
+    Returns None if the level is outside the values of the slab.
+    """
+
+    if not slab.min() <= level <= slab.max():
+        return None
+    try:
+        return _marching_cubes(slab, level, gradient_direction)
+    except RuntimeError: # level within the range, but no surface
+        return None
+
+
+def _upscaled_block_mesh(coeffs : np.ndarray,
+                         coeffs_origin : np.ndarray,
+                         fine_ranges : list,
+                         scale : np.ndarray,
+                         level : float,
+                         gradient_direction : str) -> tuple | None:
+    """
+    Marching cubes on a block of the upscaled grid, interpolated from the spline
+    coefficients of the coarse grid around it (coeffs, starting at coarse index coeffs_origin).
+    The block spans the fine indices fine_ranges[i][0] to fine_ranges[i][1] (included)
+    along each axis i. Used as the task of the pool.
+    """
+
+    from scipy.ndimage import map_coordinates # pylint: disable=import-outside-toplevel
+
+    coords = np.meshgrid(*[np.arange(start, stop + 1) * s - origin
+                           for (start, stop), s, origin in zip(fine_ranges, scale, coeffs_origin)],
+                         indexing='ij')
+    block = map_coordinates(coeffs, coords, order=3, mode='constant', prefilter=False)
+    del coords
+    return _slab_mesh(block, level, gradient_direction)
+
+
+def _weld_meshes(meshes : list, origins : list, planes : list) -> tuple:
+    """
+    Merge the meshes of adjacent blocks (vertices in index units of the whole grid
+    after adding the origin of each block), welding the vertices on the planes shared
+    by the blocks (planes[i] are the indices of the shared planes along axis i),
+    which are identical in the two blocks since they are interpolated on the same edges.
+    Meshes that are None are skipped.
+    """
+
+    all_verts = []
+    all_faces = []
+    nverts = 0
+    for origin, mesh in zip(origins, meshes):
+        if mesh is None:
+            continue
+        verts, faces = mesh
+        verts += origin # exact, since the vertices on the planes have an integer coordinate
+        all_verts.append(verts)
+        all_faces.append(faces + nverts)
+        nverts += len(verts)
+    verts = np.concatenate(all_verts)
+    faces = np.concatenate(all_faces)
+
+    # weld the vertices on the shared planes, keeping the first occurrence
+    on_planes = np.zeros(len(verts), dtype=bool)
+    for axis, axis_planes in enumerate(planes):
+        on_planes |= np.isin(verts[:, axis], axis_planes)
+    shared = np.flatnonzero(on_planes)
+    _, first, inverse = np.unique(verts[shared], axis=0, return_index=True, return_inverse=True)
+    target = np.arange(len(verts))
+    target[shared] = shared[first][inverse.reshape(-1)]
+    keep = target == np.arange(len(verts))
+    new_index = np.cumsum(keep) - 1
+    faces = new_index[target[faces]]
+    verts = verts[keep]
+    # faces with vertices at a grid point on a shared plane, which become degenerate
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2])
+                  & (faces[:, 2] != faces[:, 0])]
+
+    logger.debug('Welded %d vertices of %d blocks', len(shared) - len(first), len(all_verts))
+
+    return verts, faces
+
+
+def _upscaled_shape(shape : tuple, upscale : float) -> np.ndarray:
+    """
+    Shape of the grid of the given shape upscaled by upscale, as in scipy.ndimage.zoom.
+    """
+
+    return np.round(np.array(shape) * upscale).astype(int)
+
+
+def _upscaled_mesh(density_grid : np.ndarray,
+                   level : float,
+                   gradient_direction : str,
+                   upscale : float,
+                   jobs : int) -> tuple:
+    """
+    Marching cubes on the grid upscaled with cubic splines as scipy.ndimage.zoom(order=3),
+    with vertices in index units of the upscaled grid. Only the blocks of the upscaled grid
+    whose coarse values around them straddle the level are interpolated.
+    """
+
+    from scipy.ndimage import spline_filter # pylint: disable=import-outside-toplevel
+
+    shape = np.array(density_grid.shape)
+    fine_shape = _upscaled_shape(shape, upscale)
+    # fine index i is at coarse index i * scale, as in scipy.ndimage.zoom
+    scale = (shape - 1) / (fine_shape - 1)
+    coeffs = spline_filter(density_grid, order=3, output=np.float64, mode='constant')
+
+    # block k spans the fine planes bounds[k] to bounds[k+1], both included
+    bounds = [np.linspace(0, n - 1, -(-(n - 1) // _UPSCALE_BLOCK) + 1).round().astype(int)
+              for n in fine_shape]
+
+    def tasks():
+        for block in np.ndindex(*[len(b) - 1 for b in bounds]):
+            fine_ranges = [(b[k], b[k + 1]) for b, k in zip(bounds, block)]
+            # coarse points in the support of the cubic splines of the block
+            low = np.array([max(int(start * s) - 2, 0) for (start, _), s in zip(fine_ranges, scale)])
+            high = np.array([min(int(np.ceil(stop * s)) + 3, n)
+                             for (_, stop), s, n in zip(fine_ranges, scale, shape)])
+            support = tuple(slice(l, h) for l, h in zip(low, high))
+            vmin, vmax = density_grid[support].min(), density_grid[support].max()
+            margin = _UPSCALE_RANGE_MARGIN * (vmax - vmin)
+            if vmin - margin <= level <= vmax + margin:
+                yield fine_ranges, coeffs[support], low
+
+    blocks = list(tasks())
+    nblocks = np.prod([len(b) - 1 for b in bounds])
+    logger.debug('Upscaling %d of %d blocks of the %s grid', len(blocks), nblocks, fine_shape)
+
+    args = ([block[1] for block in blocks], [block[2] for block in blocks],
+            [block[0] for block in blocks], repeat(scale), repeat(level), repeat(gradient_direction))
+    if jobs > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(blocks))) as executor:
+            meshes = list(executor.map(_upscaled_block_mesh, *args))
+    else:
+        meshes = list(map(_upscaled_block_mesh, *args))
+
+    if all(mesh is None for mesh in meshes):
+        raise ValueError('Surface level must be within volume data range.')
+
+    origins = [[start for start, _ in block[0]] for block in blocks]
+    return _weld_meshes(meshes, origins, [b[1:-1] for b in bounds]), fine_shape
+
+
+def compute_isosurface_mesh(density_grid : np.ndarray,
+                            level : float,
+                            spacing : tuple,
+                            gradient_direction : str = 'descent',
+                            jobs : int = 1,
+                            upscale : float = 1) -> tuple:
+    """
+    Marching cubes on the grid, with the same result as skimage's marching_cubes
+    (without degenerate faces), up to the order of vertices and faces, and to the
+    float32 rounding of the vertices, which can leave a few zero-area faces.
+
+    Large grids are split along the first axis into slabs of at most _SLAB_POINTS
+    points (at least jobs slabs, if the grid is larger than _MIN_PARALLEL_POINTS),
+    overlapping by one plane, so that the temporaries of marching cubes are bounded
+    by the size of the slab. The slabs are processed on a pool of jobs processes,
+    and their meshes merged, welding the vertices on the shared planes, which are
+    identical in the two slabs since they are interpolated on the same edges.
+
+    With upscale > 1, the mesh is computed on the grid upscaled as with
+    scipy.ndimage.zoom(density_grid, upscale, order=3), with the same spacing
+    as the zoomed grid (i.e. spacing * shape / upscaled shape), but the upscaled
+    grid is never built: it is interpolated in blocks of _UPSCALE_BLOCK points
+    per axis (on the pool of jobs processes), and only for the blocks where
+    the values of the coarse grid around them straddle the level (with a margin
+    for the overshoot of the splines). The other blocks contain no surface.
+
+    Parameters
+    ----------
+    density_grid : np.ndarray
+        3D grid.
+    level : float
+        Value of the isosurface.
+    spacing : tuple
+        Spacing of the grid along each axis, for the coordinates of the vertices.
+    gradient_direction : str, optional
+        'descent' or 'ascent', see skimage's marching_cubes. Default is 'descent'.
+    jobs : int, optional
+        Number of worker processes. Default is 1.
+    upscale : float, optional
+        Upscaling factor of the grid. Default is 1 (no upscaling).
+
+    Returns
+    -------
+    verts : np.ndarray
+        (n, 3) float32 coordinates of the vertices.
+    faces : np.ndarray
+        (m, 3) int32 indices of the vertices of each triangle.
+
+    Raises
+    ------
+    ValueError
+        If level is outside the range of the grid values.
+    """
+
+    if upscale > 1:
+        (verts, faces), fine_shape = _upscaled_mesh(density_grid, level, gradient_direction,
+                                                    upscale, jobs)
+        spacing = np.asarray(spacing) * density_grid.shape / fine_shape
+        return (verts * spacing).astype(np.float32), faces.astype(np.int32)
+
+    nx = density_grid.shape[0]
+    npoints = density_grid.size
+    nslabs = -(-npoints // _SLAB_POINTS)
+    if jobs > 1 and npoints >= _MIN_PARALLEL_POINTS:
+        nslabs = max(nslabs, jobs)
+    nslabs = max(min(nslabs, nx - 1), 1)
+
+    if nslabs == 1:
+        verts, faces = _marching_cubes(density_grid, level, gradient_direction, spacing)
+        return verts.astype(np.float32, copy=False), faces.astype(np.int32)
+
+    # slab k spans the planes bounds[k] to bounds[k+1], both included
+    bounds = np.linspace(0, nx - 1, nslabs + 1).round().astype(int)
+    slabs = (density_grid[start:stop + 1] for start, stop in zip(bounds[:-1], bounds[1:]))
+    args = (slabs, repeat(level), repeat(gradient_direction))
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, nslabs)) as executor:
+            meshes = list(executor.map(_slab_mesh, *args))
+    else:
+        meshes = list(map(_slab_mesh, *args))
+
+    if all(mesh is None for mesh in meshes):
+        raise ValueError('Surface level must be within volume data range.')
+
+    verts, faces = _weld_meshes(meshes, [(start, 0, 0) for start in bounds[:-1]],
+                                [bounds[1:-1], [], []])
+
+    return (verts * np.asarray(spacing)).astype(np.float32), faces.astype(np.int32)
+
+
+def taubin_smooth(verts : np.ndarray,
+                  faces : np.ndarray,
+                  iterations : int,
+                  bounds : tuple | None = None) -> np.ndarray:
+    """
+    Smooth a mesh with Taubin's lambda/mu algorithm: each iteration moves the vertices
+    towards the average of their neighbors (lambda step), and then away from it (mu step),
+    which removes the staircase of marching cubes without shrinking the surface.
+
+    The average of the neighbors is affine invariant, so that the mesh can be smoothed
+    in fractional coordinates.
+
+    Parameters
+    ----------
+    verts : np.ndarray
+        (n, 3) coordinates of the vertices.
+    faces : np.ndarray
+        (m, 3) indices of the vertices of each triangle.
+    iterations : int
+        Number of lambda/mu iterations.
+    bounds : tuple | None, optional
+        (low, high) coordinates of the planes delimiting the grid: the vertices on
+        these planes (where the surface is cut) are kept on them. Default is None.
+
+    Returns
+    -------
+    np.ndarray
+        Coordinates of the smoothed vertices.
+    """
+
+    from scipy.sparse import csr_matrix # pylint: disable=import-outside-toplevel
+
+    nverts = len(verts)
+    # each edge once per direction, also if shared by two faces
+    rows = faces[:, [0, 1, 2, 1, 2, 0]].ravel()
+    cols = faces[:, [1, 2, 0, 0, 1, 2]].ravel()
+    adjacency = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(nverts, nverts))
+    adjacency.data[:] = 1
+    degree = np.maximum(np.asarray(adjacency.sum(axis=1)).ravel(), 1)[:, None]
+
+    smoothed = verts.astype(np.float64)
+    if bounds is not None:
+        tol = 1e-6
+        pinned = [(np.flatnonzero(np.abs(smoothed[:, axis] - value) < tol), axis, value)
+                  for axis in range(3) for value in (bounds[0][axis], bounds[1][axis])]
+
+    for _ in range(iterations):
+        for factor in (_TAUBIN_LAMBDA, _TAUBIN_MU):
+            smoothed += factor * (adjacency @ smoothed / degree - smoothed)
+            if bounds is not None:
+                for indices, axis, value in pinned:
+                    smoothed[indices, axis] = value
+
+    return smoothed
+
+
+def vertex_normals(verts : np.ndarray, faces : np.ndarray) -> np.ndarray:
+    """
+    Unit normals of the vertices, as the area-weighted average of the normals
+    of the faces around each vertex, pointing out of the region enclosed by the surface
+    of marching_cubes (above the level with gradient_direction='descent', below it with 'ascent').
+
+    In fractional coordinates, the normals are transformed to Cartesian ones by
+    the inverse transpose of the cell matrix, as povray does for the mesh2 normals.
+    """
+
+    corners = verts[faces].astype(np.float64)
+    # cross product of the edges: the normal of the face times twice its area
+    # (the faces of marching_cubes are wound clockwise seen from outside the region)
+    face_normals = np.cross(corners[:, 2] - corners[:, 0], corners[:, 1] - corners[:, 0])
+    normals = np.stack([np.bincount(faces.ravel(), weights=np.repeat(face_normals[:, i], 3),
+                                    minlength=len(verts)) for i in range(3)], axis=1)
+    norms = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.where(norms > 0, norms, 1)
+
+
+def _format_triples(triples : np.ndarray,
+                    template : str,
+                    per_line : int,
+                    chunk_lines : int = 10000) -> str:
+    """
+    Format the triples in bulk, chunk_lines lines at a time, with the same output as
+    POVRAYIsosurface.wrapped_triples_section with the printf-style template.
+    """
+
+    values = np.asarray(triples).reshape(-1)
+    # all the lines are full, except the last one, which has 1 to per_line triples
+    nfull = max(-(-len(triples) // per_line) - 1, 0) * per_line * 3
+    line = f"\n     {', '.join([template] * per_line)}"
+    chunk_size = chunk_lines * per_line * 3
+    chunks = [(line * ((min(start + chunk_size, nfull) - start) // (per_line * 3)))
+              % tuple(values[start:min(start + chunk_size, nfull)].tolist())
+              for start in range(0, nfull, chunk_size)]
+    last = ', '.join([template] * ((len(values) - nfull) // 3)) % tuple(values[nfull:].tolist())
+    return ''.join(chunks) + f'\n    {last}'
+
+
+def crop_density_grid(density_grid : np.ndarray,
+                      cell : np.ndarray,
+                      z_range : tuple | None = None) -> tuple:
+    """
+    Crop the grid along the third cell vector to the planes that cover the range
+    of heights z_range (e.g. the part of a slab kept by range_cut or cut_vacuum),
+    so that the marching cubes skip the vacuum that is not drawn.
+    The grid is periodic, so that z_range can extend outside the cell: a range
+    taller than the cell (e.g. a supercell with replicas along z) is covered by
+    the grid repeated along the third axis.
+
+    The grid is cropped only if the first two cell vectors lie in the xy plane
+    (otherwise the planes of the grid are not at constant height).
+
+    Parameters
+    ----------
+    density_grid : np.ndarray
+        3D grid spanning the cell.
+    cell : np.ndarray
+        (3, 3) cell of the grid.
+    z_range : tuple | None, optional
+        (zmin, zmax) heights to be covered. Default is None (no cropping).
+
+    Returns
+    -------
+    grid : np.ndarray
+        Cropped (or repeated) grid, a view of density_grid if the planes are inside the cell.
+    grid_cell : np.ndarray
+        (3, 3) cell spanned by the cropped grid, in the same convention as
+        POVRAYIsosurface (the grid point i is at i / shape along each vector).
+    origin : np.ndarray
+        Position of the first point of the cropped grid.
+    planes : tuple | None
+        First and last plane of density_grid along the third axis,
+        or None if the grid was not cropped.
+    """
+
+    cell = np.asarray(cell, dtype=float)
+    if z_range is None or cell[:2, 2].any() or cell[2, 2] <= 0:
+        return density_grid, cell, np.zeros(3), None
+
+    n = density_grid.shape[2]
+    first = int(np.floor(z_range[0] / cell[2, 2] * n))
+    last = int(np.ceil(z_range[1] / cell[2, 2] * n))
+    if first >= 0 and last < n:
+        grid = density_grid[:, :, first:last + 1]
+    else:
+        grid = np.take(density_grid, np.arange(first, last + 1) % n, axis=2)
+
+    grid_cell = cell.copy()
+    grid_cell[2] *= grid.shape[2] / n
+    origin = first / n * cell[2]
+
+    return grid, grid_cell, origin, (first, last)
+
+
+class CachedIsosurface(POVRAYIsosurface):
+    """
+    POVRAYIsosurface whose mesh is computed in parallel slabs (see compute_isosurface_mesh),
+    stored with float32 vertices and int32 faces, and reused from the mesh cache of the
+    grid, if given, so that rendering the same grid again (e.g. with a different camera)
+    skips the marching cubes. The mesh can be smoothed, and is formatted in bulk.
+
+    Parameters
+    ----------
+    *args, **kwargs
+        Arguments of POVRAYIsosurface.
+    mesh_cache : GridCache | None, optional
+        Sidecar cache of the file of density_grid. Default is None (no cache).
+    jobs : int, optional
+        Number of worker processes for the marching cubes
+        (see compute_isosurface_mesh). Default is 1.
+    upscale : float, optional
+        Upscaling factor of the grid, applied only around the isosurface
+        (see compute_isosurface_mesh). Default is 1 (no upscaling).
+    smooth : int, optional
+        Number of iterations of Taubin smoothing of the mesh (see taubin_smooth).
+        If > 0, the mesh is written with the vertex normals, for smooth shading.
+        Default is 0 (no smoothing).
+    planes : tuple | None, optional
+        First and last plane along the third axis of the grid of the file,
+        if density_grid was cropped (see crop_density_grid), to tell the meshes
+        of different crops apart in the mesh cache. Default is None (whole grid).
+    translations : np.ndarray | None, optional
+        (K, 3) translations (in the frame of the scene) of the copies of the isosurface,
+        e.g. the replicas of a supercell. The mesh is declared once, as name, and drawn
+        as translated instances of it. Default is None (drawn once, where it is).
+    name : str, optional
+        Name of the declared mesh, if translations is given. Default is 'Isosurface'.
+    """
+
+    def __init__(self,
+                 *args,
+                 mesh_cache : GridCache | None = None,
+                 jobs : int = 1,
+                 upscale : float = 1,
+                 smooth : int = 0,
+                 planes : tuple | None = None,
+                 translations : np.ndarray | None = None,
+                 name : str = 'Isosurface',
+                 **kwargs):
+
+        self.mesh_cache = mesh_cache
+        self.planes = planes
+        self.translations = translations
+        self.name = name
+        self.jobs = jobs
+        self.upscale = upscale
+        self.smooth = smooth
+        self.normals = None
+        super().__init__(*args, **kwargs)
+
+
+    # instance method, not static as in POVRAYIsosurface: the mesh depends on the
+    # cache, the upscaling, the cut planes and the number of jobs of the isosurface
+    def compute_mesh(self, density_grid, cut_off, spacing, gradient_direction): # pylint: disable=arguments-differ
+        """
+        Return scaled_verts, faces, normals, values as POVRAYIsosurface.compute_mesh,
+        with normals and values None (they are not used for the povray mesh).
+        """
+
+        # the vertices are in fractional coordinates: the mesh does not depend on
+        # the (rotated) cell, which is applied as a matrix in the povray scene
+        settings = (float(cut_off), tuple(spacing), gradient_direction, self.closed_edges,
+                    self.upscale, self.planes)
+        mesh = self.mesh_cache.load_mesh(settings) if self.mesh_cache is not None else None
+        if mesh is not None:
+            verts, faces = mesh
+        else:
+            start = time.perf_counter()
+            verts, faces = compute_isosurface_mesh(density_grid, cut_off, spacing,
+                                                   gradient_direction, self.jobs, self.upscale)
+            logger.debug('Marching cubes on a %s grid in %.3f s (%d faces)',
+                         density_grid.shape, time.perf_counter() - start, len(faces))
+
+            if self.mesh_cache is not None:
+                self.mesh_cache.save_mesh(settings, verts, faces)
+
+        self.normals = None
+        if self.smooth > 0 and len(faces) > 0:
+            start = time.perf_counter()
+            # boundary planes of the grid of the mesh (the upscaled one, if upscale > 1)
+            shape = np.array(density_grid.shape)
+            mesh_shape = _upscaled_shape(shape, self.upscale) if self.upscale > 1 else shape
+            bounds = (np.zeros(3), (mesh_shape - 1) * np.asarray(spacing) * shape / mesh_shape)
+            smoothed = taubin_smooth(verts, faces, self.smooth, bounds)
+            self.normals = vertex_normals(smoothed, faces).astype(np.float32)
+            verts = smoothed.astype(np.float32)
+            logger.debug('Mesh smoothed in %.3f s', time.perf_counter() - start)
+
+        return verts, faces, None, None
+
+
+    def format_mesh(self) -> str:
+        """
+        Return the mesh2 of the isosurface for the povray scene, with the same output
+        as POVRAYIsosurface.format_mesh (formatted in bulk), plus the normals of the
+        vertices if the mesh was smoothed. With translations, the mesh2 is declared
+        and followed by its translated instances.
+        """
+
+        if self.material in POVRAY.material_styles_dict:
+            material = f"""material {{
+        texture {{
+          pigment {{ {pc(self.color)} }}
+          finish {{ {self.material} }}
+        }}
+      }}"""
+        else:
+            material = self.material
+
+        vertex_vectors = _format_triples(self.verts, '<%f, %f, %f>', 4)
+        face_indices = _format_triples(self.faces, '<%d, %d, %d>', 5)
+        normal_vectors = ''
+        if self.normals is not None:
+            normal_vectors = f"""
+    normal_vectors {{  {len(self.normals):n},
+    {_format_triples(self.normals, '<%f, %f, %f>', 4)}
+    }}"""
+
+        cell = self.cell
+        cell_or = self.cell_origin
+        mesh2 = f"""\n\nmesh2 {{
+    vertex_vectors {{  {len(self.verts):n},
+    {vertex_vectors}
+    }}{normal_vectors}
+    face_indices {{ {len(self.faces):n},
+    {face_indices}
+    }}
+{material if material != '' else '// no material'}
+  matrix < {cell[0][0]:f}, {cell[0][1]:f}, {cell[0][2]:f},
+           {cell[1][0]:f}, {cell[1][1]:f}, {cell[1][2]:f},
+           {cell[2][0]:f}, {cell[2][1]:f}, {cell[2][2]:f},
+           {cell_or[0]:f}, {cell_or[1]:f}, {cell_or[2]:f}>
+    }}
+    """
+
+        if self.translations is None:
+            return mesh2
+
+        # the mesh is stored once by povray, and shared by all the instances
+        instances = ''.join(f'object{{{self.name} translate <%f, %f, %f>}}\n' % tuple(t)
+                            for t in np.asarray(self.translations).tolist())
+        return f'\n\n#declare {self.name} = {mesh2.lstrip()}\n{instances}'
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Generation of movies from the rendered frames of a trajectory.
+'''
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MovieEncoder:
+    """
+    Encode frames into an mp4 movie with a persistent ffmpeg process.
+
+    The frames are fed to ffmpeg over stdin as soon as they are available,
+    so that the encoding overlaps with the rendering, and there is no need
+    of a second pass over the frame images at the end.
+
+    Parameters
+    ----------
+    outfile : str
+        Path of the output movie.
+    framerate : float
+        Framerate of the movie (frames per second).
+
+    Raises
+    ------
+    FileNotFoundError
+        If ffmpeg is not available.
+    """
+
+    def __init__(self, outfile : str, framerate : float):
+
+        self.outfile = outfile
+        self.failed = False
+
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+               '-f', 'image2pipe', '-framerate', f'{framerate}', '-c:v', 'png', '-i', '-',
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+               '-c:v', 'libx264', '-profile:v', 'high', '-crf', '20', '-pix_fmt', 'yuv420p',
+               outfile]
+
+        # stderr to a file, since a pipe might fill up and block ffmpeg
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=self._stderr)
+
+
+    def add_frame(self, frame_file : str) -> bool:
+        """
+        Send a frame (png image) to the encoder.
+
+        Returns
+        -------
+        bool
+            True if the frame was sent, False if the encoder has failed.
+        """
+
+        if self.failed:
+            return False
+
+        try:
+            with open(frame_file, 'rb') as f:
+                shutil.copyfileobj(f, self.process.stdin)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as exc:
+            logger.error('ffmpeg stopped accepting frames: %s', exc)
+            self.failed = True
+
+        return not self.failed
+
+
+    def close(self):
+        """
+        Finalize the movie and wait for ffmpeg to terminate.
+
+        Raises
+        ------
+        RuntimeError
+            If ffmpeg failed, or stopped accepting frames.
+        """
+
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            self.failed = True
+        returncode = self.process.wait()
+
+        self._stderr.seek(0)
+        stderr = self._stderr.read().decode(errors='replace').strip()
+        self._stderr.close()
+
+        if returncode != 0 or self.failed:
+            self.failed = True
+            raise RuntimeError(f'ffmpeg failed (exit code {returncode}): {stderr}')
+
+
+    def abort(self):
+        """
+        Stop ffmpeg without finalizing the movie (e.g. if the rendering failed,
+        or ffmpeg stopped accepting frames), and remove the incomplete movie.
+        """
+
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.wait()
+        self.failed = True
+
+        self._stderr.seek(0)
+        stderr = self._stderr.read().decode(errors='replace').strip()
+        self._stderr.close()
+        if stderr:
+            logger.error('ffmpeg: %s', stderr)
+
+        if os.path.exists(self.outfile):
+            os.remove(self.outfile)
+
+
+def make_gif(frame_files : list[str], outfile : str, framerate : float) -> bool:
+    """
+    Generate a gif from the frame images with imagemagick convert.
+    Fallback for when ffmpeg is not available.
+
+    Returns
+    -------
+    bool
+        True if the gif was generated successfully.
+    """
+
+    cmd = ['convert', '-delay', f'{int(1000 // framerate)}', '-loop', '0',
+           *frame_files, outfile]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except (subprocess.CalledProcessError, FileNotFoundError) as imagemagick_error:
+        logger.error('Imagemagick failed: %s', imagemagick_error)
+        return False
+
+    return True
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Neighbor search shared by all the analyses that need pairs of close atoms
+(bonds, coordination numbers, bond orders), so that it is done only once per frame.
+'''
+
+from __future__ import annotations
+
+import time
+import logging
+from typing import TYPE_CHECKING
+
+import numpy as np
+from ase.data import covalent_radii
+
+if TYPE_CHECKING:
+    from ase import Atoms
+
+logger = logging.getLogger(__name__)
+
+
+# ase.io.pov.get_bondpairs uses ase's NeighborList with its default skin,
+# which is added to the cutoff of each atom: keep the same bonding criterion.
+BOND_SKIN = 0.3
+# multiplier of the covalent radii for the coordination numbers
+COORDNUM_MULT = 1.3
+# extra distance for the neighbors reused across the frames of a trajectory
+VERLET_SKIN = 1.0
+
+# Reference lengths (Angstrom) of the bonds of order 1, 2, 3 for the pairs of
+# elements that can form multiple bonds, from pymatgen's bond length data
+# (pymatgen.core.bonds), and its relative tolerance for the longest bond.
+MULTIPLE_BOND_LENGTHS = {
+    (6, 6): (1.54, 1.34, 1.20),
+    (6, 7): (1.47, 1.30, 1.16),
+    (6, 8): (1.43, 1.23),
+    (7, 7): (1.45, 1.25, 1.10),
+}
+BONDORDER_TOL = 0.2
+
+
+def _find_pairs(atoms: Atoms, cutoffs: np.ndarray) -> tuple:
+    """
+    Find all the pairs of atoms with distance < cutoffs[a] + cutoffs[b],
+    periodic images included, with a KD-tree on the atoms plus the periodic
+    images that fall within the maximum cutoff from them.
+
+    Returns
+    -------
+    a, b, offsets, distances : np.ndarray
+        Half list of pairs (each pair once, a <= b), sorted by a and b.
+    """
+
+    from scipy.spatial import cKDTree # pylint: disable=import-outside-toplevel
+
+    positions = atoms.positions
+    rmax = 2 * cutoffs.max()
+    periodic = np.flatnonzero(atoms.pbc)
+
+    # periodic images within rmax from the bounding box (in fractional coordinates)
+    # of the atoms, since only these can be neighbors of an atom
+    image_positions = [positions]
+    image_indices = [np.arange(len(atoms))]
+    image_offsets = [np.zeros((len(atoms), 3), dtype=int)]
+    if len(periodic) > 0:
+        cell = atoms.cell.complete()
+        frac = positions @ np.linalg.inv(cell)
+        # rmax in fractional units along each direction (1 / spacing of the lattice planes)
+        margin = rmax * np.linalg.norm(np.linalg.inv(cell), axis=0)
+        low = frac.min(axis=0) - margin
+        high = frac.max(axis=0) + margin
+
+        nrep = np.zeros(3, dtype=int)
+        nrep[periodic] = np.ceil(high - low).astype(int)[periodic]
+        shifts = np.stack(np.meshgrid(*[np.arange(-n, n + 1) for n in nrep],
+                                      indexing='ij'), axis=-1).reshape(-1, 3)
+        for shift in shifts[np.any(shifts != 0, axis=1)]:
+            shifted = frac + shift
+            inside = np.flatnonzero(np.all((shifted > low) & (shifted < high), axis=1))
+            if len(inside) > 0:
+                image_positions.append(positions[inside] + shift @ cell)
+                image_indices.append(inside)
+                image_offsets.append(np.broadcast_to(shift, (len(inside), 3)))
+
+    all_positions = np.concatenate(image_positions)
+    all_indices = np.concatenate(image_indices)
+    all_offsets = np.concatenate(image_offsets)
+
+    pairs = cKDTree(positions).sparse_distance_matrix(cKDTree(all_positions), rmax,
+                                                      output_type='ndarray')
+    a = pairs['i']
+    b = all_indices[pairs['j']]
+    offsets = all_offsets[pairs['j']]
+    distances = pairs['v']
+
+    # keep each pair once, and exclude the atoms themselves
+    first_nonzero = np.take_along_axis(offsets, (offsets != 0).argmax(axis=1)[:, None],
+                                       axis=1)[:, 0]
+    keep = ((a < b) | ((a == b) & (first_nonzero > 0))) & (distances < cutoffs[a] + cutoffs[b])
+    order = np.lexsort((b[keep], a[keep]))
+
+    return a[keep][order], b[keep][order], offsets[keep][order], distances[keep][order]
+
+
+def estimate_bond_orders(numbers: np.ndarray,
+                         a: np.ndarray,
+                         b: np.ndarray,
+                         distances: np.ndarray,
+                         tol: float = BONDORDER_TOL) -> np.ndarray:
+    """
+    Estimate the order of the bonds between atoms a and b from their distances,
+    interpolating between the reference lengths of MULTIPLE_BOND_LENGTHS
+    (same criterion as pymatgen's get_bond_order, rounded to the nearest integer).
+    The bonds between other elements are single bonds.
+
+    Returns
+    -------
+    np.ndarray
+        Integer bond order of each bond.
+    """
+
+    orders = np.ones(len(a), dtype=int)
+    z_low = np.minimum(numbers[a], numbers[b])
+    z_high = np.maximum(numbers[a], numbers[b])
+
+    for (z1, z2), lengths in MULTIPLE_BOND_LENGTHS.items():
+        sel = np.flatnonzero((z_low == z1) & (z_high == z2))
+        if len(sel) == 0:
+            continue
+        # order 0 at (1 + tol) times the single bond length, then linear
+        # between the reference lengths, and constant below the shortest one
+        ref_lengths = np.array((lengths[0] * (1 + tol),) + lengths)
+        ref_orders = np.arange(len(ref_lengths))
+        continuous_orders = np.interp(distances[sel], ref_lengths[::-1], ref_orders[::-1])
+        orders[sel] = np.maximum(np.rint(continuous_orders).astype(int), 1)
+
+    return orders
+
+
+class Neighbors:
+    """
+    Pairs of atoms closer than mult * (r_a + r_b) + 2 * skin,
+    where r_a and r_b are the covalent radii of the two atoms.
+
+    The search is done once, with a KD-tree (close to linear scaling),
+    periodic images included. Any criterion with smaller mult and skin
+    can then be applied to the stored pairs without searching again.
+
+    Each pair is stored once, as (a, b, offset), meaning that atom a is bonded to
+    atom b displaced by offset @ cell, with a <= b.
+
+    With verlet_skin > 0, also the pairs up to verlet_skin farther are stored,
+    so that the neighbors can be updated for new positions of the same atoms
+    (see update) without a new search, as long as no atom moved by more than
+    verlet_skin / 2.
+
+    Parameters
+    ----------
+    atoms : Atoms
+        Atoms object.
+    mult : float
+        Multiplier of the covalent radii for the largest cutoff needed.
+    skin : float, optional
+        Distance added to the cutoff of each atom. Default is 0.
+    verlet_skin : float, optional
+        Extra distance for the stored pairs. Default is 0.
+
+    Attributes
+    ----------
+    a, b : np.ndarray
+        Indices of the two atoms of each pair.
+    offsets : np.ndarray
+        (n_pairs, 3) integer cell offsets of atom b.
+    distances : np.ndarray
+        Distance of each pair.
+    """
+
+    def __init__(self, atoms: Atoms, mult: float, skin: float = 0.0, verlet_skin: float = 0.0):
+
+        self.natoms = len(atoms)
+        self.numbers = atoms.numbers.copy()
+        self.radii = covalent_radii[atoms.numbers]
+        self.mult = mult
+        self.skin = skin
+        self.verlet_skin = verlet_skin
+
+        # reference for the update
+        self.positions = atoms.positions.copy()
+        self.cell = atoms.cell.array.copy()
+        self.pbc = atoms.pbc.copy()
+
+        if self.natoms == 0:
+            a = b = np.empty(0, dtype=int)
+            offsets = np.empty((0, 3), dtype=int)
+            distances = np.empty(0)
+        else:
+            a, b, offsets, distances = _find_pairs(atoms,
+                                                   mult * self.radii + skin + verlet_skin / 2)
+
+        self.a = a
+        self.b = b
+        self.offsets = offsets
+        self.distances = distances
+        self._bond_orders = None # (bonds, orders) of the last call of get_bond_orders
+
+        logger.debug('Found %d pairs for %d atoms', len(a), self.natoms)
+
+
+    def update(self, atoms: Atoms) -> bool:
+        """
+        Update the distances of the stored pairs for the new positions of atoms,
+        if they are still guaranteed to include all the neighbors, i.e. if atoms
+        has the same atoms and cell as the reference, and no atom moved by more
+        than verlet_skin / 2 from the reference positions.
+
+        Returns
+        -------
+        bool
+            True if the neighbors were updated, False if a new search is needed.
+        """
+
+        if len(atoms) != self.natoms \
+            or not np.array_equal(atoms.numbers, self.numbers) \
+            or not np.array_equal(atoms.cell.array, self.cell) \
+            or not np.array_equal(atoms.pbc, self.pbc):
+            return False
+
+        max_displacement2 = ((atoms.positions - self.positions)**2).sum(axis=1).max(initial=0)
+        if max_displacement2 >= (self.verlet_skin / 2)**2:
+            return False
+
+        vectors = atoms.positions[self.b] + self.offsets @ self.cell - atoms.positions[self.a]
+        self.distances = np.linalg.norm(vectors, axis=1)
+        return True
+
+
+    def select(self, mult: float, skin: float = 0.0) -> np.ndarray:
+        """
+        Return the indices of the pairs closer than mult * (r_a + r_b) + 2 * skin.
+        mult and skin cannot be larger than those used for the search.
+        """
+
+        if mult > self.mult or skin > self.skin:
+            raise ValueError('The requested cutoff is larger than the one used for the search.')
+
+        cutoffs = mult * (self.radii[self.a] + self.radii[self.b]) + 2 * skin
+        return np.flatnonzero(self.distances < cutoffs)
+
+
+    def get_bondpairs(self, radius: float) -> list:
+        """
+        Return the bonds in the same format as ase.io.pov.get_bondpairs,
+        i.e. a list of (a, b, offset) tuples, with the same bonding criterion.
+        """
+
+        idx = self.select(radius, BOND_SKIN)
+        return list(zip(self.a[idx].tolist(), self.b[idx].tolist(), self.offsets[idx]))
+
+
+    def get_bond_orders(self, bonds: np.ndarray) -> np.ndarray:
+        """
+        Return the orders of the given bonds (indices of pairs, as returned by select),
+        see estimate_bond_orders. Since the indices of the pairs do not change
+        in update, the orders are reused as long as the bonds are the same,
+        e.g. for the following frames of a trajectory with the same topology.
+        """
+
+        if self._bond_orders is not None and np.array_equal(self._bond_orders[0], bonds):
+            return self._bond_orders[1]
+
+        orders = estimate_bond_orders(self.numbers, self.a[bonds], self.b[bonds],
+                                      self.distances[bonds])
+        self._bond_orders = (bonds, orders)
+        return orders
+
+
+    def get_coordination_numbers(self, mult: float = COORDNUM_MULT) -> np.ndarray:
+        """
+        Return the coordination number of each atom, counting the atoms closer than
+        mult * (r_a + r_b), periodic images included.
+        """
+
+        idx = self.select(mult)
+        return np.bincount(self.a[idx], minlength=self.natoms) + \
+               np.bincount(self.b[idx], minlength=self.natoms)
+
+
+class NeighborsCache:
+    """
+    Neighbors reused across the frames of a trajectory (Verlet list):
+    the pairs are searched with an extra verlet_skin, and for the next frames
+    only their distances are updated, until an atom has moved by more than
+    verlet_skin / 2 since the last search.
+
+    Parameters
+    ----------
+    verlet_skin : float, optional
+        Extra distance for the stored pairs. Default is VERLET_SKIN.
+    """
+
+    def __init__(self, verlet_skin: float = VERLET_SKIN):
+
+        self.verlet_skin = verlet_skin
+        self.neighbors = None
+        self.n_searches = 0
+        self.n_updates = 0
+
+
+    def get(self, atoms: Atoms, mult: float, skin: float = 0.0) -> Neighbors:
+        """
+        Return the neighbors of atoms, as Neighbors(atoms, mult, skin),
+        reusing those of the previous call if possible.
+        """
+
+        start = time.perf_counter()
+        neighbors = self.neighbors
+        if neighbors is not None and neighbors.mult >= mult and neighbors.skin >= skin \
+            and neighbors.update(atoms):
+            self.n_updates += 1
+            logger.debug('Neighbors updated in %.3f s', time.perf_counter() - start)
+        else:
+            self.neighbors = neighbors = Neighbors(atoms, mult, skin, self.verlet_skin)
+            self.n_searches += 1
+            logger.debug('Neighbors searched in %.3f s', time.perf_counter() - start)
+
+        return neighbors
@@ -22,32 +22,38 @@ Module to render an image of an Atoms object using POVray or ASE renderer.
 
 from __future__ import annotations
 import logging
+from dataclasses import dataclass
 from typing import Optional, TYPE_CHECKING
 import shutil
 import os
 from pathlib import Path
 
 import numpy as np
-from ase.io.pov import get_bondpairs, set_high_bondorder_pairs
-from ase.data import covalent_radii
+from ase.data import covalent_radii, chemical_symbols
 
 from ase.io import write
-from ase.io.utils import PlottingVariables
-from ase.io.pov import POVRAY, POVRAYIsosurface
-from ase.geometry.geometry import get_layers
-from ase.build.tools import sort
+from ase.io.utils import PlottingVariables, get_cell_vertex_points, has_cell
+from ase.utils import rotate
+from ase.io.pov import POVRAY
+from ase.geometry import wrap_positions
 
 from atomsplot.settings import CustomSettings
+from atomsplot.isosurface import CachedIsosurface, crop_density_grid
+from atomsplot.neighbors import Neighbors, NeighborsCache, BOND_SKIN, COORDNUM_MULT
 from atomsplot.ase_custom import AtomsCustom # monkey patch for ase.utils.PlottingVariables arrows_type. pylint: disable=unused-import
-import atomsplot.ase_custom.povray # monkey patch for povray. pylint: disable=unused-import
+from atomsplot.ase_custom.povray import TEXTURES, ATOM_STYLE_DTYPE # also monkey patches povray
 
 if TYPE_CHECKING:
     from ase import Atoms
     from atomsplot.ase_custom import AtomsCustom
+    from atomsplot.cache import GridCache
 
 
 
-def _get_colorcoded_colors(atoms: Atoms, quantity: str, ccrange : list | None = None) -> list:
+def _get_colorcoded_colors(atoms: Atoms,
+                           quantity: str,
+                           ccrange : list | None = None,
+                           neighbors : Neighbors | None = None) -> list:
     """
     Get colors for atoms based on the specified quantity.
 
@@ -60,11 +66,14 @@ def _get_colorcoded_colors(atoms: Atoms, quantity: str, ccrange : list | None =
     ccrange : list, optional
         Range of values for color coding. If None, the range is automatically set to the
         min and max of the quantity.
+    neighbors : Neighbors | None, optional
+        Precomputed neighbors, used for the coordination numbers.
+        If None, they are computed here.
 
     Returns
     -------
-    colors : list
-        List of RGB colors for each atom, normalized to the specified range.
+    colors : np.ndarray
+        (N, 3) array with the RGB color of each atom, normalized to the specified range.
     """
 
     # import here to reduce loading time when not needed
@@ -86,12 +95,9 @@ def _get_colorcoded_colors(atoms: Atoms, quantity: str, ccrange : list | None =
         cmap = colormaps.get_cmap('coolwarm')
 
     elif quantity == 'coordnum':
-        from ase.neighborlist import NeighborList, natural_cutoffs # pylint: disable=import-outside-toplevel
-        cutoffs = natural_cutoffs(atoms, mult=1.3)
-        nl = NeighborList(cutoffs, skin=0, self_interaction=False, bothways=True)
-        nl.update(atoms)
-        connmat = nl.get_connectivity_matrix()
-        values = [connmat[idx].count_nonzero() for idx in range(len(atoms))]
+        if neighbors is None:
+            neighbors = Neighbors(atoms, mult=COORDNUM_MULT)
+        values = neighbors.get_coordination_numbers(COORDNUM_MULT)
         cmap = colormaps.get_cmap('viridis_r')
     else:
         raise ValueError("Invalid quantity for colorcoding.")
@@ -99,10 +105,75 @@ def _get_colorcoded_colors(atoms: Atoms, quantity: str, ccrange : list | None =
     if ccrange is not None:
         vmin, vmax = ccrange[0], ccrange[1]
     else:
-        vmin, vmax = min(values), max(values)
+        vmin, vmax = np.min(values), np.max(values)
     norm = Normalize(vmin=vmin, vmax=vmax)
     scalar_map = cm.ScalarMappable(norm=norm, cmap=cmap)
-    colors = [scalar_map.to_rgba(q)[:3] for q in values]
+    colors = scalar_map.to_rgba(np.asarray(values))[:, :3]
+
+    return colors
+
+
+def _indices_mask(indices: list[int], natoms: int) -> np.ndarray:
+    """
+    Boolean mask of the atoms in indices. Indices out of range
+    (e.g. from image_settings.json, for a different structure) are ignored.
+    """
+
+    mask = np.zeros(natoms, dtype=bool)
+    indices = np.asarray(indices, dtype=int)
+    mask[indices[(indices >= 0) & (indices < natoms)]] = True
+    return mask
+
+
+def _get_species_table(atoms: 'Atoms | AtomsCustom') -> tuple:
+    """
+    Get the distinct species (custom labels for AtomsCustom, chemical symbols otherwise),
+    and the index of the species of each atom.
+    """
+
+    if isinstance(atoms, AtomsCustom):
+        return atoms.get_custom_labels_table()
+
+    numbers, species_indices = np.unique(atoms.numbers, return_inverse=True)
+    return [chemical_symbols[number] for number in numbers.tolist()], species_indices.ravel()
+
+
+def _get_colors(atoms: 'Atoms | AtomsCustom',
+                custom_settings: CustomSettings,
+                mol_indices: list[int] | None = None) -> np.ndarray:
+    """
+    Get the colors of the atoms from the color scheme, overridden by the atomic_colors
+    of the custom settings, in turn overridden by molecule_colors for the atoms
+    in mol_indices. Species are matched by their custom labels, if present.
+
+    Returns
+    -------
+    colors : np.ndarray
+        (N, 3) array with the RGB color of each atom.
+    """
+
+    colors = np.asarray(custom_settings.color_scheme, dtype=float)[atoms.numbers]
+
+    species, species_indices = _get_species_table(atoms)
+
+    overrides = [(custom_settings.atomic_colors, None)]
+    if mol_indices is not None:
+        overrides.append((custom_settings.molecule_colors, _indices_mask(mol_indices, len(atoms))))
+
+    for color_overrides, mask in overrides:
+        has_override = np.array([sp in color_overrides for sp in species], dtype=bool)
+        if not has_override.any():
+            continue
+
+        # lookup table with the override color of each species
+        override_colors = np.zeros((len(species), 3))
+        override_colors[has_override] = [color_overrides[sp]
+                                         for sp, has in zip(species, has_override) if has]
+
+        selected = has_override[species_indices]
+        if mask is not None:
+            selected &= mask
+        colors[selected] = override_colors[species_indices[selected]]
 
     return colors
 
@@ -125,7 +196,135 @@ def _get_arrows(atoms: Atoms, quantity: str, rotation, scaling : float) -> np.nd
     return arrows
 
 
-def _calculate_ground_fog_height(atoms: Atoms, mol_indices: list[float] | None = None) -> float:
+# maximum distance (Angstrom) along z between atoms of the same layer
+LAYER_TOLERANCE = 0.3
+
+
+def _get_layer_heights(atoms: Atoms, instances: SupercellInstances | None = None) -> tuple:
+    """
+    Heights of the atoms along the normal to the ab plane, as the distances
+    of ase.geometry.get_layers with miller=(0,0,1), with the atomic numbers and
+    the number of copies of each atom (replicas of an instanced supercell).
+
+    Returns
+    -------
+    heights, numbers, weights : np.ndarray
+    """
+
+    # scaled positions along c, wrapped as in atoms.get_scaled_positions,
+    # times the distance between the lattice planes parallel to ab
+    reciprocal_c = np.linalg.inv(atoms.cell.complete())[:, 2]
+    scaled_z = atoms.positions @ reciprocal_c
+    if atoms.pbc[2]:
+        scaled_z %= 1.0
+        scaled_z %= 1.0
+    spacing = 1 / np.linalg.norm(reciprocal_c)
+    heights = scaled_z * spacing
+    numbers = atoms.numbers
+    weights = np.ones(len(atoms))
+
+    if instances is not None:
+        # replicas along c are at different heights, those in the ab plane are just counted
+        nx, ny, nz = instances.supercell
+        replicated = instances.instanced
+        heights = np.concatenate([heights[~replicated]]
+                                 + [heights[replicated] + k * spacing for k in range(nz)])
+        numbers = np.concatenate([numbers[~replicated]] + [numbers[replicated]] * nz)
+        weights = np.concatenate([weights[~replicated]] + [weights[replicated] * nx * ny] * nz)
+
+    return heights, numbers, weights
+
+
+def _find_slab_layers(heights: np.ndarray,
+                      numbers: np.ndarray,
+                      weights: np.ndarray,
+                      tolerance: float = LAYER_TOLERANCE) -> tuple:
+    """
+    Group the atoms in layers (as ase.geometry.get_layers: sorted by height, with a new
+    layer at each gap larger than tolerance), and find the top layer of the slab, as the
+    highest layer with an occupied volume larger than 80% of the maximum.
+    The occupied volume is used rather than the number of atoms, to avoid
+    planar molecules such as benzene to be considered as a slab layer.
+
+    Returns
+    -------
+    zmax_slab : float
+        Height of the top slab layer + 1 Angstrom.
+    top_layer : np.ndarray
+        Indices of the atoms in the top slab layer.
+    margin : float
+        Displacement along z below which the atoms cannot change layer, i.e. every
+        gap within a layer stays within tolerance and every gap between layers
+        stays larger than tolerance, as the sorted heights move at most by the
+        largest displacement and each gap by twice that.
+    """
+
+    keys = np.argsort(heights, kind='stable')
+    sorted_heights = heights[keys]
+    gaps = np.diff(sorted_heights)
+    new_layer = np.concatenate(([True], gaps > tolerance))
+    layers = np.cumsum(new_layer) - 1
+    levels = sorted_heights[new_layer]
+
+    volumes = np.bincount(layers,
+                          weights=weights[keys] * 4/3 * np.pi * covalent_radii[numbers[keys]]**3)
+
+    # XXX: this method does not work for the example depth_cueing_mols_auto
+    top = np.flatnonzero(volumes > 0.8 * volumes.max()).max()
+
+    margin = min(tolerance - gaps[~new_layer[1:]].max(initial=0),
+                 gaps[new_layer[1:]].min(initial=np.inf) - tolerance) / 2
+
+    return levels[top] + 1, keys[layers == top], margin
+
+
+class SlabHeightCache:
+    """
+    Height of the top slab layer for the ground fog, reused across the frames
+    of a trajectory as long as the layers along z are the same, i.e. the atoms
+    are the same and no atom has moved along z since the last search by more
+    than the margin returned by _find_slab_layers. The height is then
+    that of the lowest atom of the same top layer, as a new search would find.
+    """
+
+    def __init__(self, tolerance: float = LAYER_TOLERANCE):
+
+        self.tolerance = tolerance
+        self.numbers = None
+        self.weights = None
+        self.heights = None # heights at the last search
+        self.top_layer = None # indices of the atoms in the top slab layer
+        self.margin = None
+        self.n_searches = 0
+        self.n_reuses = 0
+
+
+    def get(self, heights: np.ndarray, numbers: np.ndarray, weights: np.ndarray) -> float:
+        """
+        Return the height of the top slab layer + 1 Angstrom (see _find_slab_layers),
+        reusing the layers of the previous search if possible.
+        """
+
+        if self.heights is not None \
+            and np.array_equal(numbers, self.numbers) \
+            and np.array_equal(weights, self.weights) \
+            and np.abs(heights - self.heights).max(initial=0) < self.margin:
+            self.n_reuses += 1
+            return heights[self.top_layer].min() + 1
+
+        zmax_slab, self.top_layer, self.margin = _find_slab_layers(heights, numbers,
+                                                                   weights, self.tolerance)
+        self.numbers = numbers.copy()
+        self.weights = weights.copy()
+        self.heights = heights.copy()
+        self.n_searches += 1
+        return zmax_slab
+
+
+def _calculate_ground_fog_height(atoms: Atoms,
+                                 mol_indices: list[float] | None = None,
+                                 instances: SupercellInstances | None = None,
+                                 slab_height_cache: SlabHeightCache | None = None) -> float:
     """
     Calculate the height of ground fog for visualization purposes.
     This function determines the fog height by analyzing the structure of a system,
@@ -140,6 +339,10 @@ def _calculate_ground_fog_height(atoms: Atoms, mol_indices: list[float] | None =
         height is calculated based on the z-coordinate range of these atoms.
         If None, the function attempts to distinguish between slab and molecular
         regions automatically.
+    instances : SupercellInstances | None, optional
+        Supercell drawn as instances of atoms, if any.
+    slab_height_cache : SlabHeightCache | None, optional
+        Cache of the slab height of the previous frame of a trajectory.
 
     Returns
     -------
@@ -150,9 +353,8 @@ def _calculate_ground_fog_height(atoms: Atoms, mol_indices: list[float] | None =
     Notes
     -----
     When mol_indices is None:
-        - The function sorts atoms by z-coordinate and uses layer analysis to
-          identify slab regions.
-        - Layers are identified using Miller indices (0,0,1) with a tolerance of 0.3.
+        - The atoms are grouped in layers along z with a tolerance of 0.3,
+          as in ase.geometry.get_layers with Miller indices (0,0,1).
         - Volume-based thresholding (80% of max occupied volume) is used to
           distinguish slab layers from molecular regions.
         - Occupied volume is estimated using covalent radii assuming spherical atoms.
@@ -162,25 +364,16 @@ def _calculate_ground_fog_height(atoms: Atoms, mol_indices: list[float] | None =
         mol_zs = atoms.positions[mol_indices][:,2]
         constant_fog_height = - (mol_zs.max() - mol_zs.min())
     else:
-        #this should give much more intense peaks for the slab
-        sorted_atoms = sort(atoms, tags=atoms.positions[:,2])
-        zmax_mol = sorted_atoms.positions[-1,2]
-        layer_indicization, distances = get_layers(atoms=sorted_atoms, miller=(0,0,1),
-                                        tolerance=0.3)
-
-        #use occupied volume rather than number of atoms, to avoid
-        #planar molecules such as benzene to be considered as a slab layer
-        bins_heights = [0] * len(distances)
-        for i, idx in enumerate(layer_indicization):
-            bins_heights[idx] += 4/3*np.pi*(covalent_radii[sorted_atoms[i].number])**3
-
-        # XXX: this method does not work for the example depth_cueing_mols_auto
-        threshold = 0.8 * max(bins_heights)
-        zmax_slab = 0
-        for i in range(len(distances)-1,-1,-1):
-            if bins_heights[i] > threshold:
-                zmax_slab = distances[i] +1
-                break
+        if instances is not None:
+            zmax_mol = instances.get_bounding_atoms(atoms)[1][:,2].max()
+        else:
+            zmax_mol = atoms.positions[:,2].max()
+
+        layer_heights = _get_layer_heights(atoms, instances)
+        if slab_height_cache is not None:
+            zmax_slab = slab_height_cache.get(*layer_heights)
+        else:
+            zmax_slab = _find_slab_layers(*layer_heights)[0]
 
         if zmax_slab < zmax_mol - 5:
             logging.warning(
@@ -194,33 +387,372 @@ def _calculate_ground_fog_height(atoms: Atoms, mol_indices: list[float] | None =
     return constant_fog_height
 
 
-def _calculate_bondorder_pairs(atoms: Atoms, mol_indices : list[int] | None = None) -> dict:
+def _calculate_bondorder_pairs(neighbors: Neighbors,
+                               radius: float,
+                               mol_indices : list[int] | None = None) -> dict:
+    '''
+    Calculate the pairs of atoms with high bond order, among the bonds found by neighbors,
+    including those with periodic images.
+
+    Returns
+    -------
+    dict
+        {(a, b): (offset, bond_order, bond_offset)} for the bonds with order >= 2,
+        as for ase.io.pov.set_high_bondorder_pairs.
+    '''
+
+    bonds = neighbors.select(radius, BOND_SKIN)
+    orders = neighbors.get_bond_orders(bonds)
+
+    high = orders >= 2
+    if mol_indices is not None:
+        high &= np.isin(neighbors.a[bonds], mol_indices) | np.isin(neighbors.b[bonds], mol_indices)
+    bonds, orders = bonds[high], orders[high]
+
+    return {(a, b): (offset, order, (0.2, 0.2, 0))
+            for a, b, offset, order in zip(neighbors.a[bonds].tolist(),
+                                           neighbors.b[bonds].tolist(),
+                                           neighbors.offsets[bonds],
+                                           orders.tolist())}
+
+
+def _set_high_bondorder_pairs(bondpairs: list, high_bondorder_pairs: dict) -> list:
     '''
-    Calculate pairs of atoms with high bond order using Pymatgen's CovalentBondNN.
+    Same as ase.io.pov.set_high_bondorder_pairs, but a pair is modified only
+    if its offset also matches, so that bonds with different periodic images
+    of the same atom are not mixed up.
     '''
 
-    from pymatgen.analysis.local_env import CovalentBondNN # pylint: disable=import-outside-toplevel
-    from pymatgen.io.ase import AseAtomsAdaptor # pylint: disable=import-outside-toplevel
+    if not high_bondorder_pairs:
+        return bondpairs
+
+    bondpairs_ = []
+    for pair in bondpairs:
+        high = high_bondorder_pairs.get((pair[0], pair[1]))
+        if high is not None and np.array_equal(high[0], pair[2]):
+            bondpairs_.append((pair[0], pair[1], *high))
+        else:
+            bondpairs_.append(pair)
+    return bondpairs_
+
+
+@dataclass
+class SupercellInstances:
+    """
+    Supercell drawn by povray as translated instances of the scene of the unit cell
+    (atoms and bonds), instead of replicating the atoms.
+    """
+
+    supercell : tuple # number of replicas along each cell vector
+    cell : np.ndarray # cell of the supercell
+    instanced : np.ndarray # mask of the replicated atoms (all but the molecule for repeat_slab)
+
+    @property
+    def replicas(self) -> np.ndarray:
+        """(K, 3) integer offsets of the replicas, in the same order as in ase Atoms.repeat"""
+        return np.indices(self.supercell).reshape(3, -1).T
+
+
+    def get_bounding_atoms(self, atoms: Atoms) -> tuple:
+        """
+        Atoms of the replicas at the corners of the supercell, plus those that are
+        not replicated, which include the extreme positions of all the atoms
+        along any direction.
+
+        Returns
+        -------
+        indices : np.ndarray
+            Index of each of the bounding atoms in atoms.
+        positions : np.ndarray
+            (M, 3) positions of the bounding atoms.
+        """
+
+        corners = np.unique(np.indices((2, 2, 2)).reshape(3, -1).T
+                            * (np.asarray(self.supercell) - 1), axis=0)
+        replicated = np.flatnonzero(self.instanced)
+        once = np.flatnonzero(~self.instanced)
+        positions = (atoms.positions[replicated][None, :, :]
+                     + (corners @ atoms.cell.array)[:, None, :]).reshape(-1, 3)
+
+        return (np.concatenate([np.tile(replicated, len(corners)), once]),
+                np.concatenate([positions, atoms.positions[once]]))
+
+
+def _prepare_atoms(atoms: 'Atoms | AtomsCustom',
+                   custom_settings: CustomSettings,
+                   supercell: Optional[list] = None,
+                   repeat_slab: bool = False,
+                   instanced_supercell: bool = False,
+                   wrap: bool = False,
+                   range_cut: Optional[tuple] = None,
+                   cut_vacuum: bool = False,
+                   transl_vector: Optional[list[float]] = None,
+                   mol_indices: Optional[list] = None) -> tuple:
+    """
+    Apply the structure transformations (translation, wrap, supercell,
+    vacuum and range cut) before rendering, on a copy of atoms.
+    See render_image for the description of the parameters.
+
+    Returns
+    -------
+    atoms : Atoms | AtomsCustom
+        Transformed copy of the input atoms.
+    mol_indices : list | None
+        Indices of the molecule atoms in the transformed atoms.
+    instances : SupercellInstances | None
+        If instanced_supercell, the supercell to be drawn as instances of
+        the atoms, which are not replicated. None otherwise.
+    z_range : tuple | None
+        (zmin, zmax) heights of the input atoms kept by cut_vacuum and range_cut,
+        where zmin is moved to z = 0. None if there is no cut.
+    """
+
+    # The transformations are applied to the positions array and to the
+    # indices of the original atoms that are kept (replicated for the supercell),
+    # so that the atoms are copied only once, at the end.
+    positions = atoms.positions
+    cell = atoms.cell.array.copy()
+    pbc = atoms.pbc.copy()
+    indices = None # None means all the atoms, in the same order
+    replicated = np.ones(len(atoms), dtype=bool) # mask of the atoms to be drawn as instances
+    instanced_supercell = instanced_supercell and supercell is not None
+    z_range = None
+
+    if transl_vector is not None:
+        positions = positions + transl_vector
+        wrap = True
+
+    if wrap:
+        #wrap the atoms to the unit cell
+        positions = wrap_positions(positions, cell, pbc=pbc, pretty_translation=True)
+
+    if mol_indices is None and custom_settings.mol_indices is not None:
+        mol_indices = custom_settings.mol_indices
+
+    if supercell is not None:
+        natoms = len(atoms)
+        for n_repeats, vec in zip(supercell, cell):
+            if n_repeats != 1 and not vec.any():
+                raise ValueError('Cannot repeat along undefined lattice vector')
+
+        if repeat_slab and mol_indices is None:
+            logging.warning('No molecule indices to exclude from the supercell: '
+                            'replicating all the atoms.')
+        if repeat_slab and mol_indices is not None:
+            replicated = ~_indices_mask(mol_indices, natoms)
+
+        # same order of the replicas as in ase Atoms.repeat
+        replicas = np.indices(supercell).reshape(3, -1).T
+        translations = replicas @ cell
+
+        # the cuts along z are the same for all the replicas only if they are not displaced along z
+        if instanced_supercell and (range_cut is not None or cut_vacuum) \
+            and translations[:, 2].any():
+            logging.debug('Supercell replicated explicitly, since the cuts '
+                          'are different for the replicas along z.')
+            instanced_supercell = False
+
+        if not instanced_supercell:
+            slab = np.flatnonzero(replicated)
+            once = np.flatnonzero(~replicated)
+            positions = np.concatenate([(positions[slab][None, :, :]
+                                         + translations[:, None, :]).reshape(-1, 3),
+                                        positions[once]])
+            indices = np.concatenate([np.tile(slab, len(replicas)), once])
+            cell = cell * np.asarray(supercell)[:, None]
+
+            if mol_indices is not None:
+                if repeat_slab:
+                    # the molecule is appended once after the replicated slab
+                    mol_indices = (len(slab) * len(replicas) + np.arange(len(once))).tolist()
+                else:
+                    # get new mol_indices after supercell expansion
+                    mol_indices = (np.asarray(mol_indices)[:, None]
+                                   + natoms * np.arange(len(replicas))[None, :]).ravel().tolist()
+
+    if cut_vacuum:
+        zmin = positions[:,2].min()
+        positions = positions - [0, 0, zmin] #shift to z=0
+        cell[2,2] = positions[:,2].max() + 1
+        z_range = (zmin, zmin + cell[2,2])
+        pbc = np.array([True,True,False]) #to avoid periodic bonding in z direction
+
+    if range_cut is not None:
+        keep = (positions[:,2] >= range_cut[0]) & (positions[:,2] <= range_cut[1])
+        if mol_indices is not None:
+            # indices of the molecule atoms among the kept atoms
+            mol_mask = _indices_mask(mol_indices, len(keep))
+            mol_indices = np.flatnonzero(mol_mask[keep]).tolist()
+        if instanced_supercell:
+            replicated = replicated[keep]
+        positions = positions[keep] - [0, 0, range_cut[0]] #shift the atoms to the origin of the new cell
+        kept = np.flatnonzero(keep)
+        indices = kept if indices is None else indices[kept]
+        cell[2,2] = range_cut[1] - range_cut[0] #set the new cell height
+        z_shift = z_range[0] if z_range is not None else 0
+        z_range = (z_shift + range_cut[0], z_shift + range_cut[1])
+        pbc = np.array([True,True,False]) #to avoid periodic bonding in z direction
+
+    calc = atoms.calc
+    atoms = atoms.copy() if indices is None else atoms[indices] #do not modify the original object
+    atoms.calc = calc #keep the calculator, if present
+    atoms.positions = positions
+    atoms.cell = cell
+    atoms.pbc = pbc
+
+    instances = None
+    if instanced_supercell:
+        instances = SupercellInstances(supercell=tuple(int(n) for n in supercell),
+                                       cell=cell * np.asarray(supercell)[:, None],
+                                       instanced=replicated)
+
+    return atoms, mol_indices, instances, z_range
+
+
+def _get_camera_dist(atoms: Atoms,
+                     rotations: str,
+                     instances: SupercellInstances | None = None,
+                     whole_cell: bool = False) -> float:
+    """
+    Distance of the camera from the front-most atom, large enough
+    to include the top face of the cell in top views.
+    With whole_cell, large enough also if the front-most atom is at the bottom
+    of the cell, e.g. for the other frames of a trajectory.
+    """
+
+    if 'x' not in rotations and 'y' not in rotations:
+        if instances is None:
+            cell, positions = atoms.cell, atoms.positions
+        else:
+            cell, positions = instances.cell, instances.get_bounding_atoms(atoms)[1]
+        front = min(0, positions[:,2].min()) if whole_cell else positions[:,2].max()
+        dz = cell[2,2] - front + 0.1
+    else:
+        dz = 0
+    return max(2, dz)
+
+
+def _get_image_bounds(atoms: Atoms,
+                      radii: np.ndarray,
+                      rotation: np.ndarray,
+                      fit_to_atoms: bool = True,
+                      instances: SupercellInstances | None = None) -> tuple:
+    """
+    Low and high corners, in the image plane, of the bounding box of the cell
+    and, if fit_to_atoms or if there is no cell, of the atoms (spheres with radii).
+    With instances, the bounding box is that of the whole supercell.
+    """
+
+    im_low = np.full(3, np.inf)
+    im_high = np.full(3, -np.inf)
+
+    if has_cell(atoms):
+        cell = atoms.cell.array if instances is None else instances.cell
+        cell_vertices = get_cell_vertex_points(cell, atoms.get_celldisp().flatten()) @ rotation
+        im_low = np.minimum(im_low, cell_vertices.min(axis=0))
+        im_high = np.maximum(im_high, cell_vertices.max(axis=0))
+
+    if fit_to_atoms or not has_cell(atoms):
+        positions = atoms.positions
+        if instances is not None:
+            indices, positions = instances.get_bounding_atoms(atoms)
+            radii = radii[indices]
+        im_positions = positions @ rotation
+        im_low = np.minimum(im_low, (im_positions - radii[:, None]).min(axis=0))
+        im_high = np.maximum(im_high, (im_positions + radii[:, None]).max(axis=0))
+
+    return im_low, im_high
+
+
+def _bounds_to_bbox(im_low: np.ndarray, im_high: np.ndarray, size: float) -> np.ndarray:
+    """
+    (xlo, ylo, xhi, yhi) bounding box with the same center as the bounds,
+    enlarged by the size factor (as auto_bbox_size in PlottingVariables).
+    """
+
+    middle = (im_low + im_high) / 2
+    half_size = size * (im_high - im_low) / 2
+    return np.array([middle[0] - half_size[0], middle[1] - half_size[1],
+                     middle[0] + half_size[0], middle[1] + half_size[1]])
+
+
+@dataclass
+class FixedView:
+    """
+    Camera and canvas shared by all the frames of a trajectory,
+    so that they are computed only once and all the images have the same size.
+    """
+
+    rotation : np.ndarray # 3x3 rotation matrix
+    bbox : np.ndarray # (xlo, ylo, xhi, yhi) in the image plane, in Angstrom
+    camera_dist : float
+
+
+def get_fixed_view(frames,
+                   custom_settings: CustomSettings,
+                   rotations: str = '',
+                   fit_to: str = 'cell',
+                   **kwargs) -> FixedView:
+    """
+    Compute a single view (camera and bounding box) for all the frames of a trajectory.
+
+    Parameters
+    ----------
+    frames : Iterable[Atoms]
+        Frames of the trajectory.
+    custom_settings : CustomSettings
+        Custom settings for rendering, used for the atomic radii.
+    rotations : str, optional
+        String with the rotations to apply to the image. Default is ''.
+    fit_to : str, optional
+        'cell': fit the bounding box to the cell of the first frame
+        (only the first frame is read, unless it has no cell).
+        'all': fit the bounding box to the atoms and cells of all the frames.
+        Default is 'cell'.
+    **kwargs : dict
+        Structure transformations (supercell, wrap, range_cut, ...),
+        as in render_image.
+
+    Returns
+    -------
+    FixedView
+        View to be passed to render_image for each frame.
+    """
 
-    covalent_bond_nn = CovalentBondNN()
-    pymat_mol = AseAtomsAdaptor.get_molecule(atoms)
+    if fit_to not in ('cell', 'all'):
+        raise ValueError(f"Invalid fit_to '{fit_to}'. Options are 'cell' and 'all'.")
 
-    if mol_indices is None:
-        mol_indices = list(range(len(pymat_mol)))
+    # the bounds of the supercell are found without replicating the atoms
+    kwargs['instanced_supercell'] = True
 
-    high_bondorder_pairs = {}
-    for atom_id in mol_indices:
-        neighbors = covalent_bond_nn.get_nn_info(pymat_mol, atom_id)
+    rotation = rotate(rotations)
+    im_low = np.full(3, np.inf)
+    im_high = np.full(3, -np.inf)
+    camera_dist = 0
 
-        for neighbor in neighbors:
-            bondorder = round(neighbor['weight'])
-            # avoid duplicate pairs
-            if  bondorder >= 2 and (neighbor['site_index'], atom_id) \
-                not in high_bondorder_pairs:
-                high_bondorder_pairs[(atom_id, neighbor['site_index'])] = \
-                    ((0, 0, 0), bondorder, (0.2, 0.2, 0))
+    for frame in frames:
+        atoms, _, instances, _ = _prepare_atoms(frame, custom_settings, **kwargs)
 
-    return high_bondorder_pairs
+        radii = covalent_radii[atoms.numbers] * custom_settings.atomic_radius
+        frame_low, frame_high = _get_image_bounds(atoms, radii, rotation,
+                                                  fit_to_atoms=fit_to == 'all',
+                                                  instances=instances)
+        im_low = np.minimum(im_low, frame_low)
+        im_high = np.maximum(im_high, frame_high)
+
+        if fit_to == 'cell' and has_cell(atoms):
+            # the following frames are not read: the camera is placed far enough
+            # for the atoms anywhere in the cell
+            camera_dist = max(camera_dist, _get_camera_dist(atoms, rotations, instances,
+                                                            whole_cell=True))
+            break
+
+        camera_dist = max(camera_dist, _get_camera_dist(atoms, rotations, instances))
+
+    # same padding as fixed_bounds in render_image
+    bbox = _bounds_to_bbox(im_low, im_high, 1.2)
+
+    return FixedView(rotation=rotation, bbox=bbox, camera_dist=camera_dist)
 
 
 def render_image(atoms: 'Atoms | AtomsCustom',
@@ -228,6 +760,8 @@ def render_image(atoms: 'Atoms | AtomsCustom',
                 custom_settings: CustomSettings,
                 rotations: str = '',
                 supercell: Optional[list] = None,
+                repeat_slab: bool = False,
+                instanced_supercell: bool = False,
                 wrap: bool = False,
                 range_cut: Optional[tuple] = None,
                 cut_vacuum: bool = False,
@@ -241,11 +775,19 @@ def render_image(atoms: 'Atoms | AtomsCustom',
                 arrows_scale: float = 1.0,
                 chg_grid: Optional[np.ndarray] = None,
                 chg_iso_threshold: Optional[float] = None,
+                chg_grid_cache: Optional[GridCache] = None,
+                chg_jobs: int = 1,
+                chg_local_upscale: Optional[int] = None,
+                chg_smooth: int = 0,
                 width_res: Optional[int] = 700,
                 povray: bool = True,
                 transl_vector: Optional[list[float]] = None,
                 mol_indices: Optional[list] = None,
-                fixed_bounds : bool = False):
+                fixed_bounds : bool = False,
+                fixed_view : Optional[FixedView] = None,
+                compact_pov : bool = False,
+                neighbors_cache : Optional[NeighborsCache] = None,
+                slab_height_cache : Optional[SlabHeightCache] = None):
 
     """
     Render an image of an Atoms object using POVray or ASE renderer.
@@ -261,8 +803,15 @@ def render_image(atoms: 'Atoms | AtomsCustom',
     rotations : str, optional
         String with the rotations to apply to the image. Default is ''.
     supercell : list | None, optional
-        List with the number of replicas in each direction.
-        If mol_indices is provided, only the slab is replicated. Default is None.
+        List with the number of replicas in each direction. Default is None.
+    repeat_slab : bool, optional
+        If True, replicate only the slab, i.e. the atoms not in mol_indices
+        (or in custom_settings.mol_indices). The isosurfaces of chg_grid, which
+        include the density of the molecule, are then not replicated. Default is False.
+    instanced_supercell : bool, optional
+        If True (povray only), the scene of the unit cell is declared once,
+        and the supercell is drawn as translated instances of it, instead of
+        replicating the atoms. Much faster for large supercells. Default is False.
     wrap : bool, optional
         If True, wrap the atoms. Default is False.
     range_cut : tuple | None, optional
@@ -289,11 +838,28 @@ def render_image(atoms: 'Atoms | AtomsCustom',
     arrows_scale : float, optional
         Scale factor for the arrows. Default is 1.0 (no scaling).
     chg_grid : np.ndarray | None, optional
-        Charge density grid to use for isosurface rendering.
-        If None, no isosurface is rendered. Default is None.
+        Charge density grid to use for isosurface rendering, spanning the unit cell
+        of atoms. With range_cut or cut_vacuum, only the planes of the grid within
+        the kept heights are used. With supercell (without repeat_slab), the isosurfaces
+        are computed once and drawn as instances for each replica. If None, no isosurface
+        is rendered.
+        Default is None.
     chg_iso_threshold : float | None, optional
         Iso-surface threshold for the charge density.
         If None, VESTA default is used (mean(|rho|) + 2 * std(|rho|)). Default is None.
+    chg_grid_cache : GridCache | None, optional
+        Sidecar cache of the file of chg_grid, used to reuse the isosurface meshes
+        already computed for the same grid and isovalue. Default is None.
+    chg_jobs : int, optional
+        Number of worker processes for the marching cubes of the isosurfaces,
+        which are computed on slabs of the grid. Default is 1.
+    chg_local_upscale : int | None, optional
+        Upscaling factor of chg_grid, applied only to the blocks of the grid around
+        the isosurfaces, when computing them. Default is None (no upscaling).
+    chg_smooth : int, optional
+        Number of iterations of Taubin smoothing of the isosurface meshes, which are then
+        written with vertex normals. Cheaper alternative to the upscaling of the grid.
+        Default is 0 (no smoothing).
     width_res : int | None, optional
         Width resolution of the output image. Default is 700.
     povray : bool, optional
@@ -303,71 +869,65 @@ def render_image(atoms: 'Atoms | AtomsCustom',
         Translation vector for the molecule. Default is None.
     mol_indices : list | None, optional
         List with the indices of the atoms to consider as the molecule. Default is None.
+    fixed_bounds : bool, optional
+        If True, fit the canvas to the unit cell. Default is False.
+    fixed_view : FixedView | None, optional
+        Precomputed view (see get_fixed_view), which overrides rotations and
+        fixed_bounds. Used to render all the frames of a trajectory with
+        the same camera and image size. Default is None.
+    compact_pov : bool, optional
+        If True, write a compact povray scene, with shared texture and sphere
+        declarations, and single cylinders for bonds between atoms that look
+        the same. Smaller files and faster parsing for large systems. Default is False.
+    neighbors_cache : NeighborsCache | None, optional
+        Cache of the neighbors (bonds) of the previous frame of a trajectory,
+        reused if the atoms did not move too much. Default is None.
+    slab_height_cache : SlabHeightCache | None, optional
+        Cache of the slab height for the depth cueing fog of the previous frame
+        of a trajectory, reused if the slab layers did not change. Default is None.
     """
 
-    calc = atoms.calc
-    atoms = atoms.copy() #do not modify the original object
-    atoms.calc = calc #keep the calculator, if present
-
     label = Path(outfile).stem
 
-    if transl_vector is not None:
-        atoms.translate(transl_vector)
-        wrap = True
-
-    if wrap:
-        atoms.wrap(pretty_translation=True) #wrap the atoms to the unit cell
-
-    if mol_indices is None and custom_settings.mol_indices is not None:
-        mol_indices = custom_settings.mol_indices
-
-    if supercell is not None:
-        if mol_indices is not None:
-            n_repeats = np.array(supercell) - 1
-            # get new mol_indces after supercell expansion
-            mol_indices = [i + j * len(atoms) for i in mol_indices for j in range(np.prod(supercell))]
-
-        #     slab_indices = [i for i in range(len(atoms)) if i not in mol_indices]
-        #     slab = atoms[slab_indices]
-        #     slab *= supercell
-        #     atoms = slab + atoms[mol_indices]
-        #     mol_indices = [i + len(slab) for i in range(len(mol_indices))]
-        # else:
-        atoms *= supercell
-
-    if cut_vacuum:
-        atoms.translate([0,0,atoms.positions[:,2].min()]) #shift to z=0
-        atoms.cell[2,2] = atoms.positions[:,2].max() + 1
-        atoms.pbc=[True,True,False] #to avoid periodic bonding in z direction
-
-    if range_cut is not None:
-        del atoms[[atom.index for atom in atoms if atom.z < range_cut[0] or atom.z > range_cut[1]]]
-        atoms.translate([0,0,-range_cut[0]]) #shift the atoms to the origin of the new cell
-        atoms.cell[2,2] = range_cut[1] - range_cut[0] #set the new cell height
-        atoms.pbc=[True,True,False] #to avoid periodic bonding in z direction
+    if instanced_supercell and repeat_slab and colorcode == 'coordnum':
+        # the slab atoms bonded to the molecule have a different coordination number
+        # than their replicas, so the replicas cannot be instances of the same unit cell
+        logging.debug('Supercell replicated explicitly, since the coordination numbers '
+                      'are different for the replicas of the slab.')
+        instanced_supercell = False
+
+    unit_cell = atoms.cell.array
+    atoms, mol_indices, instances, z_range = _prepare_atoms(atoms,
+                                                            custom_settings=custom_settings,
+                                                            supercell=supercell,
+                                                            repeat_slab=repeat_slab,
+                                                            instanced_supercell=instanced_supercell and povray,
+                                                            wrap=wrap,
+                                                            range_cut=range_cut,
+                                                            cut_vacuum=cut_vacuum,
+                                                            transl_vector=transl_vector,
+                                                            mol_indices=mol_indices)
+
+    # neighbors are searched only once, for bonds, bond orders and coordination numbers
+    find_bonds = povray and bonds != 'none' and not custom_settings.nontransparent_atoms
+    if find_bonds or colorcode == 'coordnum':
+        mult = max(custom_settings.bond_radius if find_bonds else 0,
+                   COORDNUM_MULT if colorcode == 'coordnum' else 0)
+        skin = BOND_SKIN if find_bonds else 0
+        if neighbors_cache is not None:
+            neighbors = neighbors_cache.get(atoms, mult, skin)
+        else:
+            neighbors = Neighbors(atoms, mult, skin)
+    else:
+        neighbors = None
 
     #set custom colors if present ###############################################
 
 
     if colorcode is None:
-        #first, apply those of jmol
-        colors = [ custom_settings.color_scheme[atom.number] for atom in atoms]
-
-        #then, substitute user-defined colors
-        if isinstance(atoms, AtomsCustom):
-            species = atoms.custom_labels
-        else:
-            species = atoms.get_chemical_symbols()
-
-        for i, sp in enumerate(species):
-            if mol_indices is not None and i in mol_indices:
-                if sp in custom_settings.molecule_colors:
-                    colors[i] = custom_settings.molecule_colors[sp]
-                    continue
-            if sp in custom_settings.atomic_colors:
-                colors[i] = custom_settings.atomic_colors[sp]
+        colors = _get_colors(atoms, custom_settings, mol_indices)
     else:
-        colors = _get_colorcoded_colors(atoms, colorcode, ccrange)
+        colors = _get_colorcoded_colors(atoms, colorcode, ccrange, neighbors)
 
 
     ############################################################################
@@ -392,37 +952,47 @@ def render_image(atoms: 'Atoms | AtomsCustom',
         # I used 3000 in Xsorb paper. > 1500 is still very good.
 
     if povray: #use POVray renderer (high quality, CPU intensive)
-        pvars = PlottingVariables(atoms,
+        radii = covalent_radii[atoms.numbers] * custom_settings.atomic_radius
+
+        view_atoms = atoms
+        bbox = fixed_view.bbox if fixed_view is not None else None
+        if instances is not None:
+            # draw the cell and fit the canvas of the whole supercell
+            view_atoms = atoms.copy()
+            view_atoms.cell = instances.cell
+            if fixed_view is None and not fixed_bounds:
+                bbox = _bounds_to_bbox(*_get_image_bounds(atoms, radii, rotate(rotations),
+                                                          instances=instances), 1.05)
+
+        pvars = PlottingVariables(view_atoms,
             scale=1,
             radii=custom_settings.atomic_radius,
-            rotation=rotations,
+            rotation=fixed_view.rotation if fixed_view is not None else rotations,
             colors=colors,
+            bbox=bbox,
             auto_bbox_size=1.2 if fixed_bounds else 1.05, #auto_bbox_size is used to set the size of the bounding box
             show_unit_cell=3 if fixed_bounds else 2,  #IMPORTANT: keep the blank space around the cell fixed in trajs
         )
 
+        # per-atom style table for the povray writer
+        ase3, pale = TEXTURES.index('ase3'), TEXTURES.index('pale')
+        styles = np.zeros(len(atoms), dtype=ATOM_STYLE_DTYPE)
+        styles['color'] = colors
+        styles['radius'] = radii
+        styles['texture'] = ase3
+
         if mol_indices is not None and highlight_mol:
-            textures = ['ase3' if i in mol_indices else 'pale' for i in range(len(atoms))]
-        else:
-            textures = None
+            styles['texture'] = np.where(_indices_mask(mol_indices, len(atoms)), ase3, pale)
 
         if custom_settings.nontransparent_atoms:
-            transmittances = []
-            textures = []
-            trans_map = {True: 0.0, False: 0.8}
-            texture_map = {True: 'ase3', False: 'pale'}
-            for i in range(len(atoms)):
-                nontrasp = i in custom_settings.nontransparent_atoms
-                transmittances.append(trans_map[nontrasp])
-                textures.append(texture_map[nontrasp])
-        else:
-            transmittances = None
+            nontransparent = _indices_mask(custom_settings.nontransparent_atoms, len(atoms))
+            styles['texture'] = np.where(nontransparent, ase3, pale)
+            styles['transmittance'] = np.where(nontransparent, 0.0, 0.8)
 
-        if 'x' not in rotations and 'y' not in rotations:
-            dz = atoms.cell[2,2] - atoms.positions[:,2].max() + 0.1
+        if fixed_view is not None:
+            camera_dist = fixed_view.camera_dist
         else:
-            dz = 0
-        camera_dist = max(2, dz)
+            camera_dist = _get_camera_dist(atoms, rotations, instances)
 
 
         povray_settings=dict(
@@ -431,26 +1001,31 @@ def render_image(atoms: 'Atoms | AtomsCustom',
             transparent=False,
             camera_type='orthographic',
             camera_dist=camera_dist,
-            textures=textures,
-            transmittances=transmittances,
+            styles=styles,
             bondlinewidth=custom_settings.bond_line_width,
+            compact=compact_pov,
+            supercell=instances.supercell if instances is not None else None,
+            instanced=instances.instanced if instances is not None else None,
             arrows = _get_arrows(atoms, arrows, pvars.rotation, arrows_scale)
             if arrows is not None else None
         )
 
-        if bonds == 'none' or custom_settings.nontransparent_atoms:
+        if not find_bonds:
             # with transparency, bonds are very ugly
             bondatoms = None
         else:
-            bondatoms = get_bondpairs(atoms, radius=custom_settings.bond_radius)
+            bondatoms = neighbors.get_bondpairs(custom_settings.bond_radius)
             if bonds == 'multiple':
-                high_bondorder_pairs = _calculate_bondorder_pairs(atoms)
-                bondatoms = set_high_bondorder_pairs(bondatoms, high_bondorder_pairs)
+                high_bondorder_pairs = _calculate_bondorder_pairs(neighbors,
+                                                                  custom_settings.bond_radius)
+                bondatoms = _set_high_bondorder_pairs(bondatoms, high_bondorder_pairs)
             povray_settings['bondatoms'] = bondatoms
 
 
         if depth_cueing is not None:
-            constant_fog_height = _calculate_ground_fog_height(atoms) #, mol_indices)
+            constant_fog_height = _calculate_ground_fog_height(atoms, #mol_indices,
+                                                               instances=instances,
+                                                               slab_height_cache=slab_height_cache)
 
             povray_settings['depth_cueing'] = True
             povray_settings['cue_density'] = depth_cueing
@@ -466,19 +1041,52 @@ def render_image(atoms: 'Atoms | AtomsCustom',
                 # VESTA default isosurface: mean(|rho|) + 2 * std(|rho|)
                 chg_iso_threshold = np.mean(np.abs(chg_grid)) + 2 * np.std(np.abs(chg_grid))
 
-            iso_positive = POVRAYIsosurface.from_POVRAY(
-                povray=pov_obj,
-                density_grid=chg_grid,
-                cut_off=chg_iso_threshold,
-                color=(0.80, 0.80, 0.0, 0.3))
-
-            iso_negative = POVRAYIsosurface.from_POVRAY(
-                povray=pov_obj,
-                density_grid=chg_grid,
-                cut_off=-chg_iso_threshold,
-                color=(0.00, 0.80, 0.80, 0.3))
-
-            pov_obj.isosurfaces = [iso_positive, iso_negative]
+            # the grid spans the unit cell of the input atoms: only the planes in the range
+            # kept by the cuts are meshed, and placed at the height of the cut atoms
+            grid, grid_cell, grid_origin, planes = crop_density_grid(chg_grid, unit_cell, z_range)
+            if z_range is not None:
+                grid_origin = grid_origin - [0, 0, z_range[0]]
+            if planes is not None:
+                logging.debug('Isosurfaces on the planes %d-%d of the %s grid',
+                              *planes, chg_grid.shape)
+
+            # the grid of the unit cell is meshed once, and drawn as translated
+            # instances of the mesh for the replicas of a supercell (not with
+            # repeat_slab, since the density of the molecule would be replicated too).
+            # With a cut, the cropped grid already covers the kept heights (periodically),
+            # and only the replicas in the plane are drawn
+            translations = None
+            if supercell is not None and not repeat_slab:
+                replicas = np.indices(supercell).reshape(3, -1).T
+                if planes is not None:
+                    replicas = replicas[replicas[:, 2] == 0]
+                if len(replicas) > 1:
+                    translations = replicas @ unit_cell @ pvars.rotation
+
+            isosurface_settings = dict(density_grid=grid,
+                                       cell=grid_cell @ pvars.rotation,
+                                       cell_origin=pvars.to_image_plane_positions(grid_origin)
+                                                   - pov_obj.offset,
+                                       mesh_cache=chg_grid_cache,
+                                       jobs=chg_jobs,
+                                       upscale=chg_local_upscale or 1,
+                                       smooth=chg_smooth,
+                                       planes=planes,
+                                       translations=translations)
+            pov_obj.isosurfaces = []
+            for cut_off, color, name in ((chg_iso_threshold, (0.80, 0.80, 0.0, 0.3),
+                                          'IsosurfacePositive'),
+                                         (-chg_iso_threshold, (0.00, 0.80, 0.80, 0.3),
+                                          'IsosurfaceNegative')):
+                try:
+                    pov_obj.isosurfaces.append(CachedIsosurface(cut_off=cut_off,
+                                                                color=color,
+                                                                name=name,
+                                                                **isosurface_settings))
+                except (ValueError, RuntimeError):
+                    # e.g. no density above the threshold in the planes kept by the cuts
+                    logging.warning('No isosurface at %g in the charge density grid%s, skipped.',
+                                    cut_off, ' (within the cut)' if planes is not None else '')
 
         #Do the actual rendering
         pov_obj.write(f'{label}.pov').render()
@@ -490,14 +1098,20 @@ def render_image(atoms: 'Atoms | AtomsCustom',
             shutil.move(f'{label}.png', outfile)
 
     else: # use ASE renderer (low quality, does not draw bonds)
+        if fixed_view is not None:
+            view_settings = dict(rotation=fixed_view.rotation,
+                                 bbox=fixed_view.bbox,
+                                 scale=width_res / (fixed_view.bbox[2] - fixed_view.bbox[0]))
+        else:
+            view_settings = dict(rotation=rotations,
+                                 maxwidth=width_res,
+                                 scale=100)
         write(outfile,
               atoms,
               format='png',
               radii = custom_settings.atomic_radius,
-              rotation=rotations,
               colors=colors,
-              maxwidth=width_res,
-              scale=100)
+              **view_settings)
 
 # TODO:
 # -do all manual tests
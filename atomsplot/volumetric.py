@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Readers of volumetric data files (VASP CHGCAR/CHG/LOCPOT, Gaussian cube), which parse
+the grids in bulk, directly into a preallocated array (optionally in single precision).
+'''
+
+from __future__ import annotations
+
+import logging
+
+import numpy as np
+from ase import Atoms
+import ase.io.vasp
+from ase.units import Bohr
+
+logger = logging.getLogger(__name__)
+
+
+# Number of lines of a grid parsed at once
+_CHUNK_LINES = 200000
+# Number of bytes parsed at once, for grids with lines of different lengths
+_CHUNK_BYTES = 16 * 1024**2
+
+
+def _iter_grid_chunks(fd, nvalues : int, chunk_lines : int = _CHUNK_LINES):
+    """
+    Yield the lines of a grid with nvalues values from the binary file fd, in chunks
+    of lines, leaving fd at the end of the grid. All the lines have the same number
+    of values as the first one, except the last one.
+
+    The lines written by VASP have also the same length, so that a chunk of lines
+    is read at once as a block of bytes (checking where the newlines are).
+    Otherwise, the lines are read one by one.
+    """
+
+    first = fd.readline()
+    per_line = len(first.split())
+    if per_line == 0:
+        raise ValueError('Missing volumetric data after the grid dimensions.')
+    yield first
+
+    line_length = len(first)
+    nlines = -(-(nvalues - per_line) // per_line)
+    while nlines > 0:
+        # the last line can be shorter
+        nread = min(chunk_lines, nlines - 1) if nlines > 1 else 1
+        chunk = fd.read(nread * line_length) if nlines > 1 else b''
+        if len(chunk) != nread * line_length \
+            or not np.all(np.frombuffer(chunk, dtype=np.uint8)[line_length - 1::line_length]
+                          == ord('\n')):
+            fd.seek(-len(chunk), 1)
+            chunk = b''.join(fd.readline() for _ in range(nread))
+        if not chunk:
+            raise ValueError('Unexpected end of file in the volumetric data.')
+        nlines -= nread
+        yield chunk
+
+
+def _iter_chunks_to_end(fd, chunk_bytes : int = _CHUNK_BYTES):
+    """
+    Yield the rest of the binary file fd in chunks of whole lines.
+    """
+
+    while True:
+        chunk = fd.read(chunk_bytes)
+        if not chunk:
+            return
+        yield chunk + fd.readline()
+
+
+def _parse_values(chunks, nvalues : int, dtype=float) -> np.ndarray:
+    """
+    Parse the whitespace-separated values in the chunks of text (bytes)
+    into a single array of nvalues values of type dtype.
+    """
+
+    values = np.empty(nvalues, dtype=dtype)
+    filled = 0
+    for chunk in chunks:
+        chunk_values = np.fromstring(chunk, dtype=dtype, sep=' ')
+        if filled + len(chunk_values) > nvalues:
+            raise ValueError('Too many values in the volumetric data.')
+        values[filled:filled + len(chunk_values)] = chunk_values
+        filled += len(chunk_values)
+
+    if filled != nvalues:
+        raise ValueError(f'Expected {nvalues} values in the volumetric data, found {filled}.')
+
+    return values
+
+
+def read_vasp_volumetric(filename : str, block : int = 0, dtype=float) -> tuple:
+    """
+    Read the structure and a volumetric grid from a VASP CHGCAR, CHG or LOCPOT file
+    (or any file with the same layout, e.g. PARCHG or ELFCAR).
+
+    Only the requested grid is parsed: the previous ones (and the augmentation
+    occupancies of CHGCAR) are skipped, and the file is not read past it.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file.
+    block : int, optional
+        Index of the grid in the file: 0 is the total density (or the potential),
+        1 the magnetization for spin-polarized calculations
+        (1, 2, 3 for mx, my, mz in non-collinear ones). Default is 0.
+    dtype : data-type, optional
+        Type of the grid, e.g. np.float32 to halve the memory. Default is float.
+
+    Returns
+    -------
+    atoms : Atoms
+        Atomic structure.
+    grid : np.ndarray
+        3D grid with the values as written in the file
+        (for CHGCAR/CHG, the density multiplied by the cell volume).
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid volumetric file, or the block is not present.
+    """
+
+    with open(filename, 'r', encoding='utf-8') as fd:
+        atoms = ase.io.vasp.read_vasp_configuration(fd)
+        fd.readline() # empty line after the positions
+        dims_line = fd.readline()
+        data_start = fd.tell()
+
+    dims = dims_line.encode().split()
+    try:
+        shape = tuple(int(n) for n in dims)
+    except ValueError:
+        shape = ()
+    if len(shape) != 3:
+        raise ValueError(f'Invalid grid dimensions in {filename}: {dims_line.strip()}')
+
+    # the grids are read as bytes, without decoding the text
+    with open(filename, 'rb') as fd:
+        fd.seek(data_start)
+        for iblock in range(block):
+            for _ in _iter_grid_chunks(fd, np.prod(shape)):
+                pass
+            # the next grid starts after a line with its dimensions,
+            # possibly after the augmentation occupancies and magnetic moments
+            for line in fd:
+                if line.split() == dims:
+                    break
+            else:
+                raise ValueError(f'Only {iblock + 1} volumetric grids found in {filename}.')
+
+        # written in Fortran order (x fastest)
+        grid = _parse_values(_iter_grid_chunks(fd, np.prod(shape)),
+                             np.prod(shape), dtype).reshape(shape, order='F')
+
+    logger.debug('Read %s grid %d with shape %s', filename, block, shape)
+
+    return atoms, grid
+
+
+def read_cube_volumetric(filename : str, dtype=float) -> tuple:
+    """
+    Read the structure and the volumetric grid from a Gaussian cube file,
+    with the same conventions as ase.io.cube.read_cube (positions and cell in Angstrom,
+    origin of the grid ignored, 'OUTER LOOP' axes order and castep2cube files),
+    but parsing the grid in bulk. If the file has more values per grid point,
+    only the first one is returned.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file.
+    dtype : data-type, optional
+        Type of the grid, e.g. np.float32 to halve the memory. Default is float.
+
+    Returns
+    -------
+    atoms : Atoms
+        Atomic structure.
+    grid : np.ndarray
+        3D grid with the values as written in the file.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid cube file.
+    """
+
+    with open(filename, 'rb') as fd:
+        fd.readline() # first comment line
+        comment = fd.readline().decode(errors='replace').upper()
+
+        # the second comment line can contain the order of the axes
+        axes = []
+        if 'OUTER LOOP' in comment:
+            axes = ['XYZ'.index(s[0]) for s in comment.split()[2::3]]
+        if not axes:
+            axes = [0, 1, 2]
+        # in castep2cube files the last voxel along each direction is equal to the first one
+        castep = 'CASTEP2CUBE' in comment
+
+        fields = fd.readline().split()
+        num_atoms = int(fields[0])
+        # negative number of atoms: extra line(s) with labels after the positions
+        has_labels = num_atoms < 0
+        num_atoms = abs(num_atoms)
+        # optional number of values per grid point
+        num_val = int(fields[4]) if len(fields) == 5 else 1
+
+        shape = []
+        cell = np.empty((3, 3))
+        for i in range(3):
+            n, x, y, z = (float(f) for f in fd.readline().split())
+            shape.append(int(n))
+            cell[i] = (n - 1 if castep else n) * Bohr * np.array([x, y, z])
+
+        numbers = np.empty(num_atoms, dtype=int)
+        positions = np.empty((num_atoms, 3))
+        for i in range(num_atoms):
+            fields = fd.readline().split()
+            numbers[i] = int(fields[0])
+            positions[i] = [float(f) for f in fields[2:5]]
+
+        if has_labels:
+            fields = fd.readline().split()
+            nlabels = int(fields[0])
+            nread = len(fields) - 1
+            while nread < nlabels:
+                nread += len(fd.readline().split())
+
+        values = _parse_values(_iter_chunks_to_end(fd), np.prod(shape) * num_val, dtype)
+
+    atoms = Atoms(numbers=numbers, positions=positions * Bohr, cell=cell,
+                  pbc=True if castep else [v.any() for v in cell])
+
+    if num_val > 1:
+        values = values[::num_val].copy()
+    # written in C order, with the given order of the axes
+    grid = values.reshape(shape)
+    if axes != [0, 1, 2]:
+        grid = grid.transpose(axes)
+    if castep:
+        grid = grid[:-1, :-1, :-1]
+
+    logger.debug('Read %s grid with shape %s', filename, grid.shape)
+
+    return atoms, grid
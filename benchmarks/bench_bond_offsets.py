@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Microbenchmark of the offsets of double and triple bonds, rotated perpendicular to
+the bonds all at once, against the previous per-bond rotation with an Atoms('H3')
+and set_angle. The rotated offsets are checked to be equal.
+
+Usage: python bench_bond_offsets.py [--bonds N]
+'''
+
+import time
+import argparse
+
+import numpy as np
+from ase import Atoms
+
+from atomsplot.ase_custom.povray import _perpendicular_bond_offsets
+
+
+def reference_bond_offset(cell, posa, posb, bond_offset):
+    """Offset of one bond as rotated by the previous writer (copied from write_pov)."""
+
+    tmp_atoms = Atoms('H3')
+    tmp_atoms.set_cell(cell)
+    tmp_atoms.set_positions([
+        posa,
+        posb,
+        posb + np.array(bond_offset),
+    ])
+    tmp_atoms.center()
+    tmp_atoms.set_angle(0, 1, 2, 90)
+    return tmp_atoms[2].position - tmp_atoms[1].position
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bonds', type=int, default=10000,
+                        help='number of double and triple bonds (default: 10000)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    cell = np.eye(3) * 50
+    posa = rng.random((args.bonds, 3)) * 50
+    # bonds 1.1-1.6 A long, in random directions
+    directions = rng.normal(size=(args.bonds, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    posb = posa + directions * rng.uniform(1.1, 1.6, args.bonds)[:, None]
+    # default offset of the writer (bondlinewidth, bondlinewidth, 0), and random ones
+    bond_offsets = np.where(rng.random(args.bonds)[:, None] < 0.5, [0.1, 0.1, 0.0],
+                            rng.normal(scale=0.1, size=(args.bonds, 3)))
+
+    start = time.perf_counter()
+    reference = np.array([reference_bond_offset(cell, a, b, offset)
+                          for a, b, offset in zip(posa, posb, bond_offsets)])
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    offsets = _perpendicular_bond_offsets(posa - posb, bond_offsets)
+    vectorized_time = time.perf_counter() - start
+
+    max_difference = np.abs(offsets - reference).max()
+    print(f'{args.bonds} bonds')
+    print(f'per bond    {reference_time:>8.3f} s')
+    print(f'vectorized  {vectorized_time:>8.4f} s')
+    print(f'speedup {reference_time / vectorized_time:.0f}x, '
+          f'max difference {max_difference:.1e} A')
+    if not np.allclose(offsets, reference, rtol=0, atol=1e-9):
+        raise SystemExit('The offsets differ from the reference.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Benchmark of the smoothed isosurfaces of the native grid (-chgsm) against the
+isosurfaces of the upscaled grid (-chgu 2, -chgu 3): time to compute and format
+the mesh, number of triangles and size of the mesh in the povray scene.
+
+Usage: python bench_isosurface_smoothing.py [file.cube] [--iterations N]
+Without a file, a synthetic grid with a few hundred gaussian lobes is used.
+'''
+
+import time
+import argparse
+
+import numpy as np
+from scipy.ndimage import zoom
+
+from atomsplot.isosurface import CachedIsosurface
+from atomsplot.volumetric import read_cube_volumetric
+
+
+def synthetic_grid(shape=(120, 120, 160), nlobes=300, seed=0):
+    """Sum of gaussian lobes of both signs at random positions in a periodic unit cell."""
+
+    rng = np.random.default_rng(seed)
+    axes = [np.arange(n) / n for n in shape]
+    grid = np.zeros(shape)
+    for center, sign in zip(rng.random((nlobes, 3)), rng.choice([-1, 1], nlobes)):
+        # separable gaussian, with periodic distances
+        factors = [np.exp(-(((x - c + 0.5) % 1 - 0.5) / 0.03)**2) for x, c in zip(axes, center)]
+        grid += sign * np.einsum('i,j,k->ijk', *factors)
+    return np.eye(3) * 15, grid
+
+
+def run(grid, cell, threshold, **kwargs):
+    """Compute and format the positive isosurface, returning time, triangles and scene size."""
+
+    start = time.perf_counter()
+    iso = CachedIsosurface(density_grid=grid, cut_off=threshold, cell=cell,
+                           cell_origin=np.zeros(3), **kwargs)
+    mesh = iso.format_mesh()
+    return time.perf_counter() - start, len(iso.faces), len(mesh)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filename', nargs='?', help='cube file (default: synthetic grid)')
+    parser.add_argument('--iterations', type=int, default=5,
+                        help='iterations of Taubin smoothing (default: 5)')
+    args = parser.parse_args()
+
+    if args.filename is not None:
+        atoms, grid = read_cube_volumetric(args.filename)
+        cell = atoms.cell.array
+    else:
+        cell, grid = synthetic_grid()
+    threshold = np.mean(np.abs(grid)) + 2 * np.std(np.abs(grid))
+    print(f'grid {grid.shape}, isovalue {threshold:.4g}')
+
+    print(f'{"case":<20}{"time (s)":>10}{"triangles":>12}{"scene (MB)":>12}')
+    cases = [('native', {}, 1),
+             (f'-chgsm {args.iterations}', {'smooth': args.iterations}, 1),
+             ('-chgu 2', {}, 2),
+             ('-chgu 3', {}, 3)]
+    for name, kwargs, upscale in cases:
+        start = time.perf_counter()
+        # -chgu upscales the whole grid when it is read, as in _read_charge_file
+        case_grid = zoom(grid, upscale, order=3) if upscale > 1 else grid
+        upscale_time = time.perf_counter() - start
+        elapsed, ntriangles, size = run(case_grid, cell, threshold, **kwargs)
+        print(f'{name:<20}{upscale_time + elapsed:>10.2f}{ntriangles:>12d}{size / 1e6:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
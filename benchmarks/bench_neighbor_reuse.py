@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Benchmark of the neighbor list reused across the frames of a trajectory
+(NeighborsCache, Verlet list) against a new search for every frame, on a
+thermally vibrating Pt(111) slab. The per-frame timings of both are printed,
+and the bonds and coordination numbers of each frame are checked to be equal.
+
+Usage: python bench_neighbor_reuse.py [--size N] [--frames N] [--amplitude A]
+'''
+
+import time
+import argparse
+
+import numpy as np
+from ase.build import fcc111
+
+from atomsplot.neighbors import Neighbors, NeighborsCache, BOND_SKIN, COORDNUM_MULT
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=40,
+                        help='Pt(111) slab of size x size x 4 atoms (default: 40)')
+    parser.add_argument('--frames', type=int, default=20,
+                        help='number of frames (default: 20)')
+    parser.add_argument('--amplitude', type=float, default=0.05,
+                        help='random displacement of each atom per frame, in A (default: 0.05)')
+    args = parser.parse_args()
+
+    slab = fcc111('Pt', size=(args.size, args.size, 4), vacuum=10.0)
+    rng = np.random.default_rng(0)
+    frames = []
+    for _ in range(args.frames):
+        slab = slab.copy()
+        slab.positions += rng.normal(scale=args.amplitude / np.sqrt(3), size=(len(slab), 3))
+        frames.append(slab)
+    print(f'{len(slab)} atoms, {args.frames} frames')
+
+    cache = NeighborsCache()
+    rebuild_times = []
+    reuse_times = []
+    for i, atoms in enumerate(frames):
+        start = time.perf_counter()
+        fresh = Neighbors(atoms, COORDNUM_MULT, BOND_SKIN)
+        bonds = fresh.select(1.1, BOND_SKIN)
+        coordnums = fresh.get_coordination_numbers()
+        rebuild_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        reused = cache.get(atoms, COORDNUM_MULT, BOND_SKIN)
+        reused_bonds = reused.select(1.1, BOND_SKIN)
+        reused_coordnums = reused.get_coordination_numbers()
+        reuse_times.append(time.perf_counter() - start)
+
+        if not (np.array_equal(fresh.a[bonds], reused.a[reused_bonds])
+                and np.array_equal(fresh.b[bonds], reused.b[reused_bonds])
+                and np.array_equal(fresh.offsets[bonds], reused.offsets[reused_bonds])
+                and np.array_equal(coordnums, reused_coordnums)):
+            raise SystemExit(f'The neighbors of frame {i} differ from a new search.')
+
+    print('frame   rebuild (s)   reuse (s)')
+    for i, (rebuild_time, reuse_time) in enumerate(zip(rebuild_times, reuse_times)):
+        print(f'{i:>5}   {rebuild_time:>11.4f}   {reuse_time:>9.4f}')
+    print(f'total   {sum(rebuild_times):>11.3f}   {sum(reuse_times):>9.3f}')
+    print(f'{cache.n_searches} searches and {cache.n_updates} updates with reuse, '
+          f'speedup {sum(rebuild_times) / sum(reuse_times):.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Benchmark of the parallel rendering of trajectory frames: wall time of
+setup_rendering on a generated trajectory against the number of jobs (--jobs).
+
+Usage: python bench_parallel_frames.py [--frames N] [--jobs 1 2 4] [--no-povray]
+The frames are rendered with povray, or with the ase renderer with --no-povray
+(e.g. where povray is not installed).
+'''
+
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from ase import Atoms
+from ase.build import fcc111, molecule, add_adsorbate
+from ase.io import write
+
+from atomsplot.functions import setup_rendering
+
+
+def write_trajectory(filename, nframes, seed=0):
+    """Trajectory of a molecule on a Pt(111) slab, with random displacements."""
+
+    slab = fcc111('Pt', size=(4, 4, 3), vacuum=8.0)
+    add_adsorbate(slab, molecule('CH3OH'), 2.0, 'ontop')
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(nframes):
+        positions = slab.positions + rng.normal(scale=0.05, size=slab.positions.shape)
+        frames.append(Atoms(slab.numbers, positions, cell=slab.cell, pbc=slab.pbc))
+    write(filename, frames, format='extxyz')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=32, help='number of frames (default: 32)')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4],
+                        help='numbers of jobs to compare (default: 1 2 4)')
+    parser.add_argument('--no-povray', action='store_true', help='use the ase renderer')
+    args = parser.parse_args()
+
+    main_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            write_trajectory('traj.xyz', args.frames)
+            print(f'{args.frames} frames, {"ase" if args.no_povray else "povray"} renderer')
+            print(f'{"jobs":>6}{"time (s)":>10}{"speedup":>10}')
+            reference = None
+            for jobs in args.jobs:
+                start = time.perf_counter()
+                setup_rendering('traj.xyz', index=':', jobs=jobs, povray=not args.no_povray)
+                elapsed = time.perf_counter() - start
+                reference = reference or elapsed
+                print(f'{jobs:>6d}{elapsed:>10.2f}{reference / elapsed:>10.2f}')
+        finally:
+            os.chdir(main_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Benchmark of the povray scene writer (atoms and bonds formatted in bulk) against the
+previous writer, which built the scene with per-atom and per-bond string concatenation.
+Both write the same large slab scene, with single, double and triple bonds.
+The previous writer is the reference of tests/test_povray.py, which checks that
+the two outputs are identical.
+
+Usage: python bench_povray_writer.py [--size N] [--layers L]
+'''
+
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from ase.build import fcc111
+from ase.io.pov import POVRAY
+
+import atomsplot.ase_custom.povray # pylint: disable=unused-import # patches POVRAY
+from atomsplot.neighbors import Neighbors
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'tests'))
+from test_povray import write_pov_reference # pylint: disable=wrong-import-position
+
+
+def make_scene(size, layers, seed=0):
+    """POVRAY scene of a Pt(111) slab with all its bonds, some of them double or triple."""
+
+    slab = fcc111('Pt', size=(size, size, layers), vacuum=5.0)
+    rng = np.random.default_rng(seed)
+    bonds = Neighbors(slab, 1.0, 0.3).get_bondpairs(1.0)
+    orders = rng.choice([1, 2, 3], size=len(bonds), p=[0.8, 0.1, 0.1])
+    bondatoms = [(a, b, offset, order) if order > 1 else (a, b, offset)
+                 for (a, b, offset), order in zip(bonds, orders)]
+
+    cell = slab.cell.array
+    corners = np.indices((2, 2, 2)).reshape(3, -1).T @ cell
+    return POVRAY(cell=cell,
+                  cell_vertices=corners,
+                  positions=slab.positions,
+                  diameters=np.full(len(slab), 1.4),
+                  colors=rng.random((len(slab), 3)),
+                  image_width=cell[0, 0],
+                  image_height=cell[1, 1],
+                  textures=rng.choice(['ase3', 'pale'], size=len(slab)).tolist(),
+                  transmittances=rng.choice([0.0, 0.8], size=len(slab)).tolist(),
+                  bondatoms=bondatoms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=40,
+                        help='number of atoms along the two in-plane directions (default: 40)')
+    parser.add_argument('--layers', type=int, default=6, help='number of layers (default: 6)')
+    args = parser.parse_args()
+
+    scene = make_scene(args.size, args.layers)
+    print(f'{len(scene.positions)} atoms, {len(scene.bondatoms)} bonds')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        timings = {}
+        for name, writer in (('previous', write_pov_reference), ('bulk', POVRAY.write_pov)):
+            start = time.perf_counter()
+            writer(scene, Path(tmpdir) / f'{name}.pov')
+            timings[name] = time.perf_counter() - start
+            print(f'{name:<10}{timings[name]:>8.2f} s')
+    print(f'speedup {timings["previous"] / timings["bulk"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: Enrico Pedretti
+
+'''
+Benchmark of the structure transformations before rendering (supercell, cut of
+the vacuum, range cut) on about a million atoms. It compares the index masks of
+_prepare_atoms with the previous pipeline, which used Atoms.repeat and deleted
+atoms one by one. The prepared structures are checked to be equal.
+
+Usage: python bench_prepare_atoms.py [--size N] [--supercell NX NY NZ]
+'''
+
+import time
+import argparse
+
+import numpy as np
+from ase.build import fcc111
+
+from atomsplot.render import _prepare_atoms
+from atomsplot.settings import CustomSettings
+
+
+def reference_prepare_atoms(atoms, supercell=None, range_cut=None, cut_vacuum=False,
+                            mol_indices=None):
+    """Previous pipeline on Atoms objects (copied from _prepare_atoms, with the cut
+    of the vacuum moved to z=0 and the molecule indices kept after a range cut)."""
+
+    calc = atoms.calc
+    atoms = atoms.copy()
+    atoms.calc = calc
+
+    if supercell is not None:
+        if mol_indices is not None:
+            mol_indices = [i + j * len(atoms) for i in mol_indices
+                           for j in range(np.prod(supercell))]
+        atoms *= supercell
+
+    if cut_vacuum:
+        atoms.translate([0, 0, -atoms.positions[:, 2].min()])
+        atoms.cell[2, 2] = atoms.positions[:, 2].max() + 1
+        atoms.pbc = [True, True, False]
+
+    if range_cut is not None:
+        deleted = [atom.index for atom in atoms if atom.z < range_cut[0] or atom.z > range_cut[1]]
+        if mol_indices is not None:
+            new_indices = np.cumsum(np.isin(np.arange(len(atoms)), deleted, invert=True)) - 1
+            deleted_set = set(deleted)
+            mol_indices = [new_indices[i] for i in mol_indices if i not in deleted_set]
+        del atoms[deleted]
+        atoms.translate([0, 0, -range_cut[0]])
+        atoms.cell[2, 2] = range_cut[1] - range_cut[0]
+        atoms.pbc = [True, True, False]
+
+    return atoms, mol_indices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=25,
+                        help='Pt(111) slab of size x size x size atoms (default: 25)')
+    parser.add_argument('--supercell', type=int, nargs=3, default=[8, 8, 1],
+                        help='supercell (default: 8 8 1)')
+    args = parser.parse_args()
+
+    slab = fcc111('Pt', size=(args.size,) * 3, vacuum=10.0)
+    # the top layer plays the molecule
+    mol_indices = list(np.flatnonzero(slab.positions[:, 2] > slab.positions[:, 2].max() - 0.1))
+    zmax = slab.positions[:, 2].max()
+    kwargs = dict(supercell=args.supercell, cut_vacuum=True, range_cut=(zmax / 2, zmax),
+                  mol_indices=mol_indices)
+    print(f'{len(slab) * np.prod(args.supercell)} atoms after the supercell')
+
+    start = time.perf_counter()
+    reference, reference_mol = reference_prepare_atoms(slab, **kwargs)
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    atoms, mol, _, _ = _prepare_atoms(slab, CustomSettings(), **kwargs)
+    masks_time = time.perf_counter() - start
+
+    print(f'{len(atoms)} atoms after the cut')
+    print(f'Atoms.repeat and del  {reference_time:>8.2f} s')
+    print(f'index masks           {masks_time:>8.2f} s')
+    print(f'speedup {reference_time / masks_time:.0f}x')
+    if not (np.array_equal(atoms.numbers, reference.numbers)
+            and np.allclose(atoms.positions, reference.positions, rtol=0, atol=1e-10)
+            and np.allclose(atoms.cell.array, reference.cell.array, rtol=0, atol=1e-10)
+            and sorted(mol) == sorted(reference_mol)):
+        raise SystemExit('The prepared structures differ from the reference.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+'''
+Shared fixtures for the tests.
+'''
+
+import shutil
+
+import pytest
+from ase.io.pov import POVRAYInputs
+
+
+@pytest.fixture(autouse=True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    """Run each test in its own directory, without the image_settings.json of the caller."""
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def pov_scenes(tmp_path, monkeypatch):
+    """
+    Replace the povray call with a copy of the scene, so that render_image can run without
+    povray. The scene is also copied as the .png image that povray would write.
+    Returns the list of the paths of the copied .pov files, in order of rendering
+    (only those rendered in the process of the test, not in forked workers).
+    """
+
+    scenes = []
+
+    def render(self, *args, **kwargs): # pylint: disable=unused-argument
+        scene = tmp_path / f'scene_{len(scenes)}.pov'
+        shutil.copy(self.path.with_suffix('.pov'), scene)
+        shutil.copy(self.path.with_suffix('.pov'), self.path.with_suffix('.png'))
+        scenes.append(scene)
+
+    monkeypatch.setattr(POVRAYInputs, 'render', render)
+    return scenes
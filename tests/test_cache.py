@@ -0,0 +1,195 @@
+'''
+Tests of the caches of parsed grids, isosurface meshes and rendered frames.
+'''
+
+import os
+
+import numpy as np
+import pytest
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from atomsplot.cache import FrameCache, GridCache, hash_atoms
+
+
+SETTINGS = ('cube', 1, False)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'grid.cube'
+    path.write_text('grid data\n' * 100)
+    return path
+
+
+def _atoms():
+    return Atoms('CO', positions=[[0, 0, 0], [0, 0, 1.13]], cell=[5, 5, 5], pbc=True)
+
+
+def _saved_cache(source):
+    grid = np.arange(60, dtype=float).reshape(3, 4, 5)
+    GridCache(source, SETTINGS).save(_atoms(), grid)
+    return grid
+
+
+def test_grid_cache_round_trip(source):
+    grid = _saved_cache(source)
+    atoms, cached_grid = GridCache(source, SETTINGS).load()
+
+    np.testing.assert_array_equal(cached_grid, grid)
+    assert isinstance(cached_grid, np.memmap)
+    assert not cached_grid.flags.writeable
+    assert atoms == _atoms()
+
+
+def test_grid_cache_missing(source):
+    assert GridCache(source, SETTINGS).load() is None
+
+
+def _modify_content(path):
+    stat = os.stat(path)
+    path.write_text('grid Data\n' * 100)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def _modify_size(path):
+    stat = os.stat(path)
+    with open(path, 'a') as f:
+        f.write('more\n')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def _modify_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+@pytest.mark.parametrize('modify', [_modify_content, _modify_size, _modify_mtime])
+def test_grid_cache_invalidated_by_source(source, modify):
+    _saved_cache(source)
+    modify(source)
+    assert GridCache(source, SETTINGS).load() is None
+
+
+def test_grid_cache_invalidated_by_settings(source):
+    _saved_cache(source)
+    assert GridCache(source, ('cube', 2, False)).load() is None
+
+
+def test_grid_cache_replaced(source):
+    _saved_cache(source)
+    _modify_content(source)
+    new_grid = np.ones((2, 2, 2))
+    GridCache(source, SETTINGS).save(_atoms(), new_grid)
+    np.testing.assert_array_equal(GridCache(source, SETTINGS).load()[1], new_grid)
+
+
+def test_grid_cache_corrupted_metadata(source):
+    _saved_cache(source)
+    cache = GridCache(source, SETTINGS)
+    with open(cache.meta_path, 'wb') as f:
+        f.write(b'not a npz file')
+    assert cache.load() is None
+
+
+def test_grid_cache_shape_mismatch(source):
+    _saved_cache(source)
+    cache = GridCache(source, SETTINGS)
+    np.save(cache.grid_path, np.zeros((2, 2, 2)))
+    assert cache.load() is None
+
+
+def test_mesh_cache(source):
+    _saved_cache(source)
+    cache = GridCache(source, SETTINGS)
+    verts = np.random.default_rng(0).random((10, 3))
+    faces = np.arange(12).reshape(4, 3) % 10
+    mesh_settings = (0.1, np.eye(3))
+
+    assert cache.load_mesh(mesh_settings) is None
+    cache.save_mesh(mesh_settings, verts, faces)
+
+    cached_verts, cached_faces = GridCache(source, SETTINGS).load_mesh(mesh_settings)
+    assert cached_verts.dtype == np.float32 and cached_faces.dtype == np.int32
+    np.testing.assert_allclose(cached_verts, verts, rtol=1e-6)
+    np.testing.assert_array_equal(cached_faces, faces)
+    assert cache.load_mesh((0.2, np.eye(3))) is None
+
+
+def test_mesh_cache_invalidated(source):
+    _saved_cache(source)
+    cache = GridCache(source, SETTINGS)
+    cache.save_mesh((0.1,), np.zeros((3, 3)), np.zeros((1, 3), dtype=int))
+
+    _modify_mtime(source)
+    assert GridCache(source, SETTINGS).load_mesh((0.1,)) is None
+
+    # saving the grid again removes the meshes of the previous grid
+    cache.save(_atoms(), np.zeros((2, 2, 2)))
+    assert not list(source.parent.glob('*.mesh-*.npz'))
+
+
+def test_hash_atoms():
+    atoms = _atoms()
+    assert hash_atoms(atoms.copy()) == hash_atoms(atoms)
+
+    moved = atoms.copy()
+    moved.positions[1, 2] += 1e-6
+    tagged = atoms.copy()
+    tagged.set_tags([0, 1])
+    with_forces = atoms.copy()
+    with_forces.calc = SinglePointCalculator(with_forces, forces=np.ones((2, 3)))
+    keys = {hash_atoms(a) for a in (atoms, moved, tagged, with_forces)}
+    assert len(keys) == 4
+
+
+def test_frame_cache(tmp_path):
+    outfile = str(tmp_path / 'frame_0.png')
+    cache = FrameCache(str(tmp_path), settings=({'supercell': [2, 2, 1]},))
+    key = cache.frame_key(_atoms())
+
+    assert not cache.is_valid(outfile, key)
+    cache.add(outfile, key)
+    # the image is not there
+    assert not cache.is_valid(outfile, key)
+
+    with open(outfile, 'w') as f:
+        f.write('image')
+    assert cache.is_valid(outfile, key)
+
+    # the manifest is read again
+    cache = FrameCache(str(tmp_path), settings=({'supercell': [2, 2, 1]},))
+    assert cache.frame_key(_atoms()) == key
+    assert cache.is_valid(outfile, key)
+
+    moved = _atoms()
+    moved.positions[0, 0] += 0.1
+    assert not cache.is_valid(outfile, cache.frame_key(moved))
+
+
+def test_frame_cache_settings(tmp_path):
+    outfile = str(tmp_path / 'frame_0.png')
+    with open(outfile, 'w') as f:
+        f.write('image')
+    cache = FrameCache(str(tmp_path), settings=({'supercell': [2, 2, 1]},))
+    cache.add(outfile, cache.frame_key(_atoms()))
+
+    cache = FrameCache(str(tmp_path), settings=({'supercell': [3, 2, 1]},))
+    assert not cache.is_valid(outfile, cache.frame_key(_atoms()))
+
+
+def test_frame_cache_manifest(tmp_path):
+    outfile = str(tmp_path / 'frame_0.png')
+    with open(outfile, 'w') as f:
+        f.write('image')
+    cache = FrameCache(str(tmp_path), settings=())
+    cache.add(outfile, 'old')
+    cache.add(outfile, 'new')
+    with open(cache.path, 'a') as f:
+        f.write('truncated\n\n')
+
+    cache = FrameCache(str(tmp_path), settings=())
+    # the last entry wins, and malformed lines are skipped
+    assert cache.entries == {'frame_0.png': 'new'}
+    assert cache.is_valid(outfile, 'new')
+    assert not cache.is_valid(outfile, 'old')
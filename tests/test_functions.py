@@ -0,0 +1,124 @@
+'''
+Tests of the rendering of trajectories.
+'''
+
+import os
+import time
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from ase.build import molecule
+from ase.io import write
+
+from atomsplot.functions import _imap_ordered, _render_frames, setup_rendering
+from atomsplot.settings import CustomSettings
+
+
+def _trajectory(nframes=7):
+    frames = []
+    for i in range(nframes):
+        atoms = molecule('CH3CH2OH')
+        atoms.rotate(10 * i, 'z')
+        frames.append(atoms)
+    return frames
+
+
+def _rendered_frames(frames, jobs, directory):
+    os.makedirs(directory)
+    outfiles = [os.path.abspath(os.path.join(directory, f'frame_{i:05d}.png'))
+                for i in range(len(frames))]
+    # the third frame is already rendered
+    with open(outfiles[2], 'w', encoding='utf-8') as f:
+        f.write('cached')
+    frames = [(None if i == 2 else atoms, outfile)
+              for i, (atoms, outfile) in enumerate(zip(frames, outfiles))]
+    return list(_render_frames(iter(frames), jobs, CustomSettings()))
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='the povray stub is inherited only by forked workers')
+def test_parallel_frames_match_serial(pov_scenes):
+    frames = _trajectory()
+    serial = _rendered_frames(frames, 1, 'serial')
+    # the frame already rendered is skipped
+    assert len(pov_scenes) == len(frames) - 1
+    parallel = _rendered_frames(frames, 3, 'parallel')
+
+    assert [os.path.basename(f) for f in parallel] == [os.path.basename(f) for f in serial]
+    assert sorted(os.listdir('parallel')) == sorted(os.listdir('serial'))
+    contents = []
+    for serial_file, parallel_file in zip(serial, parallel):
+        with open(serial_file, encoding='utf-8') as f1, \
+             open(parallel_file, encoding='utf-8') as f2:
+            contents.append(f1.read())
+            assert f2.read() == contents[-1]
+    # the images (copies of the scenes) of the frames are all different
+    assert len(set(contents)) == len(frames)
+    # the scratch directories of the workers are removed
+    assert not os.path.exists('.scratch')
+
+
+def test_imap_ordered_window():
+    window = 3
+    in_flight = 0
+    max_in_flight = 0
+    consumed = []
+
+    def items():
+        for i in range(20):
+            yield i
+
+    def submit(item):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        future = Future()
+        future.set_result(item)
+        return future
+
+    for result in _imap_ordered(submit, items(), window):
+        in_flight -= 1
+        consumed.append(result)
+
+    assert consumed == list(range(20))
+    assert max_in_flight == window
+
+
+def test_imap_ordered_order():
+    # later tasks finish first
+    delays = np.linspace(0.05, 0, 8)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        def submit(i):
+            return executor.submit(lambda: (time.sleep(delays[i]), i)[1])
+        results = list(_imap_ordered(submit, range(8), window=4))
+    assert results == list(range(8))
+
+
+def _rendered_scenes(pov_scenes, **kwargs) -> list:
+    """Frames whose scene was written (i.e. rendered) by a call of setup_rendering."""
+
+    nscenes = len(pov_scenes)
+    setup_rendering('trajectory.xyz', index=':', **kwargs)
+    images = [image.read_text() for image in sorted(Path('rendered_frames').glob('*.png'))]
+    return [images.index(scene.read_text()) for scene in pov_scenes[nscenes:]]
+
+
+def test_resume(pov_scenes):
+    write('trajectory.xyz', [atoms.copy() for atoms in _trajectory(5)])
+
+    assert _rendered_scenes(pov_scenes) == [0, 1, 2, 3, 4]
+    # all the frames are still valid
+    assert not _rendered_scenes(pov_scenes, resume=True)
+
+    os.remove('rendered_frames/trajectory_00003.png')
+    assert _rendered_scenes(pov_scenes, resume=True) == [3]
+
+    # new rendering settings invalidate all the frames
+    assert _rendered_scenes(pov_scenes, resume=True, rotations='10x') == [0, 1, 2, 3, 4]
+    assert not _rendered_scenes(pov_scenes, resume=True, rotations='10x')
+
+    # without resume, all the frames are rendered again
+    assert _rendered_scenes(pov_scenes, rotations='10x') == [0, 1, 2, 3, 4]
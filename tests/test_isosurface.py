@@ -0,0 +1,235 @@
+'''
+Tests of the isosurface meshes, and of the cropping of the density grid
+to the heights kept by a cut.
+'''
+
+import numpy as np
+import pytest
+from scipy.ndimage import zoom
+from scipy.spatial import cKDTree
+from skimage.measure import marching_cubes
+
+from atomsplot import isosurface
+from atomsplot.isosurface import (compute_isosurface_mesh, crop_density_grid, taubin_smooth,
+                                  vertex_normals)
+
+
+def _grid(n=20):
+    # the value of each point is the index of its plane along the third axis
+    return np.broadcast_to(np.arange(n, dtype=float), (4, 5, n)).copy()
+
+
+def _check_cropped_planes(density_grid, cell, z_range):
+    n = density_grid.shape[2]
+    cropped, grid_cell, origin, planes = crop_density_grid(density_grid, cell, z_range)
+    first, last = planes
+    m = cropped.shape[2]
+
+    assert m == last - first + 1
+    np.testing.assert_array_equal(cropped[0, 0], np.arange(first, last + 1) % n)
+    np.testing.assert_allclose(grid_cell[:2], cell[:2])
+    np.testing.assert_allclose(grid_cell[2], cell[2] * m / n)
+    np.testing.assert_allclose(origin, first / n * cell[2])
+    # the first and last points of the cropped grid enclose the range
+    assert origin[2] <= z_range[0] + 1e-12
+    assert origin[2] + (m - 1) / m * grid_cell[2, 2] >= z_range[1] - 1e-12
+    return cropped, planes
+
+
+@pytest.mark.parametrize('cell', [np.diag([4.0, 5.0, 10.0]),
+                                  np.array([[4.0, 0, 0], [2.0, 5.0, 0], [1.0, 0.5, 10.0]])])
+def test_crop_inside_cell(cell):
+    density_grid = _grid()
+    cropped, planes = _check_cropped_planes(density_grid, cell, (2.6, 7.1))
+    assert planes == (5, 15)
+    assert np.shares_memory(cropped, density_grid)
+
+
+@pytest.mark.parametrize('z_range, planes', [((-1.2, 3.0), (-3, 6)),
+                                             ((8.0, 11.6), (16, 24)),
+                                             ((-0.5, 0.0), (-1, 0))])
+def test_crop_across_cell_boundary(z_range, planes):
+    density_grid = _grid()
+    cropped, found_planes = _check_cropped_planes(density_grid, np.diag([4.0, 5.0, 10.0]),
+                                                  z_range)
+    assert found_planes == planes
+    assert not np.shares_memory(cropped, density_grid)
+
+
+@pytest.mark.parametrize('z_range, planes', [((0.0, 10.0), (0, 20)),
+                                             ((-2.0, 9.0), (-4, 18)),
+                                             ((-5.0, 15.0), (-10, 30)),
+                                             ((3.0, 22.6), (6, 46))])
+def test_repeat_taller_than_cell(z_range, planes):
+    # e.g. a cut of a supercell with replicas along z
+    density_grid = _grid()
+    cropped, found_planes = _check_cropped_planes(density_grid, np.diag([4.0, 5.0, 10.0]),
+                                                  z_range)
+    assert found_planes == planes
+    assert cropped.shape[2] > density_grid.shape[2]
+
+
+@pytest.mark.parametrize('cell', [np.array([[4.0, 0, 1.0], [0, 5.0, 0], [0, 0, 10.0]]),
+                                  np.array([[4.0, 0, 0], [0, 5.0, -0.5], [0, 0, 10.0]])])
+def test_no_crop_skewed_cell(cell):
+    density_grid = _grid()
+    grid, _, origin, planes = crop_density_grid(density_grid, cell, (2.0, 5.0))
+    assert planes is None
+    assert grid is density_grid
+    np.testing.assert_array_equal(origin, 0)
+
+
+def test_no_crop_without_range():
+    density_grid = _grid()
+    assert crop_density_grid(density_grid, np.diag([4.0, 5.0, 10.0]))[3] is None
+
+
+def _gaussians_grid(shape=(61, 47, 53), seed=0, ncenters=6):
+    """Periodic grid with a sum of gaussians at random positions."""
+
+    centers = np.random.default_rng(seed).random((ncenters, 3))
+    frac = np.stack(np.meshgrid(*[np.arange(n) / n for n in shape], indexing='ij'), axis=-1)
+    grid = np.zeros(shape)
+    for center in centers:
+        delta = (frac - center + 0.5) % 1 - 0.5
+        grid += np.exp(-((10 * delta)**2).sum(axis=-1))
+    return grid
+
+
+def _assert_same_mesh(verts, faces, ref_verts, ref_faces, atol):
+    """
+    Check that the mesh (verts, faces) has the same vertices as the reference,
+    up to atol and to their order, and the same faces, with the same orientation.
+    Extra faces are allowed only if they have zero area.
+    """
+
+    distances, ref_index = cKDTree(ref_verts).query(verts)
+    assert distances.max() < atol
+    assert len(np.unique(ref_index)) == len(verts) == len(ref_verts)
+
+    def face_keys(faces):
+        # each face starting from its smallest vertex index, keeping the orientation
+        shift = faces.argmin(axis=1)
+        rolled = np.stack([faces[np.arange(len(faces)), (shift + k) % 3] for k in range(3)], axis=1)
+        return {tuple(face) for face in rolled.tolist()}
+
+    keys = face_keys(ref_index[faces])
+    ref_keys = face_keys(ref_faces)
+    assert ref_keys <= keys
+    for face in keys - ref_keys:
+        corners = ref_verts[list(face)]
+        assert np.linalg.norm(np.cross(corners[1] - corners[0], corners[2] - corners[0])) < 1e-9
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+@pytest.mark.parametrize('gradient_direction', ['descent', 'ascent'])
+def test_slab_mesh_matches_marching_cubes(monkeypatch, jobs, gradient_direction):
+    grid = _gaussians_grid()
+    spacing = (0.1, 0.2, 0.3)
+    # about 8 slabs of 7-8 planes
+    monkeypatch.setattr(isosurface, '_SLAB_POINTS', 20000)
+    monkeypatch.setattr(isosurface, '_MIN_PARALLEL_POINTS', 0)
+
+    verts, faces = compute_isosurface_mesh(grid, 0.5, spacing, gradient_direction, jobs)
+    ref_verts, ref_faces, _, _ = marching_cubes(grid, 0.5, spacing=spacing,
+                                                gradient_direction=gradient_direction,
+                                                allow_degenerate=False)
+
+    assert verts.dtype == np.float32 and faces.dtype == np.int32
+    _assert_same_mesh(verts, faces, ref_verts, ref_faces, atol=1e-6)
+
+
+def test_slab_mesh_level_outside(monkeypatch):
+    monkeypatch.setattr(isosurface, '_SLAB_POINTS', 20000)
+    with pytest.raises(ValueError):
+        compute_isosurface_mesh(_gaussians_grid(), 10.0, (1, 1, 1))
+
+
+def _zoomed_mesh(grid, level, spacing, upscale):
+    zoomed = zoom(grid, upscale, order=3)
+    verts, faces, _, _ = marching_cubes(zoomed, level,
+                                        spacing=np.asarray(spacing) * grid.shape / zoomed.shape,
+                                        allow_degenerate=False)
+    return verts, faces
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+@pytest.mark.parametrize('upscale', [2, 2.5])
+def test_upscaled_mesh_matches_zoom(monkeypatch, jobs, upscale):
+    grid = _gaussians_grid((30, 26, 34))
+    spacing = (0.1, 0.2, 0.3)
+    monkeypatch.setattr(isosurface, '_UPSCALE_BLOCK', 32)
+
+    verts, faces = compute_isosurface_mesh(grid, 0.5, spacing, jobs=jobs, upscale=upscale)
+    _assert_same_mesh(verts, faces, *_zoomed_mesh(grid, 0.5, spacing, upscale), atol=1e-5)
+
+
+def test_upscaled_mesh_skips_blocks(monkeypatch):
+    # a single gaussian: most blocks of the upscaled grid are far below the level
+    grid = _gaussians_grid((30, 26, 34), ncenters=1)
+    spacing = (0.1, 0.2, 0.3)
+    monkeypatch.setattr(isosurface, '_UPSCALE_BLOCK', 32)
+    blocks = []
+    block_mesh = isosurface._upscaled_block_mesh
+
+    def counted_block_mesh(*args):
+        blocks.append(args[2])
+        return block_mesh(*args)
+
+    monkeypatch.setattr(isosurface, '_upscaled_block_mesh', counted_block_mesh)
+
+    verts, faces = compute_isosurface_mesh(grid, 0.5, spacing, upscale=2)
+    # 2 x 2 x 3 blocks of the 60x52x68 upscaled grid
+    assert 0 < len(blocks) < 12
+    _assert_same_mesh(verts, faces, *_zoomed_mesh(grid, 0.5, spacing, 2), atol=1e-5)
+
+
+def _sphere_mesh(center, radius=12.0, n=40, gradient_direction='descent'):
+    """Mesh of a sphere, as the isosurface of a gaussian (negative with 'ascent')."""
+
+    points = np.stack(np.meshgrid(*[np.arange(n)] * 3, indexing='ij'), axis=-1)
+    grid = np.exp(-(np.linalg.norm(points - center, axis=-1) / 10)**2)
+    level = np.exp(-(radius / 10)**2)
+    if gradient_direction == 'ascent':
+        grid, level = -grid, -level
+    return compute_isosurface_mesh(grid, level, (1, 1, 1), gradient_direction), grid.shape
+
+
+def test_taubin_smooth_keeps_sphere_size():
+    center = np.full(3, 19.5)
+    (verts, faces), _ = _sphere_mesh(center)
+
+    radii = np.linalg.norm(verts - center, axis=1)
+    smoothed_radii = np.linalg.norm(taubin_smooth(verts, faces, 20) - center, axis=1)
+    assert smoothed_radii.mean() == pytest.approx(radii.mean(), rel=0.01)
+    # the staircase of marching cubes is not made worse
+    assert smoothed_radii.std() < 0.01 * radii.mean()
+
+
+def test_taubin_smooth_pins_bounds():
+    # the sphere is cut by the three planes through the origin
+    (verts, faces), shape = _sphere_mesh(np.full(3, 4.0))
+    bounds = (np.zeros(3), np.array(shape) - 1.0)
+
+    smoothed = taubin_smooth(verts, faces, 10, bounds)
+    on_planes = 0
+    for axis in range(3):
+        for value in (bounds[0][axis], bounds[1][axis]):
+            pinned = np.abs(verts[:, axis] - value) < 1e-6
+            on_planes += pinned.sum()
+            np.testing.assert_array_equal(smoothed[pinned, axis], value)
+    assert on_planes > 0
+    assert np.all((smoothed >= bounds[0] - 1e-9) & (smoothed <= bounds[1] + 1e-9))
+    assert not np.allclose(smoothed, verts)
+
+
+@pytest.mark.parametrize('gradient_direction', ['descent', 'ascent'])
+def test_vertex_normals_outward(gradient_direction):
+    center = np.full(3, 19.5)
+    (verts, faces), _ = _sphere_mesh(center, gradient_direction=gradient_direction)
+    smoothed = taubin_smooth(verts, faces, 10)
+
+    normals = vertex_normals(smoothed, faces)
+    np.testing.assert_allclose(np.linalg.norm(normals, axis=1), 1, atol=1e-12)
+    radial = (smoothed - center) / np.linalg.norm(smoothed - center, axis=1)[:, None]
+    assert np.all((normals * radial).sum(axis=1) > 0.9)
@@ -0,0 +1,185 @@
+'''
+Tests of the movie encoding with a fake ffmpeg, which writes the frames it receives
+(and the images still in its working directory when its input is closed) to the movie file.
+'''
+
+import os
+import sys
+import json
+
+import pytest
+from ase.build import molecule
+from ase.io import write
+from ase.io.pov import POVRAYInputs
+
+from atomsplot import functions
+from atomsplot.functions import setup_rendering
+from atomsplot.movie import MovieEncoder
+
+
+FAKE_FFMPEG = f'''#!{sys.executable}
+import os
+import sys
+import json
+
+if os.environ.get('FAKE_FFMPEG_EXIT'):
+    sys.exit(1)
+data = sys.stdin.buffer.read()
+frames = sorted(name for name in os.listdir('.') if name.endswith('.png'))
+with open(sys.argv[-1], 'w') as f:
+    json.dump({{'input': data.decode(), 'frames_at_close': frames}}, f)
+if os.environ.get('FAKE_FFMPEG_FAIL'):
+    sys.stderr.write('encoder error')
+    sys.exit(1)
+'''
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Put the fake ffmpeg first on PATH."""
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    ffmpeg = bin_dir / 'ffmpeg'
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+
+
+def _read_movie(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _frame_files(n):
+    files = []
+    for i in range(n):
+        files.append(f'frame_{i}.png')
+        with open(files[-1], 'w', encoding='utf-8') as f:
+            f.write(f'<frame {i}>')
+    return files
+
+
+@pytest.mark.usefixtures('fake_ffmpeg')
+def test_encoder_frames_in_order():
+    encoder = MovieEncoder('movie.mp4', 10)
+    for frame_file in reversed(_frame_files(5)):
+        assert encoder.add_frame(frame_file)
+    encoder.close()
+
+    assert _read_movie('movie.mp4')['input'] == ''.join(f'<frame {i}>' for i in range(4, -1, -1))
+
+
+@pytest.mark.usefixtures('fake_ffmpeg')
+def test_encoder_failure_raises(monkeypatch):
+    monkeypatch.setenv('FAKE_FFMPEG_FAIL', '1')
+    encoder = MovieEncoder('movie.mp4', 10)
+    for frame_file in _frame_files(2):
+        encoder.add_frame(frame_file)
+
+    with pytest.raises(RuntimeError, match='encoder error'):
+        encoder.close()
+    assert encoder.failed
+
+
+def _render_movie(**kwargs):
+    frames = []
+    for i in range(4):
+        atoms = molecule('H2O')
+        atoms.rotate(20 * i, 'z')
+        frames.append(atoms)
+    write('trajectory.xyz', frames)
+    setup_rendering('trajectory.xyz', movie=True, **kwargs)
+
+
+@pytest.mark.usefixtures('fake_ffmpeg', 'pov_scenes')
+def test_movie_keep_frames():
+    _render_movie()
+
+    movie = _read_movie('trajectory.mp4')
+    frames = sorted(name for name in os.listdir('rendered_frames') if name.endswith('.png'))
+    assert len(frames) == 4
+    # the frames were piped in order
+    images = []
+    for name in frames:
+        with open(f'rendered_frames/{name}', encoding='utf-8') as f:
+            images.append(f.read())
+    assert movie['input'] == ''.join(images)
+
+
+@pytest.mark.usefixtures('fake_ffmpeg', 'pov_scenes')
+def test_movie_discard_frames():
+    _render_movie(keep_frames=False)
+
+    # the frames are deleted only after the movie is complete
+    movie = _read_movie('trajectory.mp4')
+    assert len(movie['frames_at_close']) == 4
+    assert not [name for name in os.listdir('rendered_frames') if name.endswith('.png')]
+
+
+@pytest.mark.usefixtures('fake_ffmpeg', 'pov_scenes')
+def test_movie_failed_keeps_frames(monkeypatch):
+    monkeypatch.setenv('FAKE_FFMPEG_FAIL', '1')
+    _render_movie(keep_frames=False)
+
+    assert len([name for name in os.listdir('rendered_frames') if name.endswith('.png')]) == 4
+
+
+@pytest.fixture
+def encoders(monkeypatch):
+    """Record the movie encoders of setup_rendering, and the frames sent to each of them."""
+
+    created = []
+
+    class RecordingEncoder(MovieEncoder):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.sent = []
+            created.append(self)
+            if os.environ.get('FAKE_FFMPEG_EXIT'):
+                self.process.wait() # ffmpeg has died before the first frame
+
+        def add_frame(self, frame_file):
+            self.sent.append(super().add_frame(frame_file))
+            return self.sent[-1]
+
+    monkeypatch.setattr(functions, 'MovieEncoder', RecordingEncoder)
+    return created
+
+
+@pytest.mark.usefixtures('fake_ffmpeg')
+def test_movie_failed_render_stops_encoder(pov_scenes, encoders, monkeypatch):
+    render = POVRAYInputs.render
+
+    def failing_render(self, *args, **kwargs):
+        if len(pov_scenes) == 2:
+            raise RuntimeError('povray failed')
+        return render(self, *args, **kwargs)
+
+    monkeypatch.setattr(POVRAYInputs, 'render', failing_render)
+    cwd = os.getcwd()
+    with pytest.raises(RuntimeError, match='povray failed'):
+        _render_movie()
+
+    encoder, = encoders
+    assert encoder.sent == [True, True]
+    # ffmpeg is not left waiting for frames, and the truncated movie is removed
+    assert encoder.process.poll() is not None
+    assert not os.path.exists('trajectory.mp4')
+    assert os.getcwd() == cwd
+
+
+@pytest.mark.usefixtures('fake_ffmpeg', 'pov_scenes')
+def test_movie_encoder_died_falls_back_to_gif(encoders, monkeypatch):
+    monkeypatch.setenv('FAKE_FFMPEG_EXIT', '1')
+    gifs = []
+    monkeypatch.setattr(functions, 'make_gif',
+                        lambda frame_files, outfile, framerate: gifs.append(frame_files) or True)
+    _render_movie(keep_frames=False)
+
+    encoder, = encoders
+    # no more frames are sent after ffmpeg stopped accepting them
+    assert encoder.sent == [False]
+    assert not os.path.exists('trajectory.mp4')
+    assert len(gifs[0]) == 4
+    assert all(os.path.exists(frame_file) for frame_file in gifs[0])
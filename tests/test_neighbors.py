@@ -0,0 +1,195 @@
+'''
+Tests of the shared neighbor search against the ase neighbor lists.
+'''
+
+import numpy as np
+import pytest
+from ase.build import add_adsorbate, bulk, fcc111, molecule
+from ase.io.pov import get_bondpairs
+from ase.neighborlist import NeighborList, natural_cutoffs
+
+from atomsplot.neighbors import Neighbors, NeighborsCache, BOND_SKIN, COORDNUM_MULT
+from atomsplot.render import _calculate_bondorder_pairs, _set_high_bondorder_pairs
+
+
+def _slab():
+    slab = fcc111('Pt', (3, 3, 3), vacuum=6.0)
+    add_adsorbate(slab, molecule('CO'), 2.0, 'ontop')
+    slab.pbc = True
+    return slab
+
+
+def _structures():
+    return {
+        'molecule': molecule('CH3CH2OH'),
+        'slab': _slab(),
+        # a single atom bonded only to its own periodic images
+        'fcc': bulk('Cu', 'fcc'),
+        'triclinic': bulk('Si'),
+    }
+
+
+def _bond_set(bondpairs) -> set:
+    """
+    Bonds as a set of (a, b, offset), with a bond to b displaced by offset
+    written the same as a bond from b to a displaced by -offset.
+    """
+
+    bonds = set()
+    for a, b, offset in bondpairs:
+        offset = tuple(int(x) for x in offset)
+        if a > b or (a == b and offset < (0, 0, 0)):
+            a, b, offset = b, a, tuple(-x for x in offset)
+        bonds.add((a, b, offset))
+    return bonds
+
+
+@pytest.mark.parametrize('name', _structures())
+@pytest.mark.parametrize('radius', [1.1, 1.3])
+def test_bondpairs_match_ase(name, radius):
+    atoms = _structures()[name]
+    bondpairs = Neighbors(atoms, radius, BOND_SKIN).get_bondpairs(radius)
+
+    reference = get_bondpairs(atoms, radius)
+    assert len(bondpairs) == len(reference)
+    assert _bond_set(bondpairs) == _bond_set(reference)
+
+
+@pytest.mark.parametrize('name', _structures())
+def test_coordination_numbers_match_ase(name):
+    atoms = _structures()[name]
+    coordnums = Neighbors(atoms, COORDNUM_MULT).get_coordination_numbers()
+
+    # periodic images are counted separately
+    nl = NeighborList(natural_cutoffs(atoms, mult=COORDNUM_MULT), skin=0.0,
+                      self_interaction=False, bothways=True)
+    nl.update(atoms)
+    reference = [len(nl.get_neighbors(i)[0]) for i in range(len(atoms))]
+    np.testing.assert_array_equal(coordnums, reference)
+
+
+def test_self_image_bonds():
+    atoms = bulk('Cu', 'fcc')
+    neighbors = Neighbors(atoms, COORDNUM_MULT, BOND_SKIN)
+
+    # each of the 12 neighbors of fcc is an image of the same atom, stored once
+    bondpairs = neighbors.get_bondpairs(1.1)
+    assert len(bondpairs) == 6
+    assert all(a == b == 0 and np.any(offset != 0) for a, b, offset in bondpairs)
+    np.testing.assert_array_equal(neighbors.get_coordination_numbers(), [12])
+
+
+def test_select_larger_cutoff():
+    neighbors = Neighbors(molecule('H2O'), 1.1)
+    with pytest.raises(ValueError):
+        neighbors.select(1.2)
+
+
+def _displaced(atoms, distance, seed=0):
+    """Copy of atoms with each atom moved by distance in a random direction."""
+
+    directions = np.random.default_rng(seed).normal(size=(len(atoms), 3))
+    displaced = atoms.copy()
+    displaced.positions += distance * directions / np.linalg.norm(directions, axis=1)[:, None]
+    return displaced
+
+
+@pytest.mark.parametrize('fraction, reused', [(0.99, True), (1.01, False)])
+def test_verlet_update_matches_fresh_search(fraction, reused):
+    atoms = _slab()
+    cache = NeighborsCache(verlet_skin=1.0)
+    cache.get(atoms, COORDNUM_MULT, BOND_SKIN)
+
+    moved = _displaced(atoms, fraction * cache.verlet_skin / 2)
+    neighbors = cache.get(moved, COORDNUM_MULT, BOND_SKIN)
+    assert (cache.n_updates, cache.n_searches) == ((1, 1) if reused else (0, 2))
+
+    fresh = Neighbors(moved, COORDNUM_MULT, BOND_SKIN)
+    assert _bond_set(neighbors.get_bondpairs(1.1)) == _bond_set(fresh.get_bondpairs(1.1))
+    np.testing.assert_array_equal(neighbors.get_coordination_numbers(),
+                                  fresh.get_coordination_numbers())
+
+
+def test_verlet_update_rejected():
+    atoms = _slab()
+    neighbors = Neighbors(atoms, COORDNUM_MULT, BOND_SKIN, verlet_skin=1.0)
+
+    assert not neighbors.update(atoms[:-1])
+    strained = atoms.copy()
+    strained.set_cell(atoms.cell * 1.01, scale_atoms=False)
+    assert not neighbors.update(strained)
+    assert neighbors.update(atoms)
+
+
+def _multiple_bonds(atoms) -> dict:
+    """{(a, b): order} of the bonds with order >= 2."""
+
+    neighbors = Neighbors(atoms, 1.1, BOND_SKIN)
+    bonds = neighbors.select(1.1, BOND_SKIN)
+    orders = neighbors.get_bond_orders(bonds)
+    return {(a, b): order for a, b, order in zip(neighbors.a[bonds].tolist(),
+                                                 neighbors.b[bonds].tolist(),
+                                                 orders.tolist()) if order >= 2}
+
+
+@pytest.mark.parametrize('name, orders', [
+    # the C-C bonds of benzene (1.40 A) are closer to double than single bonds
+    ('C6H6', {(0, 1): 2, (0, 5): 2, (1, 2): 2, (2, 3): 2, (3, 4): 2, (4, 5): 2}),
+    ('C2H2', {(0, 1): 3}),
+    ('HCN', {(0, 1): 3}),
+    ('N2', {(0, 1): 3}),
+    # no triple C-O bond in the reference lengths
+    ('CO', {(0, 1): 2}),
+    ('CH3CH2OH', {}),
+])
+def test_bond_orders(name, orders):
+    assert _multiple_bonds(molecule(name)) == orders
+
+
+def test_bond_orders_single_without_data():
+    # pymatgen has no bond length data for P-P and Cl-Cl
+    assert _multiple_bonds(molecule('P2')) == {}
+    assert _multiple_bonds(molecule('Cl2')) == {}
+
+
+def test_bond_orders_match_pymatgen():
+    pytest.importorskip('pymatgen')
+    # pylint: disable=import-outside-toplevel
+    from ase.collections import g2
+    from pymatgen.analysis.local_env import CovalentBondNN
+    from pymatgen.io.ase import AseAtomsAdaptor
+
+    for name in g2.names:
+        atoms = molecule(name)
+        structure = AseAtomsAdaptor.get_molecule(atoms)
+        reference = {}
+        try:
+            for i in range(len(atoms)):
+                for neighbor in CovalentBondNN().get_nn_info(structure, i):
+                    if round(neighbor['weight']) >= 2:
+                        pair = tuple(sorted((i, neighbor['site_index'])))
+                        reference[pair] = round(neighbor['weight'])
+        except ValueError: # element pairs without bond length data
+            continue
+        assert _multiple_bonds(atoms) == reference, name
+
+
+def test_bond_orders_across_cell():
+    atoms = molecule('C6H6')
+    atoms.set_cell([8.0, 8.0, 8.0])
+    atoms.pbc = True
+    # the ring is split by the boundaries along x and y
+    atoms.translate(-atoms.positions[0] + [0.2, 0.3, 4.0])
+    atoms.wrap()
+
+    neighbors = Neighbors(atoms, 1.1, BOND_SKIN)
+    bondpairs = _set_high_bondorder_pairs(neighbors.get_bondpairs(1.1),
+                                          _calculate_bondorder_pairs(neighbors, 1.1))
+
+    double_bonds = [pair for pair in bondpairs if len(pair) > 3 and pair[3] == 2]
+    assert len(double_bonds) == 6
+    assert sum(np.any(pair[2] != 0) for pair in double_bonds) >= 2
+    for a, b, offset, *_ in double_bonds:
+        assert atoms.numbers[a] == atoms.numbers[b] == 6
+        length = np.linalg.norm(atoms.positions[b] + offset @ atoms.cell - atoms.positions[a])
+        assert length == pytest.approx(1.395, abs=1e-3)
@@ -0,0 +1,346 @@
+'''
+Tests of the povray scene writer: the scenes formatted in bulk must be identical to
+those of the previous writer, which built them with per-atom and per-bond string
+concatenation.
+'''
+
+import numpy as np
+import pytest
+from ase import Atoms
+from ase.constraints import FixAtoms
+from ase.io.pov import POVRAY, pa, pc
+
+from atomsplot.ase_custom.povray import ATOM_STYLE_DTYPE, TEXTURES
+
+
+def write_pov_reference(self, path):
+    """
+    write_pov before the atoms and bonds were formatted in bulk
+    (copied from atomsplot/ase_custom/povray.py), as the reference.
+    """
+
+    point_lights = '\n'.join(f"light_source {{{pa(loc)} {pc(rgb)}}}"
+                                for loc, rgb in self.point_lights)
+
+    area_light = ''
+    if self.area_light is not None:
+        loc, color, width, height, nx, ny = self.area_light
+        area_light += f"""\nlight_source {{{pa(loc)} {pc(color)}
+area_light <{width:.2f}, 0, 0>, <0, {height:.2f}, 0>, {nx:n}, {ny:n}
+adaptive 1 jitter}}"""
+
+    fog = ''
+    if self.depth_cueing and (self.cue_density >= 1e-4):
+        # same way vmd does it
+        if self.cue_density > 1e4:
+            # larger does not make any sense
+            dist = 1e-4
+        else:
+            dist = 2. / self.cue_density
+        constant_fog_height = self.constant_fog_height if self.constant_fog_height is not None else 0.0
+        fog += f'fog {{fog_type 2 distance {dist:.4f} up <0,0,1> fog_offset {constant_fog_height} fog_alt 0.1 '\
+                f'color {pc(self.background)}}}'
+
+    mat_style_keys = (f'#declare {k} = {v}'
+                        for k, v in self.material_styles_dict.items())
+    mat_style_keys = '\n'.join(mat_style_keys)
+
+    # Draw unit cell
+    cell_vertices = ''
+    if self.cell_vertices is not None:
+        for c in range(3):
+            for j in ([0, 0], [1, 0], [1, 1], [0, 1]):
+                p1 = self.cell_vertices[tuple(j[:c]) + (0,) + tuple(j[c:])]
+                p2 = self.cell_vertices[tuple(j[:c]) + (1,) + tuple(j[c:])]
+
+                distance = np.linalg.norm(p2 - p1)
+                if distance < 1e-12:
+                    continue
+
+                cell_vertices += f'cylinder {{{pa(p1)}, {pa(p2)}, '\
+                                    f'Rcell pigment {{Black}}}}\n'
+                # all strings are f-strings for consistency
+        cell_vertices = cell_vertices.strip('\n')
+
+    # Draw atoms
+    a = 0
+    atoms = ''
+    for loc, dia, col in zip(self.positions, self.diameters, self.colors):
+        tex = 'ase3'
+        trans = 0.
+        if self.textures is not None:
+            tex = self.textures[a]
+        if self.transmittances is not None:
+            trans = self.transmittances[a]
+        atoms += f'atom({pa(loc)}, {dia/2.:.2f}, {pc(col)}, '\
+                    f'{trans}, {tex}) // #{a:n}\n'
+        a += 1
+    atoms = atoms.strip('\n')
+
+    # Draw atom bonds
+    bondatoms = ''
+    for pair in self.bondatoms:
+        # Make sure that each pair has 4 componets: a, b, offset,
+        #                                           bond_order, bond_offset
+        # a, b: atom index to draw bond
+        # offset: original meaning to make offset for mid-point.
+        # bond_oder: if not supplied, set it to 1 (single bond).
+        #            It can be  1, 2, 3, corresponding to single,
+        #            double, triple bond
+        # bond_offset: displacement from original bond position.
+        #              Default is (bondlinewidth, bondlinewidth, 0)
+        #              for bond_order > 1.
+        if len(pair) == 2:
+            a, b = pair
+            offset = (0, 0, 0)
+            bond_order = 1
+            bond_offset = (0, 0, 0)
+        elif len(pair) == 3:
+            a, b, offset = pair
+            bond_order = 1
+            bond_offset = (0, 0, 0)
+        elif len(pair) == 4:
+            a, b, offset, bond_order = pair
+            bond_offset = (self.bondlinewidth, self.bondlinewidth, 0)
+        elif len(pair) > 4:
+            a, b, offset, bond_order, bond_offset = pair
+        else:
+            raise RuntimeError('Each list in bondatom must have at least '
+                                '2 entries. Error at %s' % pair)
+
+        if len(offset) != 3:
+            raise ValueError('offset must have 3 elements. '
+                                'Error at %s' % pair)
+        if len(bond_offset) != 3:
+            raise ValueError('bond_offset must have 3 elements. '
+                                'Error at %s' % pair)
+        if bond_order not in [0, 1, 2, 3]:
+            raise ValueError('bond_order must be either 0, 1, 2, or 3. '
+                                'Error at %s' % pair)
+
+        # Up to here, we should have all a, b, offset, bond_order,
+        # bond_offset for all bonds.
+
+        # Rotate bond_offset so that its direction is 90 deg. off the bond
+        # Utilize Atoms object to rotate
+        if bond_order > 1 and np.linalg.norm(bond_offset) > 1.e-9:
+            tmp_atoms = Atoms('H3')
+            tmp_atoms.set_cell(self.cell)
+            tmp_atoms.set_positions([
+                self.positions[a],
+                self.positions[b],
+                self.positions[b] + np.array(bond_offset),
+            ])
+            tmp_atoms.center()
+            tmp_atoms.set_angle(0, 1, 2, 90)
+            bond_offset = tmp_atoms[2].position - tmp_atoms[1].position
+
+        R = np.dot(offset, self.cell)
+        mida = 0.5 * (self.positions[a] + self.positions[b] + R)
+        midb = 0.5 * (self.positions[a] + self.positions[b] - R)
+        if self.textures is not None:
+            texa = self.textures[a]
+            texb = self.textures[b]
+        else:
+            texa = texb = 'ase3'
+
+        if self.transmittances is not None:
+            transa = self.transmittances[a]
+            transb = self.transmittances[b]
+        else:
+            transa = transb = 0.
+
+        # draw bond, according to its bond_order.
+        # bond_order == 0: No bond is plotted
+        # bond_order == 1: use original code
+        # bond_order == 2: draw two bonds, one is shifted by bond_offset/2,
+        #                  and another is shifted by -bond_offset/2.
+        # bond_order == 3: draw two bonds, one is shifted by bond_offset,
+        #                  and one is shifted by -bond_offset, and the
+        #                  other has no shift.
+        # To shift the bond, add the shift to the first two coordinate in
+        # write statement.
+
+        posa = self.positions[a]
+        posb = self.positions[b]
+        cola = self.colors[a]
+        colb = self.colors[b]
+
+        if bond_order == 1:
+            draw_tuples = (
+                (posa, mida, cola, transa, texa),
+                (posb, midb, colb, transb, texb))
+
+        elif bond_order == 2:
+            bs = [x / 2 for x in bond_offset]
+            draw_tuples = (
+                (posa - bs, mida - bs, cola, transa, texa),
+                (posb - bs, midb - bs, colb, transb, texb),
+                (posa + bs, mida + bs, cola, transa, texa),
+                (posb + bs, midb + bs, colb, transb, texb))
+
+        elif bond_order == 3:
+            bs = bond_offset
+            draw_tuples = (
+                (posa, mida, cola, transa, texa),
+                (posb, midb, colb, transb, texb),
+                (posa + bs, mida + bs, cola, transa, texa),
+                (posb + bs, midb + bs, colb, transb, texb),
+                (posa - bs, mida - bs, cola, transa, texa),
+                (posb - bs, midb - bs, colb, transb, texb))
+
+        bondatoms += ''.join(f'cylinder {{{pa(p)}, '
+                                f'{pa(m)}, Rbond texture{{pigment '
+                                f'{{color {pc(c)} '
+                                f'transmit {tr}}} finish{{{tx}}}}}}}\n'
+                                for p, m, c, tr, tx in
+                                draw_tuples)
+
+    bondatoms = bondatoms.strip('\n')
+
+    # Draw constraints if requested
+    constraints = ''
+    if self.exportconstraints:
+        for a in self.constrainatoms:
+            dia = self.diameters[a]
+            loc = self.positions[a]
+            trans = 0.0
+            if self.transmittances is not None:
+                trans = self.transmittances[a]
+            constraints += f'constrain({pa(loc)}, {dia / 2.:.2f}, Black, '\
+                f'{trans}, {tex}) // #{a:n} \n'
+    constraints = constraints.strip('\n')
+
+    #### BEGIN CUSTOM: handle arrows
+    # Draw arrows
+    arrows = ''
+    if self.arrows is not None:
+        maxlength = np.max([np.linalg.norm(arrow) for arrow in self.arrows])
+        for pos, arrow, diam in zip(self.positions, self.arrows, self.diameters):
+            modulus = np.linalg.norm(arrow)
+            if modulus/maxlength > 0.1: # skip degenerate primitives
+                cylinder_pos_dw = pos # - 0.8*normalized_arrow
+                cylinder_pos_up = pos + 0.7*arrow
+                arrows += f'cylinder {{{pa(cylinder_pos_dw)}, '+\
+                                        f'{pa(cylinder_pos_up)}, 0.1 texture{{pigment '+\
+                                        f'{{color {pc([1,0,0])} '+\
+                                        f'transmit 0.0}} finish{{ase3}}}}}}\n'
+                cone_pos = pos + 0.7*arrow
+                arrows += f'cone {{{pa(cone_pos)}, 0.2'+\
+                                        f'{pa(cone_pos + 0.3*arrow/modulus)}, 0.0 texture{{pigment '+\
+                                        f'{{color {pc([1,0,0])} '+\
+                                        f'transmit 0.0}} finish{{ase3}}}}}}\n'
+    #### END CUSTOM
+
+    pov = f"""#version 3.6;
+#include "colors.inc"
+#include "finish.inc"
+
+global_settings {{assumed_gamma 2.2 max_trace_level 6}}
+background {{{pc(self.background)}{' transmit 1.0' if self.transparent else ''}}}
+camera {{{self.camera_type}
+right -{self.image_width:.2f}*x up {self.image_height:.2f}*y
+direction {self.image_plane:.2f}*z
+location <0,0,{self.camera_dist:.2f}> look_at <0,0,0>}}
+{point_lights}
+{area_light if area_light != '' else '// no area light'}
+{fog if fog != '' else '// no fog'}
+{mat_style_keys}
+#declare Rcell = {self.celllinewidth:.3f};
+#declare Rbond = {self.bondlinewidth:.3f};
+
+#macro atom(LOC, R, COL, TRANS, FIN)
+sphere{{LOC, R texture{{pigment{{color COL transmit TRANS}} finish{{FIN}}}}}}
+#end
+#macro constrain(LOC, R, COL, TRANS FIN)
+union{{torus{{R, Rcell rotate 45*z texture{{pigment{{color COL transmit TRANS}} finish{{FIN}}}}}}
+    torus{{R, Rcell rotate -45*z texture{{pigment{{color COL transmit TRANS}} finish{{FIN}}}}}}
+    translate LOC}}
+#end
+
+{cell_vertices if cell_vertices != '' else '// no cell vertices'}
+{atoms}
+{bondatoms}
+{constraints if constraints != '' else '// no constraints'}
+{arrows if arrows != '' else '// no arrows'}
+"""  # noqa: E501
+
+    with open(path, 'w') as fd:
+        fd.write(pov)
+
+    return path
+
+
+def _scene(textures=True, transmittances=True, color_components=3, orders=(1, 2, 3), **kwargs):
+    """
+    Scene with all the atom textures, transmittances and formats of the colors, and bonds
+    in all the formats of ase (2 to 5 entries) with the given orders, across the cell too.
+    """
+
+    rng = np.random.default_rng(0)
+    natoms = 3 * len(TEXTURES)
+    cell = np.diag([12.0, 11.0, 10.0])
+    positions = rng.random((natoms, 3)) @ cell
+    bondatoms = [(0, 1), (1, 2, (0, 0, 0)), (2, 3, (1, 0, 0)), (3, 4, (0, -1, 1))]
+    for order in orders:
+        bondatoms += [(5 + order, 6 + order, (0, 0, 0), order),
+                      (10 + order, 11 + order, (0, 1, 0), order, (0.1, -0.2, 0.05)),
+                      (15 + order, 16 + order, (0, 0, 0), order, (0.0, 0.0, 0.0))]
+    corners = np.indices((2, 2, 2)).reshape(3, -1).T @ cell
+    return POVRAY(cell=cell,
+                  cell_vertices=corners,
+                  positions=positions,
+                  diameters=rng.uniform(0.5, 2.0, natoms),
+                  colors=rng.random((natoms, color_components)),
+                  image_width=12.0,
+                  image_height=11.0,
+                  textures=list(TEXTURES) * 3 if textures else None,
+                  transmittances=(rng.choice([0.0, 0.5, 0.8], natoms).tolist()
+                                  if transmittances else None),
+                  constraints=[FixAtoms(indices=[0, 3, 7])],
+                  exportconstraints=True,
+                  depth_cueing=True,
+                  bondatoms=bondatoms,
+                  **kwargs)
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(textures=False, transmittances=False),
+    dict(color_components=4),
+    dict(color_components=5, arrows=np.random.default_rng(1).normal(size=(3 * len(TEXTURES), 3))),
+    dict(transparent=False, area_light=None, constant_fog_height=-2.5),
+])
+def test_write_pov_matches_reference(tmp_path, kwargs):
+    scene = _scene(**kwargs)
+    scene.write_pov(tmp_path / 'bulk.pov')
+    write_pov_reference(scene, tmp_path / 'reference.pov')
+
+    assert (tmp_path / 'bulk.pov').read_text() == (tmp_path / 'reference.pov').read_text()
+
+
+def test_write_pov_styles_matches_reference(tmp_path):
+    scene = _scene()
+    styles = np.zeros(len(scene.diameters), dtype=ATOM_STYLE_DTYPE)
+    styles['color'] = scene.colors
+    styles['radius'] = np.asarray(scene.diameters) / 2
+    styles['texture'] = [TEXTURES.index(texture) for texture in scene.textures]
+    styles['transmittance'] = scene.transmittances
+    write_pov_reference(scene, tmp_path / 'reference.pov')
+
+    scene.styles = styles
+    scene.colors = scene.diameters = scene.textures = scene.transmittances = None
+    scene.write_pov(tmp_path / 'bulk.pov')
+
+    assert (tmp_path / 'bulk.pov').read_text() == (tmp_path / 'reference.pov').read_text()
+
+
+def test_write_pov_no_bond_order_zero(tmp_path):
+    # the previous writer drew the previous bond again for a bond of order 0
+    scene = _scene(orders=(0,))
+    scene.write_pov(tmp_path / 'bulk.pov')
+    nbonds = (tmp_path / 'bulk.pov').read_text().count('Rbond texture')
+
+    scene.bondatoms = [pair for pair in scene.bondatoms if len(pair) < 4]
+    scene.write_pov(tmp_path / 'bulk.pov')
+    assert (tmp_path / 'bulk.pov').read_text().count('Rbond texture') == nbonds == 8
@@ -0,0 +1,512 @@
+'''
+Tests of render_image and of the structure transformations.
+'''
+
+import re
+
+import numpy as np
+import pytest
+from ase import Atoms
+
+from atomsplot.ase_custom import AtomsCustom
+from atomsplot.render import (_prepare_atoms, _calculate_ground_fog_height, _get_colors,
+                              render_image, get_fixed_view, SlabHeightCache)
+from atomsplot.settings import CustomSettings
+
+
+def _charged_slab(cell=(6.0, 6.0, 8.338272)):
+    """Two-atom slab with a positive and a negative lobe of density around the atoms."""
+
+    atoms = Atoms('CO', positions=[[1.5, 1.5, 6.0], [4.5, 4.5, 7.0]], cell=cell, pbc=True)
+    shape = (24, 24, 32)
+    frac = np.stack(np.meshgrid(*[np.arange(n) / n for n in shape], indexing='ij'), axis=-1)
+    grid = np.zeros(shape)
+    for sign, position in zip((1, -1), atoms.get_scaled_positions()):
+        # periodic distance in fractional coordinates
+        delta = (frac - position + 0.5) % 1 - 0.5
+        grid += sign * np.exp(-((delta @ atoms.cell.array)**2).sum(axis=-1))
+    return atoms, grid
+
+
+def _isosurface_translations(scene) -> np.ndarray:
+    return np.array([[float(x) for x in match.groups()] for match in
+                     re.finditer(r'object\{IsosurfacePositive translate <(\S+), (\S+), (\S+)>\}',
+                                 scene.read_text())]).reshape(-1, 3)
+
+
+@pytest.mark.parametrize('cut', [dict(range_cut=(5, 20)), dict(cut_vacuum=True)])
+def test_isosurface_instances_with_cut_supercell(pov_scenes, cut):
+    atoms, grid = _charged_slab()
+    render_image(atoms, 'scene.png', CustomSettings(), supercell=[2, 2, 2],
+                 chg_grid=grid, chg_iso_threshold=0.3, **cut)
+
+    translations = _isosurface_translations(pov_scenes[0])
+    # only the replicas in the plane, since the cropped grid covers the kept heights
+    assert len(translations) == 4
+    np.testing.assert_allclose(translations[:, 2], 0, atol=1e-6)
+
+
+def test_isosurface_instances_supercell(pov_scenes):
+    atoms, grid = _charged_slab()
+    render_image(atoms, 'scene.png', CustomSettings(), supercell=[2, 2, 2],
+                 chg_grid=grid, chg_iso_threshold=0.3)
+
+    translations = _isosurface_translations(pov_scenes[0])
+    assert len(translations) == 8
+    np.testing.assert_allclose(np.unique(translations[:, 2].round(4)), [0, 8.3383])
+
+
+
+def _isosurface_vertices(scene) -> np.ndarray:
+    """Vertices of the first isosurface mesh of the scene, in the frame of the scene."""
+
+    text = scene.read_text()
+    start = text.index('vertex_vectors')
+    vertices = re.findall(r'<(\S+), (\S+), (\S+)>', text[start:text.index('}', start)])
+    matrix = re.search(r'matrix <([^>]+)>', text[start:])[1]
+    matrix = np.array([float(x) for x in matrix.replace(',', ' ').split()]).reshape(4, 3)
+    return np.array(vertices, dtype=float) @ matrix[:3] + matrix[3]
+
+
+@pytest.mark.parametrize('cut', [dict(range_cut=(5, 20)), dict(cut_vacuum=True)])
+def test_isosurface_supercell_cut_taller_than_cell(pov_scenes, cut):
+    atoms, grid = _charged_slab()
+    render_image(atoms, 'scene.png', CustomSettings(), supercell=[1, 1, 2],
+                 chg_grid=grid, chg_iso_threshold=0.3, **cut)
+
+    # the grid is repeated to cover the lobes of both the replicas along z
+    heights = _isosurface_vertices(pov_scenes[0])[:, 2]
+    assert heights.max() - heights.min() > atoms.cell[2, 2]
+    assert not len(_isosurface_translations(pov_scenes[0]))
+
+
+
+def _isosurface_lobes(scene) -> int:
+    """Number of separate lobes of the first isosurface of the scene, with its instances."""
+
+    from scipy.sparse.csgraph import connected_components # pylint: disable=import-outside-toplevel
+    from scipy.spatial import cKDTree # pylint: disable=import-outside-toplevel
+
+    vertices = _isosurface_vertices(scene)
+    translations = _isosurface_translations(scene)
+    if len(translations):
+        vertices = (vertices[None, :, :] + translations[:, None, :]).reshape(-1, 3)
+    graph = cKDTree(vertices).sparse_distance_matrix(cKDTree(vertices), 0.5)
+    return connected_components(graph, directed=False)[0]
+
+
+@pytest.mark.parametrize('instanced_supercell', [False, True])
+@pytest.mark.parametrize('cell', [(6.0, 6.0, 8.338272),
+                                  [[6.0, 0, 1.0], [0, 6.0, 0], [0, 0, 8.338272]]])
+@pytest.mark.parametrize('cut', [{}, dict(range_cut=(5, 20)), dict(cut_vacuum=True)])
+def test_isosurface_lobes_of_all_replicas(pov_scenes, cut, cell, instanced_supercell):
+    # the grid of a cell with tilted in-plane vectors is not cropped by the cuts,
+    # so the replicas along z are drawn as instances
+    atoms, grid = _charged_slab(cell)
+    render_image(atoms, 'scene.png', CustomSettings(), supercell=[2, 2, 2],
+                 instanced_supercell=instanced_supercell, chg_grid=grid, chg_iso_threshold=0.3,
+                 **cut)
+
+    assert _isosurface_lobes(pov_scenes[0]) == 8
+
+
+def _reference_prepare_atoms(atoms, supercell=None, repeat_slab=False, wrap=False,
+                             range_cut=None, cut_vacuum=False, transl_vector=None,
+                             mol_indices=None):
+    """Structure transformations on Atoms objects, with Atoms.repeat and deletions."""
+
+    atoms = atoms.copy()
+    if transl_vector is not None:
+        atoms.translate(transl_vector)
+        wrap = True
+    if wrap:
+        atoms.wrap(pretty_translation=True)
+
+    if supercell is not None:
+        if repeat_slab and mol_indices is not None:
+            mol_mask = np.isin(np.arange(len(atoms)), mol_indices)
+            slab = atoms[~mol_mask].repeat(supercell)
+            mol_indices = list(range(len(slab), len(slab) + mol_mask.sum()))
+            atoms = slab + atoms[mol_mask]
+        else:
+            if mol_indices is not None:
+                mol_indices = [i + j * len(atoms) for i in mol_indices
+                               for j in range(np.prod(supercell))]
+            atoms = atoms.repeat(supercell)
+
+    if cut_vacuum:
+        atoms.translate([0, 0, -atoms.positions[:, 2].min()])
+        atoms.cell[2, 2] = atoms.positions[:, 2].max() + 1
+        atoms.pbc = [True, True, False]
+
+    if range_cut is not None:
+        z = atoms.positions[:, 2]
+        keep = (z >= range_cut[0]) & (z <= range_cut[1])
+        if mol_indices is not None:
+            new_indices = np.cumsum(keep) - 1
+            mol_indices = [new_indices[i] for i in mol_indices if keep[i]]
+        del atoms[np.flatnonzero(~keep)]
+        atoms.translate([0, 0, -range_cut[0]])
+        atoms.cell[2, 2] = range_cut[1] - range_cut[0]
+        atoms.pbc = [True, True, False]
+
+    return atoms, mol_indices
+
+
+def _slab_with_molecule():
+    from ase.build import fcc111, molecule, add_adsorbate # pylint: disable=import-outside-toplevel
+    slab = fcc111('Pt', size=(3, 3, 4), vacuum=6.0)
+    add_adsorbate(slab, molecule('CH3OH'), 2.0, 'ontop')
+    slab.positions[0] += [0, 0, -0.3] # an atom outside the cell after wrap with translation
+    return slab, list(range(36, len(slab)))
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(supercell=[2, 3, 1]),
+    dict(supercell=[2, 2, 2], mol_indices=True),
+    dict(supercell=[2, 2, 1], range_cut=(7.0, 14.0), mol_indices=True),
+    dict(supercell=[3, 2, 1], repeat_slab=True, mol_indices=True),
+    dict(supercell=[2, 2, 1], repeat_slab=True, range_cut=(9.0, 30.0), mol_indices=True),
+    dict(supercell=[2, 1, 1], cut_vacuum=True, range_cut=(1.0, 9.0), mol_indices=True),
+    dict(transl_vector=[0.5, 0.5, 1.0], supercell=[2, 2, 1], range_cut=(8.0, 20.0),
+         mol_indices=True),
+    dict(wrap=True, cut_vacuum=True),
+])
+def test_prepare_atoms_matches_atoms_operations(kwargs):
+    atoms, mol_indices = _slab_with_molecule()
+    if kwargs.pop('mol_indices', False):
+        kwargs['mol_indices'] = mol_indices
+
+    prepared, prepared_mol, instances, _ = _prepare_atoms(atoms, CustomSettings(), **kwargs)
+    reference, reference_mol = _reference_prepare_atoms(atoms, **kwargs)
+
+    assert instances is None
+    np.testing.assert_array_equal(prepared.numbers, reference.numbers)
+    np.testing.assert_allclose(prepared.positions, reference.positions, atol=1e-10)
+    np.testing.assert_allclose(prepared.cell.array, reference.cell.array, atol=1e-10)
+    np.testing.assert_array_equal(prepared.pbc, reference.pbc)
+    if reference_mol is None:
+        assert prepared_mol is None
+    else:
+        assert sorted(prepared_mol) == sorted(int(i) for i in reference_mol)
+        assert len(prepared_mol) > 0
+
+
+def _slab_trajectory(nframes=60, seed=0):
+    """Frames of a Pt(111) slab with small displacements, and of an adsorbed
+    CO monolayer moving down into the top layer of the slab."""
+
+    from ase.build import fcc111, add_adsorbate # pylint: disable=import-outside-toplevel
+    slab = fcc111('Pt', size=(3, 3, 4), vacuum=6.0)
+    for position in ([0, 0], [2.77, 0], [0, 2.4], [2.77, 2.4]):
+        add_adsorbate(slab, 'C', 2.0, tuple(position))
+        add_adsorbate(slab, 'O', 3.15, tuple(position))
+    adsorbate = slab.numbers != 78
+    rng = np.random.default_rng(seed)
+    for step in range(nframes):
+        atoms = slab.copy()
+        atoms.positions += rng.normal(scale=0.03, size=atoms.positions.shape)
+        atoms.positions[adsorbate, 2] -= 2.2 * step / nframes
+        yield atoms
+
+
+def test_slab_height_cache_matches_fresh_search():
+    cache = SlabHeightCache()
+    for atoms in _slab_trajectory():
+        cached = _calculate_ground_fog_height(atoms, slab_height_cache=cache)
+        assert cached == _calculate_ground_fog_height(atoms)
+    assert cache.n_reuses > 0
+    assert cache.n_searches > 1
+
+
+_VECTOR = r'<\s*(\S+),\s*(\S+),\s*(\S+)>'
+_TEXTURE = r'texture\{pigment ?\{color (.+?) transmit (\S+)\} finish\{(\w+)\}\}'
+
+
+def _scene_primitives(scene) -> tuple:
+    """
+    Spheres and bond cylinders drawn by a povray scene, with the declared textures and
+    spheres of compact scenes, and the instances of the unit cell, expanded.
+
+    Returns
+    -------
+    spheres : list
+        (center, radius, texture) of each sphere.
+    cylinders : list
+        (start, end, texture) of each bond cylinder, in the order of the scene.
+    """
+
+    textures = {}
+    spheres = {}
+    primitives = ([], [])
+    unit_cell = None
+    translations = []
+    current = primitives
+
+    def vector(groups):
+        return np.array([float(x) for x in groups])
+
+    for line in scene.read_text().splitlines():
+        if match := re.fullmatch(rf'#declare (T\d+) = {_TEXTURE}', line):
+            textures[match[1]] = match.groups()[1:]
+        elif match := re.fullmatch(r'#declare (S\d+) = sphere\{<0,0,0>, (\S+) texture\{(T\d+)\}\}',
+                                   line):
+            spheres[match[1]] = (float(match[2]), textures[match[3]])
+        elif line == '#declare UnitCell = union {':
+            unit_cell = current = ([], [])
+        elif line == '}' and current is unit_cell:
+            current = primitives
+        elif match := re.fullmatch(rf'object\{{UnitCell translate {_VECTOR}\}}', line):
+            translations.append(vector(match.groups()))
+        elif match := re.fullmatch(rf'object\{{(S\d+) translate {_VECTOR}\}}', line):
+            radius, texture = spheres[match[1]]
+            current[0].append((vector(match.groups()[1:]), radius, texture))
+        elif match := re.fullmatch(rf'atom\({_VECTOR}, (\S+), (.+), (\S+), (\w+)\) // #\d+', line):
+            current[0].append((vector(match.groups()[:3]), float(match[4]), match.groups()[4:]))
+        elif match := re.fullmatch(rf'cylinder \{{{_VECTOR}, {_VECTOR}, Rbond texture\{{(T\d+)\}}\}}',
+                                   line):
+            current[1].append((vector(match.groups()[:3]), vector(match.groups()[3:6]),
+                               textures[match[7]]))
+        elif match := re.fullmatch(rf'cylinder \{{{_VECTOR}, {_VECTOR}, Rbond {_TEXTURE}\}}', line):
+            current[1].append((vector(match.groups()[:3]), vector(match.groups()[3:6]),
+                               match.groups()[6:]))
+
+    spheres, cylinders = primitives
+    if unit_cell is not None:
+        for translation in translations:
+            spheres += [(center + translation, radius, texture)
+                        for center, radius, texture in unit_cell[0]]
+            cylinders += [(start + translation, end + translation, texture)
+                          for start, end, texture in unit_cell[1]]
+    return spheres, cylinders
+
+
+def _merged_bonds(cylinders) -> list:
+    """
+    Half-bond cylinders of a scene that is not compact, with the two halves of each bond
+    (consecutive, meeting at the same point, with the same texture) merged into one
+    cylinder, as in a compact scene.
+    """
+
+    merged = []
+    for (start_a, mid_a, texture_a), (start_b, mid_b, texture_b) in zip(cylinders[0::2],
+                                                                        cylinders[1::2]):
+        if texture_a == texture_b and np.array_equal(mid_a, mid_b):
+            merged.append((start_a, start_b, texture_a))
+        else:
+            merged += [(start_a, mid_a, texture_a), (start_b, mid_b, texture_b)]
+    return merged
+
+
+def _assert_same_primitives(primitives, reference, undirected=False, tol=0.02):
+    """
+    Check that the two lists of primitives, as (points..., texture), are the same up to
+    order and to tol (the rounding of the coordinates of the scenes, also of the
+    translations of the instances). With undirected, the two points can be swapped.
+    """
+
+    from scipy.spatial import cKDTree # pylint: disable=import-outside-toplevel
+
+    assert len(primitives) == len(reference)
+
+    def by_texture(items):
+        groups = {}
+        for *points, texture in items:
+            groups.setdefault(texture, []).append(np.hstack(points))
+        return {texture: np.array(rows) for texture, rows in groups.items()}
+
+    groups = by_texture(primitives)
+    reference_groups = by_texture(reference)
+    assert groups.keys() == reference_groups.keys()
+    for texture, rows in groups.items():
+        reference_rows = reference_groups[texture]
+        assert len(rows) == len(reference_rows)
+        ids = np.arange(len(reference_rows))
+        if undirected:
+            swapped = np.hstack([reference_rows[:, 3:], reference_rows[:, :3]])
+            reference_rows = np.concatenate([reference_rows, swapped])
+            ids = np.concatenate([ids, ids])
+        tree = cKDTree(reference_rows)
+        used = np.zeros(len(ids), dtype=bool)
+        for row in rows:
+            candidates = [ids[i] for i in tree.query_ball_point(row, tol, p=np.inf)
+                          if not used[ids[i]]]
+            assert candidates, f'unmatched primitive {row} {texture}'
+            used[candidates[0]] = True
+
+
+def _slab_with_multiple_bonds():
+    from ase.build import fcc111, molecule, add_adsorbate # pylint: disable=import-outside-toplevel
+    slab = fcc111('Cu', size=(2, 2, 3), vacuum=6.0)
+    add_adsorbate(slab, molecule('HCN'), 2.0, 'ontop')
+    add_adsorbate(slab, molecule('CO'), 2.0, 'fcc')
+    return slab, list(range(12, len(slab)))
+
+
+_SCENE_OPTIONS = [
+    dict(supercell=[2, 2, 1]),
+    dict(supercell=[2, 1, 2]),
+    dict(supercell=[2, 2, 1], bonds='multiple'),
+    dict(supercell=[2, 1, 2], bonds='multiple', colorcode='coordnum'),
+    dict(supercell=[3, 2, 1], repeat_slab=True, bonds='multiple'),
+    dict(supercell=[2, 2, 2], repeat_slab=True, colorcode='coordnum', highlight_mol=True),
+]
+
+
+def _render_scene(pov_scenes, **kwargs):
+    atoms, mol_indices = _slab_with_multiple_bonds()
+    render_image(atoms, 'scene.png', CustomSettings(), mol_indices=mol_indices, **kwargs)
+    return _scene_primitives(pov_scenes[-1])
+
+
+@pytest.mark.parametrize('instanced_supercell', [False, True])
+@pytest.mark.parametrize('kwargs', _SCENE_OPTIONS)
+def test_compact_scene_same_primitives(pov_scenes, kwargs, instanced_supercell):
+    spheres, cylinders = _render_scene(pov_scenes, instanced_supercell=instanced_supercell,
+                                       **kwargs)
+    compact_spheres, compact_cylinders = _render_scene(pov_scenes, compact_pov=True,
+                                                       instanced_supercell=instanced_supercell,
+                                                       **kwargs)
+
+    _assert_same_primitives(compact_spheres, spheres)
+    merged = _merged_bonds(cylinders)
+    # some halves were merged
+    assert len(merged) < len(cylinders)
+    _assert_same_primitives(compact_cylinders, merged, undirected=True)
+
+
+
+@pytest.mark.parametrize('kwargs', _SCENE_OPTIONS)
+def test_instanced_supercell_same_primitives(pov_scenes, kwargs):
+    spheres, cylinders = _render_scene(pov_scenes, **kwargs)
+    instanced_spheres, instanced_cylinders = _render_scene(pov_scenes, instanced_supercell=True,
+                                                           **kwargs)
+    # with repeat_slab, the coordination numbers of the slab replicas are different
+    instanced = not (kwargs.get('repeat_slab') and kwargs.get('colorcode') == 'coordnum')
+    assert ('#declare UnitCell' in pov_scenes[-1].read_text()) == instanced
+
+    _assert_same_primitives(instanced_spheres, spheres)
+    _assert_same_primitives(instanced_cylinders, cylinders)
+
+
+def _moving_molecule(nframes=6):
+    """Frames of a CO molecule moving across the cell (inside it) and down towards a slab."""
+
+    from ase.build import fcc111, molecule, add_adsorbate # pylint: disable=import-outside-toplevel
+    frames = []
+    for i in range(nframes):
+        slab = fcc111('Cu', size=(3, 3, 2), vacuum=6.0)
+        add_adsorbate(slab, molecule('CO'), 5.0 - 0.7 * i, 'ontop',
+                      offset=(0.3 * i, 0.2 * i))
+        frames.append(slab)
+    return frames
+
+
+def _assert_scene_in_view(scene, spheres=True):
+    """
+    The atoms (the whole spheres, or only the centers) and the cell of the scene
+    are inside the canvas, and behind the camera.
+    """
+
+    text = scene.read_text()
+    width, height = (float(x) for x in re.search(r'right -(\S+)\*x up (\S+)\*y', text).groups())
+    camera_z = float(re.search(r'location <0,0,(\S+)>', text)[1])
+    atoms = np.array([[float(x) for x in match.groups()] for match in
+                      re.finditer(rf'atom\({_VECTOR}, (\S+),', text)])
+    corners = np.array([[float(x) for x in match.groups()] for match in
+                        re.finditer(rf'cylinder {{{_VECTOR}, {_VECTOR}, Rcell', text)]).reshape(-1, 3)
+
+    positions, radii = atoms[:, :3], atoms[:, 3]
+    margins = radii if spheres else 0
+    assert np.all(np.abs(positions[:, 0]) + margins <= width / 2)
+    assert np.all(np.abs(positions[:, 1]) + margins <= height / 2)
+    assert np.all(positions[:, 2] + radii < camera_z)
+    assert np.all(np.abs(corners[:, 0]) <= width / 2 + 1e-2)
+    assert np.all(np.abs(corners[:, 1]) <= height / 2 + 1e-2)
+    assert np.all(corners[:, 2] < camera_z)
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(supercell=[2, 1, 1])])
+@pytest.mark.parametrize('fit_to', ['cell', 'all'])
+def test_fixed_view_contains_all_frames(pov_scenes, fit_to, kwargs):
+    frames = _moving_molecule()
+    custom_settings = CustomSettings()
+    view = get_fixed_view(iter(frames), custom_settings, fit_to=fit_to, **kwargs)
+
+    for i, atoms in enumerate(frames):
+        render_image(atoms, f'frame_{i}.png', custom_settings, fixed_bounds=True,
+                     fixed_view=view, **kwargs)
+        # fitted to the cell, the atoms in the cell are in view, but not their whole spheres
+        _assert_scene_in_view(pov_scenes[-1], spheres=fit_to == 'all')
+
+
+def _reference_custom_labels(atoms) -> list:
+    """Custom labels built atom by atom, as before the labels table."""
+
+    if not atoms.get_tags().any():
+        return atoms.get_chemical_symbols()
+    return [symbol if tag == -1 else f'{symbol}{tag}'
+            for symbol, tag in zip(atoms.get_chemical_symbols(), atoms.get_tags())]
+
+
+def _reference_colors(atoms, custom_settings, mol_indices=None) -> np.ndarray:
+    """Colors of the atoms assigned atom by atom, as before the vectorized lookup."""
+
+    colors = [custom_settings.color_scheme[atom.number] for atom in atoms]
+    if isinstance(atoms, AtomsCustom):
+        species = _reference_custom_labels(atoms)
+    else:
+        species = atoms.get_chemical_symbols()
+
+    for i, sp in enumerate(species):
+        if mol_indices is not None and i in mol_indices:
+            if sp in custom_settings.molecule_colors:
+                colors[i] = custom_settings.molecule_colors[sp]
+                continue
+        if sp in custom_settings.atomic_colors:
+            colors[i] = custom_settings.atomic_colors[sp]
+    return np.array(colors, dtype=float)
+
+
+def _tagged_slab(tags):
+    slab, mol_indices = _slab_with_molecule()
+    atoms = AtomsCustom(slab)
+    atoms.set_tags(tags(len(atoms)))
+    return atoms, mol_indices
+
+
+@pytest.mark.parametrize('tags', [
+    lambda n: np.zeros(n, dtype=int),
+    lambda n: np.arange(n) % 4 - 1, # -1 (no label), 0, 1, 2
+    lambda n: np.where(np.arange(n) % 3 == 0, -1, 7),
+])
+def test_custom_labels_table(tags):
+    atoms, _ = _tagged_slab(tags)
+    assert atoms.custom_labels == _reference_custom_labels(atoms)
+
+
+@pytest.mark.parametrize('custom', [False, True])
+@pytest.mark.parametrize('with_molecule', [False, True])
+@pytest.mark.parametrize('tags', [
+    lambda n: np.zeros(n, dtype=int),
+    lambda n: np.arange(n) % 4 - 1,
+])
+def test_colors_match_per_atom_reference(tags, with_molecule, custom):
+    atoms, mol_indices = _tagged_slab(tags)
+    if not custom:
+        atoms = Atoms(atoms)
+    mol_indices = mol_indices if with_molecule else None
+
+    custom_settings = CustomSettings()
+    # labelled and plain species, for the atoms of the slab and of the molecule
+    custom_settings.atomic_colors = {'Pt': [0.1, 0.2, 0.3], 'Pt1': [0.4, 0.5, 0.6],
+                                     'C0': [0.7, 0.8, 0.9], 'H': [0.9, 0.1, 0.1],
+                                     'O2': [0.2, 0.9, 0.2]}
+    custom_settings.molecule_colors = {'C': [0.0, 0.0, 1.0], 'C0': [0.3, 0.3, 0.3],
+                                       'H2': [1.0, 1.0, 0.0], 'O': [0.0, 1.0, 1.0],
+                                       'Pt0': [0.5, 0.0, 0.5]}
+
+    colors = _get_colors(atoms, custom_settings, mol_indices)
+    np.testing.assert_array_equal(colors, _reference_colors(atoms, custom_settings, mol_indices))
+    # the overrides are actually applied
+    assert not np.array_equal(colors, custom_settings.color_scheme[atoms.numbers])
@@ -0,0 +1,115 @@
+'''
+Tests of the volumetric readers against the ase ones, on small generated files.
+'''
+
+import numpy as np
+import pytest
+from ase import Atoms
+from ase.calculators.vasp import VaspChargeDensity
+from ase.io import read
+from ase.io.cube import write_cube
+from ase.units import Bohr
+
+from atomsplot.functions import _read_charge_file
+from atomsplot.volumetric import read_vasp_volumetric, read_cube_volumetric
+
+
+def _atoms():
+    return Atoms('H2O', positions=[[1.0, 1.2, 1.5], [2.3, 1.1, 1.6], [1.6, 1.9, 2.2]],
+                 cell=[[4.0, 0, 0], [0.5, 4.5, 0], [0, 0.3, 5.0]], pbc=True)
+
+
+def _grids(shape=(6, 7, 5), seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(scale=10.0, size=shape), rng.normal(scale=0.1, size=shape)
+
+
+def _assert_same_atoms(atoms, reference):
+    np.testing.assert_array_equal(atoms.numbers, reference.numbers)
+    np.testing.assert_array_equal(atoms.positions, reference.positions)
+    np.testing.assert_array_equal(atoms.cell.array, reference.cell.array)
+    np.testing.assert_array_equal(atoms.pbc, reference.pbc)
+
+
+@pytest.fixture(params=['CHGCAR', 'CHG'])
+def vasp_file(request, tmp_path):
+    """Spin-polarized CHGCAR (with augmentation occupancies) or CHG file."""
+
+    chg, chgdiff = _grids()
+    vcd = VaspChargeDensity(None)
+    vcd.atoms = [_atoms()]
+    vcd.chg = [chg]
+    vcd.chgdiff = [chgdiff]
+    if request.param == 'CHGCAR':
+        vcd.aug = 'augmentation occupancies   1   2\n  0.1 0.2\n' * 3
+        vcd.augdiff = vcd.aug
+    path = tmp_path / request.param
+    vcd.write(str(path), format=request.param.lower())
+    return path
+
+
+def test_read_vasp_total_density(vasp_file):
+    reference = VaspChargeDensity(str(vasp_file))
+    atoms, grid = _read_charge_file(str(vasp_file), fmt='vasp')
+
+    _assert_same_atoms(atoms, reference.atoms[0])
+    # as in the previous reader, based on VaspChargeDensity
+    np.testing.assert_array_equal(grid, np.array(reference.chg[0]) * Bohr**3)
+
+
+def test_read_vasp_spin_block(vasp_file):
+    reference = VaspChargeDensity(str(vasp_file))
+    if not reference.chgdiff:
+        pytest.skip('no magnetization in the file')
+    atoms, grid = read_vasp_volumetric(str(vasp_file), block=1)
+
+    grid /= atoms.get_volume()
+    np.testing.assert_array_equal(grid, reference.chgdiff[0])
+
+
+def test_read_vasp_missing_block(vasp_file):
+    with pytest.raises(ValueError):
+        read_vasp_volumetric(str(vasp_file), block=3)
+
+
+def test_read_vasp_irregular_lines(tmp_path):
+    chg, _ = _grids()
+    vcd = VaspChargeDensity(None)
+    vcd.atoms = [_atoms()]
+    vcd.chg = [chg]
+    path = tmp_path / 'CHGCAR'
+    vcd.write(str(path), format='chgcar')
+
+    # rewrite the grid with numbers of different widths, 5 values per line as in VASP
+    lines = path.read_text().splitlines(keepends=True)
+    start = next(i for i, line in enumerate(lines) if line.split() == ['6', '7', '5']) + 1
+    values = ' '.join(lines[start:]).split()
+    values = [value if i % 3 else repr(float(value)) for i, value in enumerate(values)]
+    rewritten = [' '.join(values[i:i + 5]) + '\n' for i in range(0, len(values), 5)]
+    path.write_text(''.join(lines[:start] + rewritten))
+
+    reference = VaspChargeDensity(str(path))
+    atoms, grid = read_vasp_volumetric(str(path))
+    grid /= atoms.get_volume()
+    np.testing.assert_array_equal(grid, reference.chg[0])
+
+
+def test_read_vasp_single_precision(vasp_file):
+    reference = VaspChargeDensity(str(vasp_file))
+    _, grid = _read_charge_file(str(vasp_file), fmt='vasp', single_precision=True)
+
+    assert grid.dtype == np.float32
+    np.testing.assert_allclose(grid, np.array(reference.chg[0]) * Bohr**3, rtol=1e-6)
+
+
+def test_read_cube(tmp_path):
+    chg, _ = _grids()
+    path = tmp_path / 'density.cube'
+    with open(path, 'w') as f:
+        write_cube(f, _atoms(), data=chg)
+
+    reference = read(str(path), read_data=True, full_output=True)
+    atoms, grid = read_cube_volumetric(str(path))
+
+    _assert_same_atoms(atoms, reference['atoms'])
+    np.testing.assert_array_equal(grid, reference['data'])